@@ -18,6 +18,10 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 # Load task modules from all registered Django apps.
 app.autodiscover_tasks()
 
+# Connect the worker lifecycle hooks that load the anomaly classifier
+# only in workers consuming the inference queues.
+import logs.worker  # noqa: E402,F401
+
 # Optional configuration for monitoring
 app.conf.update(
     task_track_started=True,
@@ -144,6 +144,18 @@ CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_RESULT_BACKEND = 'django-db'
 CELERY_CACHE_BACKEND = 'django-cache'
 
+# 'default' is private to each process; 'shared' lives on the broker's Redis
+# server (database 1) and is seen by the web and worker processes alike
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://localhost:6379/1',
+    },
+}
+
 # Celery Task Settings
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
@@ -156,18 +168,208 @@ CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
 # Task routing
 CELERY_TASK_ROUTES = {
     'logs.tasks.analyze_log_async': {'queue': 'analysis'},
+    'logs.tasks.analyze_log_batch': {'queue': 'analysis'},
     'logs.tasks.send_notification_async': {'queue': 'notifications'},
     'logs.tasks.process_log_batch': {'queue': 'batch_processing'},
     'logs.tasks.detect_anomaly_patterns': {'queue': 'analysis'},
     'logs.tasks.send_pattern_alert': {'queue': 'notifications'},
     'logs.tasks.real_time_anomaly_stream': {'queue': 'real_time'},
     'logs.tasks.cleanup_old_results': {'queue': 'maintenance'},
+    'logs.tasks.get_inference_stats': {'queue': 'analysis'},
+    'logs.tasks.embed_log_entries': {'queue': 'analysis'},
 }
 
 # Worker settings
 CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+# Pool children load and warm the classifier up before they report in
+# (ANOMALY_MODEL_WARMUP_ON_BOOT), which takes longer than Celery's default
+# 4 seconds
+CELERY_WORKER_PROC_ALIVE_TIMEOUT = 300
 CELERY_TASK_ACKS_LATE = True
 
+# Anomaly classifier
+ANOMALY_MODEL_NAME = 'bert-base-uncased'
+ANOMALY_MODEL_NUM_LABELS = 2
+# Directory of versioned models (one save_pretrained directory per version,
+# plus a CURRENT pointer), e.g. BASE_DIR / 'models'. When set, workers load
+# the CURRENT version instead of ANOMALY_MODEL_NAME and switch versions
+# without a restart with: python manage.py reload_model <version>
+ANOMALY_MODEL_ROOT = None
+# Seconds between checks for a requested model version in each inference process
+ANOMALY_MODEL_RELOAD_POLL = 1.0
+# Versions are filled with: python manage.py fetch_model <version> --activate
+# and always load without the hub. Check their files against MANIFEST.json
+# before loading (reads the weights once, which also warms the page cache).
+ANOMALY_MODEL_VERIFY_CHECKSUMS = True
+# Also load ANOMALY_MODEL_NAME from the local Hugging Face cache only
+ANOMALY_MODEL_OFFLINE = False
+# Workers consuming any of these queues load and warm up the classifier on boot;
+# every other process loads it lazily on first use (if ever)
+ANOMALY_INFERENCE_QUEUES = ['analysis', 'real_time']
+ANOMALY_MODEL_WARMUP_ON_BOOT = True
+# Warm-up batch run by each inference process before it takes tasks (None
+# for a built-in pair of messages); compiled backends need a few rounds
+ANOMALY_WARMUP_MESSAGES = None
+ANOMALY_WARMUP_ROUNDS = 3
+# Inference workers publish their readiness in this cache, which the web
+# processes must share; /api/health/ ignores entries not refreshed within
+# ANOMALY_READINESS_MAX_AGE seconds (keep it above ANOMALY_READINESS_REFRESH)
+ANOMALY_READINESS_CACHE_ALIAS = 'shared'
+ANOMALY_READINESS_REFRESH = 5
+ANOMALY_READINESS_MAX_AGE = 60
+# Split an inference worker's cores between pool processes and torch
+# threads: 'split' (equal share per process), 'per_process' (one intra-op
+# thread each) or 'fixed' (ANOMALY_TORCH_INTRA_OP_THREADS each).
+# ANOMALY_CPU_RESERVE cores are left for the worker parent and the OS.
+ANOMALY_THREAD_BUDGET_ENABLED = True
+ANOMALY_THREAD_POLICY = 'split'
+ANOMALY_CPU_RESERVE = 0
+ANOMALY_TORCH_INTRA_OP_THREADS = 1
+ANOMALY_TORCH_INTEROP_THREADS = 1
+# Load the model once in the prefork worker's main process, before the pool
+# forks, so children share its weight pages copy-on-write. With
+# ANOMALY_MODEL_MMAP_WEIGHTS the fp32 weights are also backed by a
+# memory-mapped safetensors file in ANOMALY_COMPILED_CACHE_DIR.
+# Check the savings with: python manage.py inference_memory <worker pid>
+ANOMALY_MODEL_PRELOAD_IN_PARENT = False
+ANOMALY_MODEL_MMAP_WEIGHTS = False
+# Node-local inference server (python manage.py run_inference_server). When
+# set, workers send BERT requests over this Unix socket instead of loading
+# the model, and fall back to in-process inference if the server does not
+# answer within ANOMALY_INFERENCE_SOCKET_TIMEOUT seconds (unless
+# ANOMALY_INFERENCE_SOCKET_FALLBACK is False).
+ANOMALY_INFERENCE_SOCKET = None
+ANOMALY_INFERENCE_SOCKET_TIMEOUT = 5.0
+ANOMALY_INFERENCE_SOCKET_FALLBACK = True
+# 'fp32', 'int8' for dynamically quantized linear layers on CPU workers, or
+# 'bf16' for CPU autocast on the eager backend (check parity first with:
+# python manage.py benchmark_inference --modes fp32,int8,bf16)
+ANOMALY_INFERENCE_PRECISION = 'fp32'
+# 'bf16' falls back to fp32 on CPUs without native bf16 (AVX512-BF16/AMX),
+# where PyTorch emulates it slowly; set True to force it anyway
+ANOMALY_BF16_ALLOW_EMULATED = False
+# Forward-pass backend: 'eager' (default), 'torchscript', 'compile', or 'onnx'
+# (needs onnxruntime). Traced/exported graphs are cached in
+# ANOMALY_COMPILED_CACHE_DIR so worker restarts reuse them.
+ANOMALY_INFERENCE_BACKEND = 'eager'
+ANOMALY_COMPILED_CACHE_DIR = BASE_DIR / 'model_cache'
+# Logits are divided by this temperature before the softmax so the stored
+# anomaly probabilities are calibrated (fit it with:
+# python manage.py benchmark_inference --calibrate). Entries whose
+# probability reaches ANOMALY_ALERT_THRESHOLD get an AnomalyReport; the
+# dashboard and GraphQL queries accept their own threshold.
+ANOMALY_CALIBRATION_TEMPERATURE = 1.0
+ANOMALY_ALERT_THRESHOLD = 0.5
+
+# Early exit: linear heads on intermediate encoder layers let confident
+# messages skip the remaining layers (train them with
+# python manage.py train_exit_heads). A message exits at the first head whose
+# top class probability reaches its severity's threshold; above 1 it never
+# exits. Needs the eager backend. Versioned models (ANOMALY_MODEL_ROOT) use
+# the exit_heads.npz in their own directory; ANOMALY_EARLY_EXIT_HEADS is for
+# unversioned models only.
+ANOMALY_EARLY_EXIT_HEADS = None  # e.g. BASE_DIR / 'model_cache' / 'exit_heads.npz'
+ANOMALY_EARLY_EXIT_LAYERS = [3, 6, 9]
+ANOMALY_EARLY_EXIT_THRESHOLDS = {
+    'DEBUG': 0.9,
+    'INFO': 0.9,
+    'WARNING': 0.97,
+    'ERROR': 1.01,
+    'CRITICAL': 1.01,
+}
+ANOMALY_EARLY_EXIT_DEFAULT_THRESHOLD = 0.95
+
+# Micro-batching: concurrent analysis requests in a worker process share one
+# forward pass, flushed at ANOMALY_BATCH_MAX_SIZE messages or once the oldest
+# request has waited ANOMALY_BATCH_MAX_WAIT_MS (at once when no other caller
+# is in flight)
+ANOMALY_BATCHING_ENABLED = True
+ANOMALY_BATCH_MAX_SIZE = 16
+ANOMALY_BATCH_MAX_WAIT_MS = 10
+# Sort each batch by tokenized length and run it as sub-batches of
+# ANOMALY_BUCKET_SIZE messages to cut padding waste
+ANOMALY_LENGTH_BUCKETING = True
+ANOMALY_BUCKET_SIZE = 8
+
+# Token budget per message (special tokens included), per severity with
+# ANOMALY_TOKEN_BUDGET as the fallback. Messages over budget are cut by
+# ANOMALY_TRUNCATION_POLICY: 'head', 'head_tail' (keeps the exception at the
+# bottom of a stack trace) or 'template' (collapses repeated lines and frames
+# first). Compare them with: python manage.py benchmark_truncation
+ANOMALY_TRUNCATION_POLICY = 'head'
+ANOMALY_TOKEN_BUDGET = 512
+ANOMALY_TOKEN_BUDGETS = {}
+ANOMALY_TRUNCATION_HEAD_FRACTION = 0.5
+
+# Verdict cache keyed by message template (IDs, numbers, IPs... masked).
+# Set ANOMALY_VERDICT_CACHE_ALIAS to a CACHES alias (e.g. a Redis cache) to
+# share verdicts across worker processes.
+ANOMALY_VERDICT_CACHE_ENABLED = True
+ANOMALY_VERDICT_CACHE_SIZE = 10000
+ANOMALY_VERDICT_CACHE_TTL = 3600
+ANOMALY_VERDICT_CACHE_ALIAS = None
+
+# Bulk ingestion (POST /api/logs/bulk/): at most ANOMALY_BULK_MAX_ITEMS
+# entries per JSON array, inserted ANOMALY_BULK_INSERT_CHUNK rows per
+# bulk_create and analyzed ANOMALY_BULK_ANALYSIS_CHUNK entries per task.
+# NDJSON bodies are streamed ANOMALY_BULK_STREAM_CHUNK_BYTES at a time with
+# no entry limit; their response lists the first
+# ANOMALY_BULK_MAX_REPORTED_ERRORS rejected lines. A signed NDJSON body is
+# copied aside and verified before anything is stored, so it is capped at
+# ANOMALY_BULK_SIGNED_MAX_BYTES.
+ANOMALY_BULK_MAX_ITEMS = 10000
+ANOMALY_BULK_INSERT_CHUNK = 1000
+ANOMALY_BULK_ANALYSIS_CHUNK = 500
+ANOMALY_BULK_STREAM_CHUNK_BYTES = 65536
+ANOMALY_BULK_STREAM_MAX_LINE_BYTES = 2**20
+ANOMALY_BULK_MAX_REPORTED_ERRORS = 100
+ANOMALY_BULK_SIGNED_MAX_BYTES = 256 * 2**20
+
+# Write-behind ingestion: when enabled, POST /api/logs/ and the bulk
+# endpoints append accepted entries to segment files in
+# ANOMALY_INGEST_BUFFER_DIR and answer 202 at once; `python manage.py
+# run_ingest_flusher` inserts them every ANOMALY_INGEST_FLUSH_INTERVAL
+# seconds, one transaction per segment. Segments are sealed at
+# ANOMALY_INGEST_SEGMENT_BYTES. Keep ANOMALY_INGEST_FSYNC on unless losing the
+# last appends on a power cut is acceptable.
+ANOMALY_INGEST_WRITE_BEHIND = False
+ANOMALY_INGEST_BUFFER_DIR = BASE_DIR / 'ingest_buffer'
+ANOMALY_INGEST_SEGMENT_BYTES = 16 * 2**20
+ANOMALY_INGEST_FSYNC = True
+ANOMALY_INGEST_FLUSH_INTERVAL = 1.0
+
+# Operator rules (LogRule, edited in the admin) decide matching messages
+# before the verdict cache and the classifiers. Each process checks the rule
+# table for changes and saves hit counts every ANOMALY_RULES_REFRESH_SECONDS;
+# a search running past ANOMALY_RULES_TIMEOUT seconds counts as no match.
+ANOMALY_RULES_ENABLED = True
+ANOMALY_RULES_REFRESH_SECONDS = 5.0
+ANOMALY_RULES_TIMEOUT = 0.05
+
+# Tier-0 cascade: a hashed-feature linear scorer decides messages scoring
+# outside ANOMALY_TIER0_BAND; only the uncertain ones go to BERT.
+# Train the weights with: python manage.py train_tier0
+ANOMALY_TIER0_ENABLED = True
+ANOMALY_TIER0_WEIGHTS = BASE_DIR / 'model_cache' / 'tier0.npz'
+ANOMALY_TIER0_BAND = (0.05, 0.95)
+
+# Drain template mining: analyzed entries get an integer LogTemplate ID
+ANOMALY_TEMPLATE_MINING_ENABLED = True
+ANOMALY_TEMPLATE_DEPTH = 4
+ANOMALY_TEMPLATE_SIMILARITY = 0.4
+ANOMALY_TEMPLATE_MAX_CHILDREN = 100
+
+# Similar-log search: analyzed entries get their pooled BERT embedding stored
+# as float16 (one extra encoder pass per entry, run as a separate task on the
+# analysis queue). Searches score ANOMALY_EMBEDDING_BLOCK_ROWS rows per
+# matmul, and switch to IVF lists (sqrt(n) of them, ANOMALY_EMBEDDING_IVF_NPROBE
+# scored per query) from ANOMALY_EMBEDDING_IVF_MIN_ROWS embeddings on.
+ANOMALY_EMBEDDINGS_ENABLED = False
+ANOMALY_EMBEDDING_BLOCK_ROWS = 65536
+ANOMALY_EMBEDDING_IVF_MIN_ROWS = 50000
+ANOMALY_EMBEDDING_IVF_NPROBE = 8
+ANOMALY_SIMILAR_LOGS_MAX = 100
+
 # GraphQL Configuration
 GRAPHENE = {
     'SCHEMA': 'logs.schema.schema',
@@ -2,25 +2,26 @@ from django.contrib import admin
 from django.utils.html import format_html
 from django.urls import reverse
 from django.utils.safestring import mark_safe
-from .models import LogEntry, AnomalyReport
+from .models import LogEntry, AnomalyReport, LogRule, LogTemplate
 
 
 @admin.register(LogEntry)
 class LogEntryAdmin(admin.ModelAdmin):
     """Admin interface for LogEntry model"""
 
-    list_display = ['id', 'timestamp', 'severity', 'colored_severity', 'truncated_message', 'has_anomaly']
-    list_filter = ['severity', 'timestamp']
+    list_display = ['id', 'timestamp', 'severity', 'colored_severity', 'truncated_message', 'anomaly_probability', 'has_anomaly']
+    list_filter = ['severity', 'timestamp', 'model_version']
     search_fields = ['message', 'severity']
-    readonly_fields = ['id', 'timestamp']
+    readonly_fields = ['id', 'timestamp', 'anomaly_probability', 'model_version']
     ordering = ['-timestamp']
     list_per_page = 50
 
     fieldsets = (
         ('Log Information', {
-            'fields': ('id', 'timestamp', 'severity', 'message')
+            'fields': ('id', 'timestamp', 'severity', 'message', 'template', 'anomaly_probability', 'model_version')
         }),
     )
+    raw_id_fields = ['template']
 
     def colored_severity(self, obj):
         """Display severity with color coding"""
@@ -142,6 +143,35 @@ class AnomalyReportAdmin(admin.ModelAdmin):
     log_entry_details.short_description = 'Log Entry Details'
 
 
+@admin.register(LogTemplate)
+class LogTemplateAdmin(admin.ModelAdmin):
+    """Admin interface for mined LogTemplate model"""
+
+    list_display = ['id', 'template', 'count', 'first_seen', 'last_seen']
+    search_fields = ['template']
+    readonly_fields = ['id', 'template', 'signature', 'token_count', 'count', 'first_seen', 'last_seen']
+    ordering = ['-count']
+    list_per_page = 50
+
+
+@admin.register(LogRule)
+class LogRuleAdmin(admin.ModelAdmin):
+    """Admin interface for the LogRule signatures deciding messages before the classifier"""
+
+    list_display = ['id', 'name', 'pattern', 'verdict', 'enabled', 'hit_count', 'last_hit']
+    list_editable = ['enabled']
+    list_filter = ['verdict', 'enabled']
+    search_fields = ['name', 'pattern']
+    readonly_fields = ['hit_count', 'last_hit', 'updated_at']
+    ordering = ['name']
+    list_per_page = 50
+    actions = ['reset_hits']
+
+    @admin.action(description='Reset hit counts')
+    def reset_hits(self, request, queryset):
+        queryset.update(hit_count=0, last_hit=None)
+
+
 # Customize admin site headers
 admin.site.site_header = "Anomaly Detection System Admin"
 admin.site.site_title = "Anomaly Detection Admin"
@@ -0,0 +1,212 @@
+"""
+Execution backends for the anomaly classifier's forward pass.
+
+A backend turns tokenized inputs into logits. ``eager`` calls the
+Hugging Face model directly (the default). The other backends run a
+compiled or traced graph of the same model, and cache the artifact under
+``ANOMALY_COMPILED_CACHE_DIR`` so worker restarts do not rebuild it:
+
+- ``torchscript``: ``torch.jit.trace`` graph saved as a ``.pt`` file
+- ``compile``: ``torch.compile`` with the Inductor cache kept on disk
+- ``onnx``: exported ONNX graph run by ``onnxruntime`` (when installed)
+
+Artifacts are keyed by the weights they were built from and written to a
+temporary file that is renamed into place, so a worker never loads a stale
+graph after a fine-tune or a half-written one after a crash.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('eager', 'torchscript', 'compile', 'onnx')
+
+INPUT_NAMES = ['input_ids', 'attention_mask', 'token_type_ids']
+
+
+def _logits_module(model):
+    import torch
+
+    class LogitsModule(torch.nn.Module):
+        """Positional-argument wrapper returning only the logits tensor."""
+
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            return self.model(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                token_type_ids=token_type_ids,
+            ).logits
+
+    return LogitsModule(model).eval()
+
+
+def _example_inputs(tokenizer):
+    encoded = tokenizer(
+        ['Example log message for graph capture', 'Short one'],
+        return_tensors='pt', padding=True, truncation=True, max_length=512,
+    )
+    return tuple(encoded[name] for name in INPUT_NAMES)
+
+
+def weights_fingerprint(model_name: str, model=None) -> str:
+    """
+    Identify the weights a model was loaded from.
+
+    Uses the checksum in a versioned model's manifest, else the size and
+    mtime of a local directory's weight files, else the hub commit the
+    model resolved to.
+    """
+    from .model_versions import MANIFEST_FILE, WEIGHTS_FILE
+
+    directory = Path(model_name)
+    if directory.is_dir():
+        try:
+            return json.loads((directory / MANIFEST_FILE).read_text())['files'][WEIGHTS_FILE]['sha256'][:12]
+        except (OSError, ValueError, KeyError):
+            pass
+        digest = hashlib.sha1()
+        for path in sorted(directory.glob('*.safetensors')) + sorted(directory.glob('*.bin')):
+            stat = path.stat()
+            digest.update(f'{path.name}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+        return digest.hexdigest()[:12]
+    commit = getattr(getattr(model, 'config', None), '_commit_hash', None)
+    return commit[:12] if commit else 'unpinned'
+
+
+def cache_key(model_name: str, precision: str, weights: str = '') -> str:
+    """Return a file-name-safe key identifying a compiled artifact."""
+    import torch
+
+    name = re.sub(r'[^A-Za-z0-9_.-]+', '_', str(model_name))
+    weights = f'-{weights}' if weights else ''
+    return f'{name}{weights}-{precision}-torch{torch.__version__}'
+
+
+def _tmp_path(path: Path) -> Path:
+    # Same directory, so os.replace is an atomic rename
+    return path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+
+
+class EagerBackend:
+    """Runs the Hugging Face model directly."""
+
+    name = 'eager'
+
+    def __init__(self, model, tokenizer=None, cache_dir=None, key=None):
+        self.model = model
+
+    def __call__(self, inputs):
+        return self.model(**inputs).logits
+
+
+class TorchScriptBackend:
+    """Runs a ``torch.jit.trace`` graph, loaded from disk when cached."""
+
+    name = 'torchscript'
+
+    def __init__(self, model, tokenizer, cache_dir, key):
+        import torch
+
+        path = Path(cache_dir) / f'{key}.pt'
+        if path.exists():
+            logger.info(f"Loading cached TorchScript classifier from {path}")
+            self.module = torch.jit.load(str(path))
+        else:
+            logger.info(f"Tracing classifier to TorchScript, caching at {path}")
+            with torch.no_grad():
+                traced = torch.jit.trace(_logits_module(model), _example_inputs(tokenizer), strict=False)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = _tmp_path(path)
+            try:
+                torch.jit.save(traced, str(tmp_path))
+                os.replace(tmp_path, path)
+            finally:
+                tmp_path.unlink(missing_ok=True)
+            self.module = traced
+        self.module = torch.jit.optimize_for_inference(torch.jit.freeze(self.module.eval()))
+
+    def __call__(self, inputs):
+        return self.module(*(inputs[name] for name in INPUT_NAMES))
+
+
+class CompileBackend:
+    """Runs ``torch.compile``; Inductor artifacts are cached on disk."""
+
+    name = 'compile'
+
+    def __init__(self, model, tokenizer, cache_dir, key):
+        import torch
+
+        # Read by Inductor when it first compiles, so it must be set before
+        os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', str(Path(cache_dir) / 'inductor'))
+        self.module = torch.compile(_logits_module(model), dynamic=True)
+
+    def __call__(self, inputs):
+        return self.module(*(inputs[name] for name in INPUT_NAMES))
+
+
+class OnnxBackend:
+    """Runs an exported ONNX graph with onnxruntime."""
+
+    name = 'onnx'
+
+    def __init__(self, model, tokenizer, cache_dir, key):
+        import onnxruntime
+        import torch
+
+        path = Path(cache_dir) / f'{key}.onnx'
+        if not path.exists():
+            logger.info(f"Exporting classifier to ONNX at {path}")
+            path.parent.mkdir(parents=True, exist_ok=True)
+            dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in INPUT_NAMES}
+            dynamic_axes['logits'] = {0: 'batch'}
+            tmp_path = _tmp_path(path)
+            try:
+                with torch.no_grad():
+                    torch.onnx.export(
+                        _logits_module(model), _example_inputs(tokenizer), str(tmp_path),
+                        input_names=INPUT_NAMES, output_names=['logits'],
+                        dynamic_axes=dynamic_axes, opset_version=17,
+                    )
+                os.replace(tmp_path, path)
+            finally:
+                tmp_path.unlink(missing_ok=True)
+        self.session = onnxruntime.InferenceSession(str(path), providers=['CPUExecutionProvider'])
+
+    def __call__(self, inputs):
+        import torch
+
+        feeds = {name: inputs[name].numpy() for name in INPUT_NAMES}
+        return torch.from_numpy(self.session.run(['logits'], feeds)[0])
+
+
+_BACKEND_CLASSES = {
+    'eager': EagerBackend,
+    'torchscript': TorchScriptBackend,
+    'compile': CompileBackend,
+    'onnx': OnnxBackend,
+}
+
+
+def build_backend(name: str, model, tokenizer, cache_dir, key):
+    """
+    Build the named backend, falling back to eager execution if it cannot
+    be built (missing runtime, unsupported operator, ...).
+    """
+    if name not in _BACKEND_CLASSES:
+        raise ValueError(f"Unknown inference backend '{name}', expected one of {BACKENDS}")
+    if name == 'eager':
+        return EagerBackend(model)
+    try:
+        return _BACKEND_CLASSES[name](model, tokenizer, cache_dir, key)
+    except Exception as exc:
+        logger.warning(f"Inference backend '{name}' unavailable, using eager execution: {str(exc)}")
+        return EagerBackend(model)
@@ -0,0 +1,335 @@
+"""
+Throughput, memory and parity benchmarks for the anomaly classifier.
+
+Every inference mode runs over the same message corpus, each in a fresh
+process so its memory figures are its own. The first mode is the reference:
+the others report how often their verdicts agree with it and, when the
+corpus file is labelled, their accuracy against the labels. Driven by
+``python manage.py benchmark_inference``.
+"""
+import io
+import json
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import django
+import numpy as np
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+
+from .early_exit import find_exit_heads
+from .inference import predict_batch, predict_logits
+from .metrics import LATENCY_BUCKETS, Histogram
+from .model_registry import ModelRegistry, current_rss_bytes
+from .models import AnomalyReport, LogEntry
+from .truncation import TruncationPolicy, get_truncation_policy
+
+logger = logging.getLogger(__name__)
+
+# Registry options for each benchmarkable inference mode
+MODES = {
+    'fp32': {'precision': 'fp32'},
+    'int8': {'precision': 'int8'},
+    'bf16': {'precision': 'bf16'},
+    'torchscript': {'precision': 'fp32', 'backend': 'torchscript'},
+    'compile': {'precision': 'fp32', 'backend': 'compile'},
+    'onnx': {'precision': 'fp32', 'backend': 'onnx'},
+    # Heads shipped with the model, or ANOMALY_EARLY_EXIT_HEADS (see ``train_exit_heads``)
+    'early_exit': {'precision': 'fp32', 'early_exit': True},
+}
+
+
+def load_corpus(path: Optional[str] = None, limit: int = 500, with_severities: bool = False,
+                report_labels: bool = False) -> Tuple:
+    """
+    Load the benchmark messages and, when available, their labels.
+
+    Args:
+        path (str): File with one message per line, or one JSON object per
+            line with ``message`` and optional ``label`` keys. When omitted,
+            the most recent LogEntry rows are used, unlabelled.
+        limit (int): Maximum number of messages
+        with_severities (bool): Also return each message's severity (from
+            the ``severity`` key of JSON lines)
+        report_labels (bool): Label LogEntry rows 1 when they have an
+            AnomalyReport. Those are the classifier's own verdicts, so they
+            can be distilled from but say nothing about its accuracy.
+
+    Returns:
+        tuple: ``(messages, labels)``, plus ``severities`` when requested;
+        ``labels`` is None for unlabelled corpora
+    """
+    messages, labels, severities = [], [], []
+
+    if path:
+        with open(path, encoding='utf-8') as corpus:
+            for line in corpus:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    record = line
+                if isinstance(record, dict):
+                    messages.append(record.get('message', ''))
+                    labels.append(record.get('label'))
+                    severities.append(record.get('severity'))
+                else:
+                    messages.append(line)
+                    labels.append(None)
+                    severities.append(None)
+                if len(messages) >= limit:
+                    break
+    else:
+        entries = LogEntry.objects.annotate(
+            has_anomaly=Exists(AnomalyReport.objects.filter(log_entry=OuterRef('pk')))
+        ).order_by('-timestamp')[:limit]
+        for entry in entries:
+            messages.append(entry.message)
+            labels.append(int(entry.has_anomaly) if report_labels else None)
+            severities.append(entry.severity)
+
+    if any(label is None for label in labels):
+        labels = None
+    if with_severities:
+        return messages, labels, severities
+    return messages, labels
+
+
+def model_size_bytes(model) -> int:
+    """Return the serialized size of a model's state dict."""
+    import torch
+
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def run_mode(mode: str, model_name: str, messages: List[str], batch_size: int = 16,
+             repeats: int = 1, severities: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Load the classifier in one inference mode and time it over the corpus.
+
+    Returns:
+        dict: Timings, memory figures and the predictions of the last repeat
+    """
+    # Imported before the first RSS reading, so the delta is the model's own
+    import torch  # noqa: F401
+
+    options = dict(MODES[mode])
+    if options.pop('early_exit', False):
+        heads = find_exit_heads(model_name, versioned=False)
+        if not heads:
+            raise ValueError("The 'early_exit' mode needs heads in the model directory or ANOMALY_EARLY_EXIT_HEADS")
+        options['exit_heads'] = heads
+    registry = ModelRegistry(
+        model_name, cache_dir=settings.ANOMALY_COMPILED_CACHE_DIR,
+        allow_emulated_bf16=getattr(settings, 'ANOMALY_BF16_ALLOW_EMULATED', False), **options
+    )
+    severities = severities or [None] * len(messages)
+    rss_before = current_rss_bytes()
+    _, model = registry.get()
+    rss_after_load = current_rss_bytes()
+
+    # Untimed warm-up pass
+    predict_batch(messages[:batch_size], severities[:batch_size], registry=registry)
+    registry.exit_stats = {'messages': 0, 'layers': 0, 'exits': {}}
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        predictions = []
+        for offset in range(0, len(messages), batch_size):
+            predictions.extend(predict_batch(
+                messages[offset:offset + batch_size], severities[offset:offset + batch_size], registry=registry
+            ))
+    elapsed = time.perf_counter() - start
+
+    result = {
+        'mode': mode,
+        'backend': registry.stats()['backend'],
+        # Differs from the mode's precision when bf16 fell back to fp32
+        'precision': registry.precision,
+        'messages': len(messages) * repeats,
+        'seconds': elapsed,
+        'throughput': len(messages) * repeats / elapsed if elapsed else None,
+        'load_time': registry.stats()['load_time'],
+        'model_bytes': model_size_bytes(model),
+        'rss_delta_bytes': rss_after_load - rss_before,
+        # Encoder layers each message ran through, on average
+        'avg_layers': registry.stats()['avg_layers'] or model.config.num_hidden_layers,
+        'exits': dict(sorted(registry.exit_stats['exits'].items())),
+        'predictions': predictions,
+    }
+    registry.unload()
+    return result
+
+
+def compare(reference: List[float], predictions: List[float], labels: Optional[List[int]] = None,
+            threshold: float = 0.5) -> Dict[str, Any]:
+    """
+    Compare a mode's verdicts (probabilities cut at ``threshold``) with the
+    reference mode and the labels.
+    """
+    drift = max((abs(r - p) for r, p in zip(reference, predictions)), default=None)
+    reference = [int(probability >= threshold) for probability in reference]
+    predictions = [int(probability >= threshold) for probability in predictions]
+    agreement = sum(r == p for r, p in zip(reference, predictions)) / len(reference) if reference else None
+    accuracy = None
+    if labels:
+        accuracy = sum(label == p for label, p in zip(labels, predictions)) / len(labels)
+    return {'agreement': agreement, 'accuracy': accuracy, 'max_probability_drift': drift}
+
+
+def fit_temperature(logits: np.ndarray, labels: List[int],
+                    candidates: Optional[List[float]] = None) -> Tuple[float, float]:
+    """
+    Pick the softmax temperature that minimizes the negative log-likelihood
+    of the labels.
+
+    Args:
+        logits (np.ndarray): ``(n, num_labels)`` logits, the last column
+            being the anomaly class
+        labels (List[int]): 1 for anomalous messages, 0 otherwise
+        candidates (List[float]): Temperatures to try
+
+    Returns:
+        tuple: ``(temperature, nll)``
+    """
+    candidates = candidates or [round(0.25 + 0.05 * step, 2) for step in range(96)]
+    targets = np.asarray(labels, dtype=bool)
+    # Margin of the anomaly logit over the other classes
+    margins = logits[:, -1] - np.logaddexp.reduce(logits[:, :-1], axis=-1)
+    losses = []
+    for temperature in candidates:
+        signed = np.where(targets, margins, -margins) / temperature
+        losses.append((float(np.mean(np.logaddexp(0.0, -signed))), temperature))
+    nll, temperature = min(losses)
+    return temperature, nll
+
+
+def calibrate(model_name: str, messages: List[str], labels: List[int], batch_size: int = 16) -> Dict[str, Any]:
+    """
+    Fit ANOMALY_CALIBRATION_TEMPERATURE on a labelled corpus.
+
+    Returns:
+        dict: The fitted temperature and the NLL before and after scaling
+    """
+    registry = ModelRegistry(model_name, cache_dir=settings.ANOMALY_COMPILED_CACHE_DIR)
+    logits = np.concatenate([
+        predict_logits(messages[offset:offset + batch_size], registry=registry).numpy()
+        for offset in range(0, len(messages), batch_size)
+    ])
+    registry.unload()
+
+    _, nll_before = fit_temperature(logits, labels, candidates=[1.0])
+    temperature, nll_after = fit_temperature(logits, labels)
+    return {'temperature': temperature, 'nll_before': nll_before, 'nll_after': nll_after}
+
+
+def run_mode_isolated(mode: str, model_name: str, messages: List[str], **options) -> Dict[str, Any]:
+    """
+    ``run_mode`` in a freshly spawned process.
+
+    Modes run one after the other in the same process would share the heap
+    and the allocator's cached pages of the modes before them, which makes
+    their ``rss_delta_bytes`` meaningless.
+    """
+    # A spawned process starts bare, so it sets Django up before importing this module
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=django.setup) as executor:
+        return executor.submit(run_mode, mode, model_name, messages, **options).result()
+
+
+def benchmark_modes(modes: List[str], model_name: str, messages: List[str],
+                    labels: Optional[List[int]] = None, batch_size: int = 16,
+                    repeats: int = 1, severities: Optional[List[str]] = None,
+                    isolated: bool = True) -> List[Dict[str, Any]]:
+    """
+    Run every mode over the same corpus and compare each against the first.
+
+    Args:
+        isolated (bool): Run each mode in its own process (see
+            ``run_mode_isolated``)
+
+    Returns:
+        List[dict]: One report per mode, without the raw predictions
+    """
+    reports = []
+    reference_predictions = None
+    reference = None
+    run = run_mode_isolated if isolated else run_mode
+    for mode in modes:
+        logger.info(f"Benchmarking '{mode}' inference on {len(messages)} messages")
+        result = run(mode, model_name, messages, batch_size=batch_size, repeats=repeats, severities=severities)
+        predictions = result.pop('predictions')
+        if reference is None:
+            reference, reference_predictions = result, predictions
+        result.update(compare(reference_predictions, predictions, labels))
+        result['speedup'] = result['throughput'] / reference['throughput'] if reference['throughput'] else None
+        result['model_size_ratio'] = result['model_bytes'] / reference['model_bytes']
+        reports.append(result)
+    return reports
+
+
+def benchmark_truncation(policies: List[str], model_name: str, messages: List[str],
+                         severities: Optional[List[str]] = None, labels: Optional[List[int]] = None,
+                         batch_size: int = 16) -> List[Dict[str, Any]]:
+    """
+    Time each truncation policy over the same corpus, with the configured
+    token budgets, against a reference run that keeps the first 512 tokens
+    of every message.
+
+    Returns:
+        List[dict]: One report per policy, the reference first
+    """
+    configured = get_truncation_policy()
+    runs = [('reference', TruncationPolicy('head'))] + [
+        (policy, TruncationPolicy(policy, configured.budgets, configured.default_budget, configured.head_fraction))
+        for policy in policies
+    ]
+    severities = severities or [None] * len(messages)
+    registry = ModelRegistry(model_name, cache_dir=settings.ANOMALY_COMPILED_CACHE_DIR)
+    tokenizer, _ = registry.get()
+
+    # Untimed warm-up pass
+    predict_batch(messages[:batch_size], severities[:batch_size], registry=registry)
+
+    reports = []
+    reference = None
+    for name, truncation in runs:
+        logger.info(f"Benchmarking '{name}' truncation on {len(messages)} messages")
+        latency = Histogram(f'truncation.{name}', LATENCY_BUCKETS)
+        predictions = []
+        tokens = 0
+        elapsed = 0.0
+        for offset in range(0, len(messages), batch_size):
+            batch, batch_severities = messages[offset:offset + batch_size], severities[offset:offset + batch_size]
+            start = time.perf_counter()
+            predictions.extend(predict_batch(batch, batch_severities, registry=registry, truncation=truncation))
+            seconds = time.perf_counter() - start
+            latency.observe(seconds)
+            elapsed += seconds
+            tokens += sum(len(ids) for ids in truncation.encode(tokenizer, batch, batch_severities)['input_ids'])
+
+        if reference is None:
+            reference = predictions
+        snapshot = latency.snapshot()
+        result = {
+            'policy': name,
+            'messages': len(messages),
+            'seconds': elapsed,
+            'throughput': len(messages) / elapsed if elapsed else None,
+            'batch_p50_seconds': snapshot['p50'],
+            'batch_p99_seconds': snapshot['p99'],
+            'batch_max_seconds': snapshot['max'],
+            'mean_tokens': tokens / len(messages) if messages else 0,
+        }
+        result.update(compare(reference, predictions, labels))
+        reports.append(result)
+
+    registry.unload()
+    return reports
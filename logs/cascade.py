@@ -0,0 +1,171 @@
+"""
+Tier-0 pre-scorer for the anomaly classifier cascade.
+
+A NumPy logistic-regression model scores feature-hashed message tokens
+(plus bigrams and the severity) in microseconds. Messages it scores below
+or above ``ANOMALY_TIER0_BAND`` are decided at tier 0. Only the uncertain
+ones in between go on to BERT (tier 1).
+
+Weights are trained with ``python manage.py train_tier0`` and stored in
+``ANOMALY_TIER0_WEIGHTS``. Without a weights file every message goes to
+tier 1.
+"""
+import logging
+import re
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from . import metrics
+from .verdict_cache import normalize_message
+
+logger = logging.getLogger(__name__)
+
+TOKEN = re.compile(r'<[A-Z*]+>|[a-z0-9_]+')
+
+# Model version recorded for verdicts decided at tier 0
+TIER0_VERSION = 'tier0'
+
+
+def _hash(feature: str, dimensions: int) -> Tuple[int, float]:
+    digest = zlib.crc32(feature.encode())
+    return digest % dimensions, 1.0 if digest & 0x80000000 else -1.0
+
+
+def featurize(message: str, severity: Optional[str], dimensions: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Hash a message into sparse feature indices and signs.
+
+    Features are the normalized tokens, adjacent-token bigrams and the
+    severity, each hashed into ``dimensions`` buckets.
+    """
+    tokens = TOKEN.findall(normalize_message(message).lower())
+    features = tokens + [f'{a} {b}' for a, b in zip(tokens, tokens[1:])]
+    features.append(f'severity={(severity or "").upper()}')
+
+    hashed = [_hash(feature, dimensions) for feature in features]
+    indices = np.fromiter((index for index, _ in hashed), dtype=np.int64, count=len(hashed))
+    signs = np.fromiter((sign for _, sign in hashed), dtype=np.float32, count=len(hashed))
+    return indices, signs
+
+
+class Tier0Scorer:
+    """
+    Feature-hashed linear model producing an anomaly probability.
+
+    Args:
+        weights (np.ndarray): One weight per hashed feature bucket
+        bias (float): Intercept
+    """
+
+    def __init__(self, weights: np.ndarray, bias: float = 0.0):
+        self.weights = weights.astype(np.float32)
+        self.bias = float(bias)
+
+    @property
+    def dimensions(self) -> int:
+        return len(self.weights)
+
+    def score(self, messages: Sequence[str], severities: Optional[Sequence[str]] = None) -> np.ndarray:
+        """Return the anomaly probability of each message."""
+        severities = severities or [None] * len(messages)
+        logits = np.empty(len(messages), dtype=np.float32)
+        for row, (message, severity) in enumerate(zip(messages, severities)):
+            indices, signs = featurize(message, severity, self.dimensions)
+            logits[row] = self.weights[indices] @ signs + self.bias
+        return 1.0 / (1.0 + np.exp(-logits))
+
+    @classmethod
+    def fit(cls, messages: Sequence[str], labels: Sequence[int], severities: Optional[Sequence[str]] = None,
+            dimensions: int = 2 ** 18, epochs: int = 5, learning_rate: float = 0.1,
+            l2: float = 1e-6, seed: int = 0) -> 'Tier0Scorer':
+        """
+        Train with stochastic gradient descent on the logistic loss.
+        """
+        severities = severities or [None] * len(messages)
+        rows = [featurize(message, severity, dimensions) for message, severity in zip(messages, severities)]
+        targets = np.asarray(labels, dtype=np.float32)
+        weights = np.zeros(dimensions, dtype=np.float32)
+        bias = 0.0
+        rng = np.random.default_rng(seed)
+
+        for _ in range(epochs):
+            for row in rng.permutation(len(rows)):
+                indices, signs = rows[row]
+                logit = weights[indices] @ signs + bias
+                error = 1.0 / (1.0 + np.exp(-logit)) - targets[row]
+                np.add.at(weights, indices, -learning_rate * (error * signs + l2 * weights[indices]))
+                bias -= learning_rate * error
+        return cls(weights, bias)
+
+    def save(self, path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(path, weights=self.weights, bias=np.float32(self.bias))
+
+    @classmethod
+    def load(cls, path) -> 'Tier0Scorer':
+        with np.load(path) as data:
+            return cls(data['weights'], float(data['bias']))
+
+
+def split_by_confidence(probabilities: np.ndarray, low: float, high: float):
+    """
+    Split tier-0 probabilities into confident verdicts and uncertain indices.
+
+    Returns:
+        tuple: ``(decided, uncertain)``; ``decided`` maps index to the tier-0
+        anomaly probability, ``uncertain`` lists the indices that need tier 1
+    """
+    decided, uncertain = {}, []
+    for index, probability in enumerate(probabilities):
+        if probability <= low or probability >= high:
+            decided[index] = float(probability)
+        else:
+            uncertain.append(index)
+    return decided, uncertain
+
+
+_scorer = None
+_scorer_loaded = False
+_scorer_lock = threading.Lock()
+
+
+def get_tier0_scorer() -> Optional[Tier0Scorer]:
+    """Return the process-wide tier-0 scorer, or None when it is not trained."""
+    global _scorer, _scorer_loaded
+    if not _scorer_loaded:
+        with _scorer_lock:
+            if not _scorer_loaded:
+                path = getattr(settings, 'ANOMALY_TIER0_WEIGHTS', None)
+                if path and Path(path).exists():
+                    _scorer = Tier0Scorer.load(path)
+                    logger.info(f"Loaded tier-0 scorer from {path}")
+                else:
+                    logger.info("No tier-0 weights found, every message goes to the BERT tier")
+                _scorer_loaded = True
+    return _scorer
+
+
+def run_tier0(messages: List[str], severities: Optional[List[str]] = None):
+    """
+    Decide the confident messages at tier 0.
+
+    Returns:
+        tuple: ``(decided, uncertain)`` as for ``split_by_confidence``
+    """
+    scorer = get_tier0_scorer() if getattr(settings, 'ANOMALY_TIER0_ENABLED', True) else None
+    if scorer is None or not messages:
+        return {}, list(range(len(messages)))
+
+    start = time.perf_counter()
+    low, high = getattr(settings, 'ANOMALY_TIER0_BAND', (0.05, 0.95))
+    decided, uncertain = split_by_confidence(scorer.score(messages, severities), low, high)
+    metrics.histogram('cascade.tier0_seconds').observe(time.perf_counter() - start)
+    metrics.counter('cascade.tier0_decided').inc(len(decided))
+    metrics.counter('cascade.tier0_deferred').inc(len(uncertain))
+    return decided, uncertain
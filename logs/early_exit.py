@@ -0,0 +1,258 @@
+"""
+Early-exit inference for the anomaly classifier.
+
+Small linear heads read the ``[CLS]`` hidden state after some intermediate
+encoder layers (``ANOMALY_EARLY_EXIT_LAYERS``). The encoder runs layer by
+layer, and a message leaves as soon as a head's top class probability
+reaches the threshold of its severity (``ANOMALY_EARLY_EXIT_THRESHOLDS``).
+The remaining messages carry on through the next layers, so confident
+batches shrink as they go. Messages no head is sure about get the full
+model's classifier.
+
+Heads are distilled from the full model with
+``python manage.py train_exit_heads`` and stored as NumPy arrays next to the
+weights they were distilled from, as ``exit_heads.npz`` in the model
+version's directory (``ANOMALY_EARLY_EXIT_HEADS`` for unversioned models).
+Each head has its own softmax temperature, fitted so its probabilities match
+the full model's calibrated ones. Severities without a threshold use
+``ANOMALY_EARLY_EXIT_DEFAULT_THRESHOLD``; a threshold above 1 never exits.
+"""
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ExitHeads:
+    """
+    Linear classifier heads over the ``[CLS]`` state of intermediate layers.
+
+    Args:
+        heads (dict): Maps a 1-based layer number to ``(weight, bias)``,
+            a ``(hidden, num_labels)`` matrix and a ``(num_labels,)`` vector
+        temperatures (dict): Layer -> softmax temperature calibrating that
+            head, 1.0 when missing
+    """
+
+    def __init__(self, heads: Dict[int, Tuple[np.ndarray, np.ndarray]],
+                 temperatures: Optional[Dict[int, float]] = None):
+        self.heads = {int(layer): (np.asarray(weight, np.float32), np.asarray(bias, np.float32))
+                      for layer, (weight, bias) in heads.items()}
+        temperatures = {int(layer): float(value) for layer, value in (temperatures or {}).items()}
+        self.temperatures = {layer: temperatures.get(layer, 1.0) for layer in self.heads}
+        self._torch_heads = None
+
+    @property
+    def layers(self) -> List[int]:
+        return sorted(self.heads)
+
+    def save(self, path: str):
+        arrays = {}
+        for layer, (weight, bias) in self.heads.items():
+            arrays[f'weight_{layer}'] = weight
+            arrays[f'bias_{layer}'] = bias
+            arrays[f'temperature_{layer}'] = np.float32(self.temperatures[layer])
+        np.savez(path, layers=np.array(self.layers), **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> 'ExitHeads':
+        with np.load(path) as data:
+            return cls(
+                {int(layer): (data[f'weight_{layer}'], data[f'bias_{layer}']) for layer in data['layers']},
+                {int(layer): float(data[f'temperature_{layer}']) for layer in data['layers']
+                 if f'temperature_{layer}' in data},
+            )
+
+    def logits(self, layer: int, cls_state):
+        """Apply a layer's head to a ``(batch, hidden)`` torch tensor; the logits are calibrated."""
+        import torch
+
+        if self._torch_heads is None:
+            self._torch_heads = {
+                head_layer: (torch.from_numpy(weight), torch.from_numpy(bias))
+                for head_layer, (weight, bias) in self.heads.items()
+            }
+        weight, bias = self._torch_heads[layer]
+        return (cls_state.float() @ weight + bias) / self.temperatures[layer]
+
+
+def fit_head(features: np.ndarray, targets: np.ndarray, num_labels: int = 2, epochs: int = 200,
+             learning_rate: float = 0.5, l2: float = 1e-4) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fit a softmax-regression head by full-batch gradient descent.
+
+    Args:
+        features (np.ndarray): ``(n, hidden)`` ``[CLS]`` states of one layer
+        targets (np.ndarray): Class the full model predicts for each row
+
+    Returns:
+        tuple: ``(weight, bias)``
+    """
+    features = np.asarray(features, dtype=np.float32)
+    # Standardize so one learning rate suits every layer, then fold the
+    # scaling back into the weights
+    mean = features.mean(axis=0)
+    scale = features.std(axis=0) + 1e-6
+    standardized = (features - mean) / scale
+    onehot = np.eye(num_labels, dtype=np.float32)[np.asarray(targets)]
+
+    weight = np.zeros((features.shape[1], num_labels), dtype=np.float32)
+    bias = np.zeros(num_labels, dtype=np.float32)
+    for _ in range(epochs):
+        logits = standardized @ weight + bias
+        logits -= logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        gradient = (probabilities - onehot) / len(features)
+        weight -= learning_rate * (standardized.T @ gradient + l2 * weight)
+        bias -= learning_rate * gradient.sum(axis=0)
+
+    weight = weight / scale[:, None]
+    bias = bias - mean @ weight
+    return weight, bias
+
+
+def fit_head_temperature(logits: np.ndarray, target_probabilities: np.ndarray,
+                         candidates: Optional[List[float]] = None) -> float:
+    """
+    Pick the temperature whose softmax over a head's logits is closest (in
+    cross-entropy) to the full model's calibrated probabilities.
+
+    A head distilled from the full model's argmax is typically more or less
+    confident than the full model, so the full model's temperature does not
+    calibrate it.
+
+    Args:
+        logits (np.ndarray): ``(n, num_labels)`` head logits
+        target_probabilities (np.ndarray): ``(n, num_labels)`` calibrated
+            probabilities of the full model
+
+    Returns:
+        float: The temperature
+    """
+    candidates = candidates or [round(0.25 + 0.05 * step, 2) for step in range(96)]
+    logits = np.asarray(logits, dtype=np.float64)
+    losses = []
+    for temperature in candidates:
+        scaled = logits / temperature
+        log_probabilities = scaled - np.logaddexp.reduce(scaled, axis=-1, keepdims=True)
+        losses.append((float(-(target_probabilities * log_probabilities).sum(axis=-1).mean()), temperature))
+    return min(losses)[1]
+
+
+class EarlyExitPolicy:
+    """
+    Per-severity confidence a head needs before a message leaves the encoder.
+
+    Args:
+        thresholds (dict): Severity -> minimum top class probability
+        default_threshold (float): For severities without their own
+    """
+
+    def __init__(self, thresholds: Optional[Dict[str, float]] = None, default_threshold: float = 0.95):
+        self.thresholds = {severity.upper(): float(value) for severity, value in (thresholds or {}).items()}
+        self.default_threshold = float(default_threshold)
+
+    @property
+    def signature(self) -> str:
+        """Identifies the policy in model versions, since it changes verdicts."""
+        payload = json.dumps([self.thresholds, self.default_threshold], sort_keys=True)
+        return hashlib.sha1(payload.encode()).hexdigest()[:8]
+
+    def threshold(self, severity: Optional[str]) -> float:
+        return self.thresholds.get((severity or '').upper(), self.default_threshold)
+
+
+def get_early_exit_policy() -> EarlyExitPolicy:
+    return EarlyExitPolicy(
+        getattr(settings, 'ANOMALY_EARLY_EXIT_THRESHOLDS', {}),
+        getattr(settings, 'ANOMALY_EARLY_EXIT_DEFAULT_THRESHOLD', 0.95),
+    )
+
+
+def find_exit_heads(model_name: str, versioned: bool) -> Optional[str]:
+    """
+    Return the heads to use with a model: the ones shipped in its directory,
+    else ``ANOMALY_EARLY_EXIT_HEADS`` for unversioned models.
+
+    A versioned model without heads of its own runs without early exit, as
+    heads distilled from other weights would give wrong verdicts.
+    """
+    from .model_versions import EXIT_HEADS_FILE
+
+    shipped = Path(model_name) / EXIT_HEADS_FILE
+    if shipped.is_file():
+        return str(shipped)
+    if versioned:
+        return None
+    heads = getattr(settings, 'ANOMALY_EARLY_EXIT_HEADS', None)
+    return str(heads) if heads else None
+
+
+def load_exit_heads(path) -> Optional[ExitHeads]:
+    if path and Path(path).exists():
+        heads = ExitHeads.load(path)
+        logger.info(f"Loaded early-exit heads for layers {heads.layers} from {path}")
+        return heads
+    if path:
+        logger.warning(f"No early-exit heads at {path}, every message runs the full encoder")
+    return None
+
+
+def early_exit_logits(model, heads: ExitHeads, inputs, thresholds: Sequence[float], temperature: float = 1.0):
+    """
+    Run the encoder layer by layer, letting confident rows exit at a head.
+
+    Args:
+        model: ``BertForSequenceClassification`` in eval mode
+        heads (ExitHeads): Heads of the exit layers
+        inputs (dict): Padded tokenizer outputs
+        thresholds (Sequence[float]): Exit threshold of each row
+        temperature (float): The full model's calibration temperature; the
+            logits of rows that exit are scaled by it, so dividing every
+            row by it afterwards yields calibrated probabilities
+
+    Returns:
+        tuple: ``(logits, layers)``, the logits that decided each row and
+        the number of encoder layers it went through
+    """
+    import torch
+
+    batch_size = inputs['input_ids'].shape[0]
+    num_layers = len(model.bert.encoder.layer)
+    logits = torch.empty(batch_size, model.config.num_labels)
+    layers = [num_layers] * batch_size
+    active = torch.arange(batch_size)
+    thresholds = torch.tensor(list(thresholds), dtype=torch.float32)
+
+    bert = model.bert
+    hidden = bert.embeddings(input_ids=inputs['input_ids'], token_type_ids=inputs.get('token_type_ids'))
+    mask = inputs['attention_mask']
+    for number, layer in enumerate(bert.encoder.layer, start=1):
+        hidden = layer(hidden, attention_mask=bert.get_extended_attention_mask(mask, mask.shape))[0]
+        if number not in heads.heads or number == num_layers:
+            continue
+
+        head_logits = heads.logits(number, hidden[:, 0])
+        confidence = torch.softmax(head_logits, dim=-1).max(dim=-1).values
+        done = confidence >= thresholds[active]
+        if not done.any():
+            continue
+        logits[active[done]] = head_logits[done] * temperature
+        for row in active[done].tolist():
+            layers[row] = number
+        # Only the undecided rows go through the next layers
+        keep = (~done).nonzero(as_tuple=True)[0]
+        active, hidden, mask = active[keep], hidden[keep], mask[keep]
+        if not len(active):
+            return logits, layers
+
+    pooled = bert.pooler(hidden)
+    logits[active] = model.classifier(model.dropout(pooled)).float()
+    return logits, layers
@@ -0,0 +1,285 @@
+"""
+Embedding store and nearest-neighbour search for similar logs.
+
+With ``ANOMALY_EMBEDDINGS_ENABLED``, analyzed log entries get the pooled BERT
+embedding of their message stored in ``LogEmbedding``. Each vector is
+normalized to unit length and stored as float16 (1.5 KiB for BERT-base), so
+cosine similarity is a dot product.
+
+``EmbeddingIndex`` holds the vectors of one model version in a float16 NumPy
+matrix and answers top-k queries:
+
+- brute force: the matrix is scored in blocks of
+  ``ANOMALY_EMBEDDING_BLOCK_ROWS`` rows, each converted to float32 for the
+  matmul, so the temporary copy stays small
+- IVF: once the index holds ``ANOMALY_EMBEDDING_IVF_MIN_ROWS`` vectors, a
+  spherical k-means over a sample splits them into about sqrt(n) lists, and
+  a query only scores the ``ANOMALY_EMBEDDING_IVF_NPROBE`` lists closest to
+  it (plus the rows added since the lists were built)
+
+Vectors of different model versions are never compared.
+"""
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from . import metrics
+from .inference import run_bucketed
+from .model_registry import get_registry
+from .models import LogEmbedding, LogEntry
+
+logger = logging.getLogger(__name__)
+
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 64
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """Scale rows to unit length (zero rows stay zero)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def embed_messages(messages: List[str], severities: Optional[List[str]] = None, registry=None) -> np.ndarray:
+    """
+    Return the unit-length pooled embedding of each message as float16.
+    """
+    registry = registry or get_registry()
+    pooled = run_bucketed(messages, registry.embed, registry, severities=severities)
+    return normalize(pooled.numpy()).astype(np.float16)
+
+
+def store_embeddings(log_entries: List[LogEntry], vectors: np.ndarray, model_version: str):
+    """Save (or replace) the embeddings of analyzed log entries."""
+    now = timezone.now()
+    LogEmbedding.objects.bulk_create(
+        [
+            LogEmbedding(log_entry=log_entry, model_version=model_version, vector=vector.tobytes(), updated_at=now)
+            for log_entry, vector in zip(log_entries, vectors.astype(np.float16))
+        ],
+        update_conflicts=True,
+        unique_fields=['log_entry'],
+        update_fields=['model_version', 'vector', 'updated_at'],
+    )
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Return the positions of the k highest scores, best first."""
+    if len(scores) > k:
+        positions = np.argpartition(-scores, k - 1)[:k]
+    else:
+        positions = np.arange(len(scores))
+    return positions[np.argsort(-scores[positions], kind='stable')]
+
+
+class _IVFLists:
+    """Inverted lists over the first ``indexed`` rows of an index."""
+
+    def __init__(self, centroids: np.ndarray, order: np.ndarray, offsets: np.ndarray, indexed: int):
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.indexed = indexed
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        lists = _top_k(self.centroids @ query, nprobe)
+        return np.concatenate([self.order[self.offsets[i]:self.offsets[i + 1]] for i in lists])
+
+
+class EmbeddingIndex:
+    """
+    In-memory float16 matrix of one model version's embeddings with top-k search.
+
+    Args:
+        model_version (str): Only embeddings of this version are indexed
+        block_rows (int): Rows scored per matmul in brute-force search
+        ivf_min_rows (int): Build the IVF lists from this many vectors on
+        nprobe (int): IVF lists scored per query
+    """
+
+    def __init__(self, model_version: str, block_rows: int = 65536, ivf_min_rows: int = 50000, nprobe: int = 8):
+        self.model_version = model_version
+        self.block_rows = block_rows
+        self.ivf_min_rows = ivf_min_rows
+        self.nprobe = nprobe
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._ids = np.empty(0, dtype=np.int64)
+        self._vectors = None
+        self._size = 0
+        self._ivf = None
+        self._marker = None
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, ids: Iterable[int], vectors: np.ndarray):
+        """Append vectors; the buffers grow by doubling."""
+        ids = np.asarray(list(ids), dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float16)
+        if not len(ids):
+            return
+        needed = self._size + len(ids)
+        if self._vectors is None or needed > len(self._vectors):
+            capacity = max(needed, 2 * (len(self._vectors) if self._vectors is not None else 0), 1024)
+            grown_vectors = np.empty((capacity, vectors.shape[1]), dtype=np.float16)
+            grown_ids = np.empty(capacity, dtype=np.int64)
+            if self._vectors is not None:
+                grown_vectors[:self._size] = self._vectors[:self._size]
+                grown_ids[:self._size] = self._ids[:self._size]
+            self._vectors, self._ids = grown_vectors, grown_ids
+        self._vectors[self._size:needed] = vectors
+        self._ids[self._size:needed] = ids
+        self._size = needed
+
+        if self._size >= self.ivf_min_rows and (self._ivf is None or self._size >= 2 * self._ivf.indexed):
+            self.build_ivf()
+
+    def refresh(self):
+        """
+        Load the embeddings stored since the last refresh.
+
+        The table's row count and latest ``updated_at`` are compared with
+        the last refresh first, so an unchanged table costs one aggregate
+        query. Rows come in by increasing log entry ID. Workers can commit
+        them out of order, entries can be deleted and embeddings replaced,
+        so the index reloads in full when an indexed row was updated or its
+        size no longer matches the table.
+        """
+        with self._lock:
+            rows = LogEmbedding.objects.filter(model_version=self.model_version)
+            marker = rows.aggregate(count=Count('log_entry'), updated_at=Max('updated_at'))
+            if marker == self._marker:
+                return
+            last_id = int(self._ids[self._size - 1]) if self._size else 0
+            replaced = self._marker is not None and self._marker['updated_at'] is not None and rows.filter(
+                log_entry_id__lte=last_id, updated_at__gt=self._marker['updated_at']
+            ).exists()
+            if not replaced:
+                self._load(rows.filter(log_entry_id__gt=last_id))
+            if replaced or rows.count() != self._size:
+                logger.info(f"Reloading the {self.model_version} embedding index in full")
+                self._reset()
+                self._load(rows)
+            self._marker = marker
+
+    def _load(self, rows, chunk_size: int = 10000):
+        ids, vectors = [], []
+        for log_entry_id, vector in rows.order_by('log_entry_id').values_list('log_entry_id', 'vector').iterator(chunk_size):
+            ids.append(log_entry_id)
+            vectors.append(np.frombuffer(vector, dtype=np.float16))
+            if len(ids) == chunk_size:
+                self.add(ids, np.stack(vectors))
+                ids, vectors = [], []
+        if ids:
+            self.add(ids, np.stack(vectors))
+
+    def build_ivf(self, nlist: Optional[int] = None, seed: int = 0):
+        """Cluster the current rows into IVF lists with spherical k-means."""
+        start = time.perf_counter()
+        size = self._size
+        nlist = nlist or max(1, int(np.sqrt(size)))
+        rng = np.random.default_rng(seed)
+        sample = self._vectors[rng.choice(size, min(size, nlist * KMEANS_SAMPLE_PER_LIST), replace=False)]
+        sample = sample.astype(np.float32)
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            # Empty lists keep their previous centroid
+            filled = np.bincount(assignment, minlength=nlist) > 0
+            centroids[filled] = normalize(sums[filled])
+
+        assignment = np.concatenate([
+            np.argmax(self._vectors[offset:min(offset + self.block_rows, size)].astype(np.float32) @ centroids.T, axis=1)
+            for offset in range(0, size, self.block_rows)
+        ])
+        order = np.argsort(assignment, kind='stable')
+        offsets = np.searchsorted(assignment[order], np.arange(nlist + 1))
+        self._ivf = _IVFLists(centroids, order, offsets, size)
+        logger.info(
+            f"Built {nlist} IVF lists over {size} {self.model_version} embeddings "
+            f"in {time.perf_counter() - start:.2f}s"
+        )
+
+    def search(self, query: np.ndarray, k: int = 10, exclude: Iterable[int] = ()) -> List[Tuple[int, float]]:
+        """
+        Return the IDs and cosine similarities of the k nearest vectors.
+
+        Args:
+            query (np.ndarray): Query vector, normalized here
+            k (int): Number of neighbours
+            exclude (Iterable[int]): IDs left out of the results, e.g. the
+                query's own log entry
+        """
+        start = time.perf_counter()
+        query = normalize(query)
+        exclude = set(exclude)
+        # Scoring runs on a snapshot, outside the lock held by refreshes
+        with self._lock:
+            ids, vectors, size, ivf = self._ids, self._vectors, self._size, self._ivf
+        if not size:
+            return []
+        wanted = k + len(exclude)
+
+        if ivf is not None:
+            rows = np.concatenate([ivf.candidates(query, self.nprobe), np.arange(ivf.indexed, size)])
+            scores = vectors[rows].astype(np.float32) @ query
+            top = _top_k(scores, wanted)
+            best, best_scores = rows[top], scores[top]
+        else:
+            best, best_scores = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            for offset in range(0, size, self.block_rows):
+                scores = vectors[offset:min(offset + self.block_rows, size)].astype(np.float32) @ query
+                top = _top_k(scores, wanted)
+                best = np.concatenate([best, top + offset])
+                best_scores = np.concatenate([best_scores, scores[top]])
+            order = _top_k(best_scores, wanted)
+            best, best_scores = best[order], best_scores[order]
+
+        metrics.histogram('embeddings.search_seconds').observe(time.perf_counter() - start)
+        results = [(int(ids[row]), float(score)) for row, score in zip(best, best_scores) if int(ids[row]) not in exclude]
+        return results[:k]
+
+
+_indexes: Dict[str, EmbeddingIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(model_version: str) -> EmbeddingIndex:
+    """Return this process's index of one model version's embeddings."""
+    with _indexes_lock:
+        if model_version not in _indexes:
+            _indexes[model_version] = EmbeddingIndex(
+                model_version,
+                block_rows=getattr(settings, 'ANOMALY_EMBEDDING_BLOCK_ROWS', 65536),
+                ivf_min_rows=getattr(settings, 'ANOMALY_EMBEDDING_IVF_MIN_ROWS', 50000),
+                nprobe=getattr(settings, 'ANOMALY_EMBEDDING_IVF_NPROBE', 8),
+            )
+        return _indexes[model_version]
+
+
+def similar_logs(log_entry_id: int, limit: int = 10) -> List[Tuple[LogEntry, float]]:
+    """
+    Return the log entries most similar to a given one, with their cosine
+    similarity, most similar first.
+
+    Raises:
+        LogEmbedding.DoesNotExist: The entry has no stored embedding
+    """
+    embedding = LogEmbedding.objects.get(log_entry_id=log_entry_id)
+    index = get_index(embedding.model_version)
+    index.refresh()
+    matches = index.search(np.frombuffer(embedding.vector, dtype=np.float16), limit, exclude=[log_entry_id])
+    entries = LogEntry.objects.in_bulk([match_id for match_id, _ in matches])
+    return [(entries[match_id], similarity) for match_id, similarity in matches if match_id in entries]
@@ -0,0 +1,329 @@
+"""
+Batched inference for the BERT anomaly classifier.
+
+``BatchingEngine`` collects concurrent analysis requests from one process
+into padded batches. A batch is flushed when it reaches
+``ANOMALY_BATCH_MAX_SIZE`` messages or when its oldest request has waited
+``ANOMALY_BATCH_MAX_WAIT_MS``. Each caller gets back a future for its own
+message.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Tuple
+
+from django.conf import settings
+
+from . import metrics
+from .model_registry import get_registry
+from .truncation import get_truncation_policy
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128]
+PADDING_RATIO_BUCKETS = [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]
+
+_STOP = object()
+
+
+def plan_buckets(lengths: List[int], bucket_size: int) -> List[List[int]]:
+    """
+    Group message indices into sub-batches of similar tokenized length.
+
+    Args:
+        lengths (List[int]): Tokenized length of each message
+        bucket_size (int): Maximum number of messages per sub-batch
+
+    Returns:
+        List[List[int]]: Message indices per sub-batch, shortest first
+    """
+    order = sorted(range(len(lengths)), key=lambda index: lengths[index])
+    return [order[start:start + bucket_size] for start in range(0, len(order), bucket_size)]
+
+
+def padding_ratio(lengths: List[int]) -> float:
+    """Return the fraction of padding tokens when these lengths are padded together."""
+    if not lengths:
+        return 0.0
+    padded = max(lengths) * len(lengths)
+    return (padded - sum(lengths)) / padded
+
+
+def run_bucketed(messages: List[str], forward: Callable, registry=None,
+                 severities: Optional[List[str]] = None, truncation=None, pass_rows: bool = False):
+    """
+    Tokenize messages and run ``forward`` over them in padded sub-batches.
+
+    Messages are tokenized once without padding, each within the token
+    budget of its severity (see ``logs.truncation``). With
+    ``ANOMALY_LENGTH_BUCKETING`` they are sorted by token count and split
+    into sub-batches of ``ANOMALY_BUCKET_SIZE`` so short messages are not
+    padded up to the longest one; results come back in input order.
+
+    Args:
+        messages (List[str]): Log messages
+        forward (Callable): Maps padded inputs to one row per message
+        registry (ModelRegistry): Registry holding the tokenizer, defaults
+            to the process-wide one
+        severities (List[str]): Severity of each message, selects its budget
+        truncation (TruncationPolicy): Defaults to the configured policy
+        pass_rows (bool): Also pass ``forward`` the input positions of the
+            sub-batch's messages
+
+    Returns:
+        torch.Tensor: One row per message, in input order
+    """
+    import torch
+
+    registry = registry or get_registry()
+    tokenizer, _ = registry.get()
+    encodings = (truncation or get_truncation_policy()).encode(tokenizer, messages, severities)
+    lengths = [len(input_ids) for input_ids in encodings['input_ids']]
+
+    if getattr(settings, 'ANOMALY_LENGTH_BUCKETING', True):
+        groups = plan_buckets(lengths, getattr(settings, 'ANOMALY_BUCKET_SIZE', 8))
+    else:
+        groups = [list(range(len(messages)))]
+
+    padding = metrics.histogram('inference.padding_ratio', PADDING_RATIO_BUCKETS)
+    rows = [None] * len(messages)
+    for group in groups:
+        padding.observe(padding_ratio([lengths[index] for index in group]))
+        inputs = tokenizer.pad(
+            {key: [values[index] for index in group] for key, values in encodings.items()},
+            return_tensors='pt',
+        )
+
+        with torch.no_grad():
+            outputs = (forward(inputs, group) if pass_rows else forward(inputs)).float()
+
+        for index, row in zip(group, outputs):
+            rows[index] = row
+
+    return torch.stack(rows)
+
+
+def predict_logits(messages: List[str], registry=None, severities: Optional[List[str]] = None,
+                   truncation=None):
+    """
+    Run the classifier over a list of log messages and return its logits.
+
+    Returns:
+        torch.Tensor: ``(len(messages), num_labels)`` logits, in input order
+    """
+    registry = registry or get_registry()
+    if registry.early_exit is None:
+        return run_bucketed(messages, registry.forward, registry, severities=severities, truncation=truncation)
+
+    # Each message leaves the encoder once a head reaches its severity's threshold
+    thresholds = [registry.early_exit.threshold(severity) for severity in severities or [None] * len(messages)]
+    return run_bucketed(
+        messages,
+        lambda inputs, rows: registry.forward_early_exit(inputs, [thresholds[row] for row in rows]),
+        registry,
+        severities=severities,
+        truncation=truncation,
+        pass_rows=True,
+    )
+
+
+def anomaly_probabilities(logits, temperature: float = 1.0) -> List[float]:
+    """
+    Return the softmax probability of the anomaly class (the last label),
+    with the logits divided by a calibration temperature.
+    """
+    import torch
+
+    return torch.softmax(logits / temperature, dim=-1)[:, -1].tolist()
+
+
+def predict_batch(messages: List[str], severities: Optional[List[str]] = None, registry=None,
+                  truncation=None) -> List[float]:
+    """
+    Return the calibrated anomaly probability of each message, in input order.
+    """
+    registry = registry or get_registry()
+    logits = predict_logits(messages, registry, severities=severities, truncation=truncation)
+    return anomaly_probabilities(logits, registry.temperature)
+
+
+def predict_tagged(messages: List[str], severities: Optional[List[str]] = None, registry=None,
+                   truncation=None) -> List[Tuple[float, str]]:
+    """
+    Return ``(probability, model_version)`` for each message, in input order.
+
+    The registry is resolved once per call, so every message of a batch is
+    scored by the same model even while a hot reload swaps it.
+    """
+    registry = registry or get_registry()
+    probabilities = predict_batch(messages, severities, registry=registry, truncation=truncation)
+    return [(probability, registry.version) for probability in probabilities]
+
+
+class _Request:
+    __slots__ = ('message', 'severity', 'future', 'enqueued_at', 'caller')
+
+    def __init__(self, message: str, severity: Optional[str] = None, caller: Optional[object] = None):
+        self.message = message
+        self.severity = severity
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+        self.caller = caller
+
+
+class BatchingEngine:
+    """
+    Dynamic micro-batching front end for a batch prediction function.
+
+    Args:
+        predict_fn (Callable): Maps a list of messages and a list of their
+            severities to a list of results
+        max_batch_size (int): Flush once this many requests are queued
+        max_wait_ms (float): Flush once the oldest request has waited this
+            long. A batch holding a request of every caller in flight is
+            flushed at once, as nobody else could join it, so a lone caller
+            (a prefork child running one task at a time) never waits
+    """
+
+    def __init__(self, predict_fn: Callable[[List[str], List[Optional[str]]], list],
+                 max_batch_size: int = 16, max_wait_ms: float = 10):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._callers = 0
+        self._callers_lock = threading.Lock()
+        self.batch_sizes = metrics.histogram('inference.batch_size', BATCH_SIZE_BUCKETS)
+        self.queue_wait = metrics.histogram('inference.queue_wait_seconds')
+        self.batch_latency = metrics.histogram('inference.batch_seconds')
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(
+                        target=self._run, name='inference-batcher', daemon=True
+                    )
+                    self._thread.start()
+
+    def _enqueue(self, messages: List[str], severities: List[Optional[str]]) -> List[Future]:
+        # A caller stays in flight until its last result is set
+        self._ensure_started()
+        caller = object()
+        remaining = [len(messages)]
+        with self._callers_lock:
+            self._callers += 1
+
+        def done(_):
+            with self._callers_lock:
+                remaining[0] -= 1
+                if not remaining[0]:
+                    self._callers -= 1
+
+        requests = [_Request(message, severity, caller) for message, severity in zip(messages, severities)]
+        for request in requests:
+            request.future.add_done_callback(done)
+            self._queue.put(request)
+        return [request.future for request in requests]
+
+    def submit(self, message: str, severity: Optional[str] = None) -> Future:
+        """Queue a message for classification and return a future for its result."""
+        return self._enqueue([message], [severity])[0]
+
+    def predict(self, messages: List[str], severities: Optional[List[str]] = None,
+                timeout: Optional[float] = None) -> list:
+        """Classify a list of messages, sharing batches with concurrent callers."""
+        if not messages:
+            return []
+        futures = self._enqueue(list(messages), list(severities or [None] * len(messages)))
+        return [future.result(timeout=timeout) for future in futures]
+
+    def shutdown(self):
+        """Stop the batching thread after it drains the requests already queued."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+
+            batch = [first]
+            callers = {first.caller}
+            deadline = first.enqueued_at + self.max_wait
+            while len(batch) < self.max_batch_size:
+                try:
+                    # Take what is already queued without waiting
+                    request = self._queue.get_nowait()
+                except queue.Empty:
+                    with self._callers_lock:
+                        alone = len(callers) >= self._callers
+                    timeout = deadline - time.perf_counter()
+                    if alone or timeout <= 0:
+                        break
+                    try:
+                        request = self._queue.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+                if request is _STOP:
+                    stopping = True
+                    break
+                batch.append(request)
+                callers.add(request.caller)
+
+            self._flush(batch)
+
+    def _flush(self, batch: List[_Request]):
+        started = time.perf_counter()
+        for request in batch:
+            self.queue_wait.observe(started - request.enqueued_at)
+        self.batch_sizes.observe(len(batch))
+
+        try:
+            results = self.predict_fn(
+                [request.message for request in batch], [request.severity for request in batch]
+            )
+        except Exception as exc:
+            logger.error(f"Inference batch of {len(batch)} messages failed: {str(exc)}")
+            for request in batch:
+                request.future.set_exception(exc)
+            return
+        finally:
+            self.batch_latency.observe(time.perf_counter() - started)
+
+        for request, result in zip(batch, results):
+            request.future.set_result(result)
+
+
+_engine = None
+_engine_pid = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> BatchingEngine:
+    """
+    Return this process's batching engine, creating it from settings. It
+    returns ``(probability, model_version)`` pairs.
+
+    The engine's thread does not survive a fork, so a forked child builds
+    its own engine on first use.
+    """
+    global _engine, _engine_pid
+    if _engine is None or _engine_pid != os.getpid():
+        with _engine_lock:
+            if _engine is None or _engine_pid != os.getpid():
+                _engine = BatchingEngine(
+                    predict_tagged,
+                    max_batch_size=getattr(settings, 'ANOMALY_BATCH_MAX_SIZE', 16),
+                    max_wait_ms=getattr(settings, 'ANOMALY_BATCH_MAX_WAIT_MS', 10),
+                )
+                _engine_pid = os.getpid()
+    return _engine
@@ -0,0 +1,264 @@
+"""
+Local inference server shared by every worker on a node.
+
+``python manage.py run_inference_server`` holds the only model copy on the
+node and listens on the Unix socket ``ANOMALY_INFERENCE_SOCKET``. Each
+client connection is served by its own thread, and all of them feed one
+``BatchingEngine``, so requests from different Celery processes share
+forward passes.
+
+Messages are length-prefixed JSON frames: a 4-byte big-endian length, then
+``{"messages": [...], "severities": [...]}``. The reply is
+``{"probabilities": [...], "model_versions": [...]}``, the version of the
+model that scored each message, or ``{"error": "..."}``. ``{"op": "version"}``
+asks for the version the server runs now, answered as
+``{"model_version": "..."}``; clients key their verdict cache lookups by it.
+``{"op": "embed", "messages": [...], "severities": [...]}`` returns the
+pooled embeddings for similar-log search as
+``{"vectors": "<base64 float16>", "dimensions": 768, "model_version": "..."}``,
+so embedding tasks do not load a model of their own either.
+
+``InferenceClient`` is the worker side. ``analyze_logs`` uses it when the
+socket is configured and falls back to in-process inference when the server
+is down or slow.
+"""
+import base64
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from .inference import BatchingEngine
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('>I')
+MAX_FRAME_BYTES = 64 * 2**20
+
+
+class InferenceServerError(Exception):
+    """The inference server could not classify a request."""
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 2**20))
+        if not chunk:
+            raise ConnectionError('Connection closed mid-frame')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def send_frame(sock: socket.socket, payload: Dict[str, Any]):
+    data = json.dumps(payload).encode()
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def recv_frame(sock: socket.socket) -> Optional[Dict[str, Any]]:
+    """Read one frame, or return None when the peer closed the connection between frames."""
+    header = sock.recv(HEADER.size, socket.MSG_WAITALL)
+    if not header:
+        return None
+    if len(header) < HEADER.size:
+        raise ConnectionError('Connection closed mid-frame')
+    (length,) = HEADER.unpack(header)
+    if length > MAX_FRAME_BYTES:
+        raise ValueError(f'Frame of {length} bytes exceeds the {MAX_FRAME_BYTES} byte limit')
+    return json.loads(_recv_exactly(sock, length))
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                request = recv_frame(self.request)
+            except (ConnectionError, ValueError) as exc:
+                logger.warning(f"Dropping inference client: {str(exc)}")
+                return
+            if request is None:
+                return
+
+            if request.get('op') == 'version':
+                try:
+                    reply = {'model_version': self.server.version_source()}
+                except Exception as exc:
+                    reply = {'error': str(exc)}
+                send_frame(self.request, reply)
+                continue
+
+            if request.get('op') == 'embed':
+                try:
+                    vectors, model_version = self.server.embedder(request['messages'], request.get('severities'))
+                    vectors = np.asarray(vectors, dtype=np.float16)
+                    reply = {
+                        'vectors': base64.b64encode(vectors.tobytes()).decode(),
+                        'dimensions': int(vectors.shape[1]),
+                        'model_version': model_version,
+                    }
+                except Exception as exc:
+                    logger.error(f"Embedding request of {len(request.get('messages', []))} messages failed: {str(exc)}")
+                    reply = {'error': str(exc)}
+                send_frame(self.request, reply)
+                continue
+
+            try:
+                messages = request['messages']
+                results = self.server.engine.predict(messages, request.get('severities'))
+                reply = {
+                    'probabilities': [probability for probability, _ in results],
+                    'model_versions': [model_version for _, model_version in results],
+                }
+            except Exception as exc:
+                logger.error(f"Inference request of {len(request.get('messages', []))} messages failed: {str(exc)}")
+                reply = {'error': str(exc)}
+            send_frame(self.request, reply)
+
+
+def _embed_with_registry(messages: List[str], severities: Optional[List[str]]) -> Tuple[np.ndarray, str]:
+    from .embeddings import embed_messages
+    from .model_registry import get_registry
+
+    # Resolved once, so a hot reload cannot mix versions within the request
+    registry = get_registry()
+    return embed_messages(messages, severities, registry=registry), registry.version
+
+
+class InferenceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Unix socket server answering classification requests through a shared
+    batching engine.
+
+    Args:
+        path (str): Socket path; a stale socket file is replaced
+        engine (BatchingEngine): Engine shared by every connection, returning
+            ``(probability, model_version)`` pairs
+        version_source (Callable): Returns the model version being served
+            (defaults to the process registry's)
+        embedder (Callable): Maps messages and severities to
+            ``(vectors, model_version)`` (defaults to the process registry)
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path: str, engine: BatchingEngine, version_source: Optional[Callable[[], str]] = None,
+                 embedder: Optional[Callable] = None):
+        if os.path.exists(path):
+            os.unlink(path)
+        self.engine = engine
+        if version_source is None:
+            from .model_registry import get_registry
+            version_source = lambda: get_registry().version  # noqa: E731
+        self.version_source = version_source
+        self.embedder = embedder or _embed_with_registry
+        super().__init__(path, _Handler)
+        os.chmod(path, 0o660)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+class InferenceClient:
+    """
+    Thin client for the local inference server.
+
+    Args:
+        path (str): Socket path of the server
+        timeout (float): Seconds to wait for a connection and for each reply
+        version_ttl (float): Seconds ``model_version`` reuses the last answer
+    """
+
+    def __init__(self, path: str, timeout: float = 5.0, version_ttl: float = 1.0):
+        self.path = path
+        self.timeout = timeout
+        self.version_ttl = version_ttl
+        self._version = None
+        self._version_at = None
+        self._lock = threading.Lock()
+
+    def _request(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+            send_frame(sock, payload)
+            reply = recv_frame(sock)
+
+        if reply is None:
+            raise ConnectionError('Inference server closed the connection')
+        if 'error' in reply:
+            raise InferenceServerError(reply['error'])
+        return reply
+
+    def model_version(self) -> str:
+        """
+        Return the version of the model the server runs.
+
+        The server follows the ``CURRENT`` pointer on its own, so this changes
+        after ``reload_model`` without the worker being told.
+
+        Raises:
+            OSError: The server is unreachable or timed out
+            InferenceServerError: The server could not tell
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._version is not None and now - self._version_at < self.version_ttl:
+                return self._version
+        version = self._request({'op': 'version'})['model_version']
+        with self._lock:
+            self._version, self._version_at = version, now
+        return version
+
+    def predict(self, messages: List[str], severities: Optional[List[str]] = None) -> List[Tuple[float, str]]:
+        """
+        Return ``(probability, model_version)`` for each message.
+
+        Raises:
+            OSError: The server is unreachable or timed out
+            InferenceServerError: The server failed to classify the messages
+        """
+        reply = self._request({'messages': messages, 'severities': severities})
+        return list(zip(reply['probabilities'], reply['model_versions']))
+
+    def embed(self, messages: List[str], severities: Optional[List[str]] = None) -> Tuple[np.ndarray, str]:
+        """
+        Return the float16 pooled embeddings of the messages and the model
+        version that computed them.
+
+        Raises:
+            OSError: The server is unreachable or timed out
+            InferenceServerError: The server failed to embed the messages
+        """
+        reply = self._request({'op': 'embed', 'messages': messages, 'severities': severities})
+        vectors = np.frombuffer(base64.b64decode(reply['vectors']), dtype=np.float16)
+        return vectors.reshape(-1, reply['dimensions']), reply['model_version']
+
+
+_clients = {}
+
+
+def get_client() -> Optional[InferenceClient]:
+    """Return a client for the configured inference server, or None when there is none."""
+    path = getattr(settings, 'ANOMALY_INFERENCE_SOCKET', None)
+    if not path:
+        return None
+    options = (
+        str(path),
+        getattr(settings, 'ANOMALY_INFERENCE_SOCKET_TIMEOUT', 5.0),
+        getattr(settings, 'ANOMALY_MODEL_RELOAD_POLL', 1.0),
+    )
+    # Kept per process, so the served version is asked at most once per poll interval
+    if options not in _clients:
+        _clients[options] = InferenceClient(*options)
+    return _clients[options]
@@ -0,0 +1,496 @@
+"""
+Bulk log ingestion.
+
+``POST /api/logs/bulk/`` takes many log entries in one request, either as a
+JSON array or as NDJSON (one JSON object per line, ``application/x-ndjson``).
+Each item is validated like a single ``POST /api/logs/``; the valid ones are
+inserted in one transaction, ``ANOMALY_BULK_INSERT_CHUNK`` rows per INSERT,
+and analyzed by ``analyze_log_batch`` tasks of up to
+``ANOMALY_BULK_ANALYSIS_CHUNK`` entries, instead of one INSERT and one task
+per entry. Invalid items are reported by index and do not fail the others.
+Once entries are stored, a broker failure does not fail the request: their
+IDs are returned with the status ``stored`` rather than ``processing``.
+
+JSON arrays are parsed whole, so they are capped at ``ANOMALY_BULK_MAX_ITEMS``
+entries. NDJSON bodies are streamed: ``ingest_stream`` reads the request in
+``ANOMALY_BULK_STREAM_CHUNK_BYTES`` chunks and inserts rows as soon as a
+chunk's worth is validated, so memory stays flat whatever the upload size.
+
+``aingest`` and ``aingest_stream`` do the same on Django's async ORM for
+``POST /api/logs/bulk/async/``, so under ASGI a request waiting on the
+database or the broker does not hold a thread.
+
+With ``ANOMALY_INGEST_WRITE_BEHIND``, valid entries are appended to the
+write-behind buffer (see ``ingest_buffer``) instead, and inserted and
+analyzed later by the flusher; results then carry no IDs and the status is
+``buffered``.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import tempfile
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework import serializers
+
+from . import metrics
+from .ingest_buffer import get_ingest_buffer, write_behind_enabled
+from .models import LogEntry
+from .validation import current_zone, validate_log_entry
+
+logger = logging.getLogger(__name__)
+
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/jsonl', 'application/json-seq')
+
+
+class BulkIngestError(ValueError):
+    """The request body as a whole cannot be ingested."""
+
+
+class BulkSignatureError(BulkIngestError):
+    """The body does not match its HMAC signature."""
+
+
+def is_ndjson(content_type: str) -> bool:
+    return (content_type or '').split(';')[0].strip().lower() in NDJSON_CONTENT_TYPES
+
+
+def parse_bulk_body(body: bytes) -> List[Tuple[Any, str]]:
+    """
+    Parse a JSON array body into items.
+
+    Returns:
+        List[tuple]: ``(item, None)`` per item
+
+    Raises:
+        BulkIngestError: The body is not a JSON array
+    """
+    try:
+        items = json.loads(body.decode('utf-8'))
+    except UnicodeDecodeError:
+        raise BulkIngestError('Body must be UTF-8')
+    except json.JSONDecodeError as exc:
+        raise BulkIngestError(f'Invalid JSON format: {exc}')
+    if not isinstance(items, list):
+        raise BulkIngestError('Expected a JSON array of log entries, or NDJSON')
+    return [(item, None) for item in items]
+
+
+def iter_ndjson(stream, chunk_size: int = 65536, max_line_bytes: int = 2**20) -> Iterator[Tuple[Any, Optional[str]]]:
+    """
+    Read NDJSON items from a file-like stream, ``chunk_size`` bytes at a time.
+
+    Only the current chunk and one partial line are held in memory. Blank
+    lines are skipped.
+
+    Yields:
+        tuple: ``(item, error)``, ``error`` being set (and ``item`` None) for
+        lines that are not valid JSON or exceed ``max_line_bytes``
+    """
+    def parse(line):
+        try:
+            return json.loads(line), None
+        except UnicodeDecodeError:
+            return None, 'Line is not UTF-8'
+        except json.JSONDecodeError as exc:
+            return None, f'Invalid JSON: {exc.msg}'
+
+    buffer = b''
+    # Set while skipping the rest of an oversized line
+    skipping = False
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        lines = (buffer + chunk).split(b'\n')
+        buffer = lines.pop()
+        for line in lines:
+            if skipping:
+                skipping = False
+                yield None, f'Line longer than {max_line_bytes} bytes'
+            elif len(line) > max_line_bytes:
+                yield None, f'Line longer than {max_line_bytes} bytes'
+            elif line.strip():
+                yield parse(line)
+        if len(buffer) > max_line_bytes:
+            buffer, skipping = b'', True
+    if skipping:
+        yield None, f'Line longer than {max_line_bytes} bytes'
+    elif buffer.strip():
+        yield parse(buffer)
+
+
+def validate_items(items: List[Tuple[Any, str]]) -> Tuple[List[Tuple[int, Dict[str, Any]]], Dict[int, Any]]:
+    """
+    Validate every item with ``validate_log_entry``.
+
+    Returns:
+        tuple: ``(valid, errors)``; ``valid`` lists ``(index, validated_data)``
+        and ``errors`` maps the index of each rejected item to its errors,
+        shaped like the single-entry endpoint's
+    """
+    zone = current_zone()
+    valid, errors = [], {}
+    for index, (item, parse_error) in enumerate(items):
+        if parse_error:
+            errors[index] = {'non_field_errors': [parse_error]}
+            continue
+        try:
+            valid.append((index, validate_log_entry(item, zone)))
+        except serializers.ValidationError as exc:
+            errors[index] = exc.detail
+    return valid, errors
+
+
+def insert_entries(validated: List[Dict[str, Any]], chunk_size: int) -> List[LogEntry]:
+    """
+    Insert validated entries in one transaction, ``chunk_size`` rows per INSERT.
+
+    ``bulk_create`` wraps all its batches in a single transaction, so a
+    failure stores none of them and the client can safely send them again.
+    """
+    return LogEntry.objects.bulk_create([LogEntry(**data) for data in validated], batch_size=chunk_size)
+
+
+def dispatch_analysis(log_entry_ids: List[int], chunk_size: int) -> List[str]:
+    """Queue ``analyze_log_batch`` over the entries, ``chunk_size`` at a time."""
+    from .tasks import analyze_log_batch
+
+    return [
+        analyze_log_batch.delay(log_entry_ids[offset:offset + chunk_size]).id
+        for offset in range(0, len(log_entry_ids), chunk_size)
+    ]
+
+
+def queue_analysis(log_entry_ids: List[int], chunk_size: int) -> Optional[List[str]]:
+    """
+    ``dispatch_analysis`` for entries that are already committed.
+
+    A broker failure is logged instead of raised: failing the request would
+    have the client send the stored entries again, as duplicates.
+
+    Returns:
+        list: The analysis task IDs, or None when they could not be queued
+    """
+    try:
+        return dispatch_analysis(log_entry_ids, chunk_size)
+    except Exception as e:
+        metrics.counter('ingest.dispatch_failures').inc()
+        logger.error(f"Stored {len(log_entry_ids)} log entries but could not queue their analysis: {str(e)}")
+        return None
+
+
+def _bulk_settings() -> Dict[str, int]:
+    return {
+        'max_items': getattr(settings, 'ANOMALY_BULK_MAX_ITEMS', 10000),
+        'insert_chunk': getattr(settings, 'ANOMALY_BULK_INSERT_CHUNK', 1000),
+        'analysis_chunk': getattr(settings, 'ANOMALY_BULK_ANALYSIS_CHUNK', 500),
+        'stream_chunk': getattr(settings, 'ANOMALY_BULK_STREAM_CHUNK_BYTES', 65536),
+        'max_line': getattr(settings, 'ANOMALY_BULK_STREAM_MAX_LINE_BYTES', 2**20),
+        'max_errors': getattr(settings, 'ANOMALY_BULK_MAX_REPORTED_ERRORS', 100),
+        'signed_max': getattr(settings, 'ANOMALY_BULK_SIGNED_MAX_BYTES', 256 * 2**20),
+    }
+
+
+def _check_items(items: List[Tuple[Any, str]], max_items: int):
+    if not items:
+        raise BulkIngestError('No log entries provided')
+    if len(items) > max_items:
+        raise BulkIngestError(f'At most {max_items} log entries per request, got {len(items)}')
+
+
+def _entry_status(accepted: int, buffered: bool = False, queued: bool = True) -> str:
+    if not accepted:
+        return 'rejected'
+    if buffered:
+        return 'buffered'
+    # Stored, but the broker could not be reached to queue the analysis
+    return 'processing' if queued else 'stored'
+
+
+def _array_result(items, valid, errors, log_entry_ids=None, task_ids=()) -> Dict[str, Any]:
+    # Without IDs the valid entries went to the write-behind buffer
+    buffered = log_entry_ids is None
+    queued = task_ids is not None
+    task_ids = task_ids or ()
+    ids = {index: None for index, _ in valid} if buffered else {
+        index: log_entry_id for (index, _), log_entry_id in zip(valid, log_entry_ids)
+    }
+    results = [
+        ({'index': index} if buffered else {'index': index, 'id': ids[index]})
+        if index in ids else {'index': index, 'errors': errors[index]}
+        for index in range(len(items))
+    ]
+    metrics.counter('ingest.accepted').inc(len(ids))
+    metrics.counter('ingest.rejected').inc(len(errors))
+    if buffered:
+        logger.info(f"Buffered {len(ids)} log entries ({len(errors)} rejected)")
+    else:
+        logger.info(f"Bulk ingested {len(ids)} log entries ({len(errors)} rejected) in {len(task_ids)} analysis tasks")
+    return {
+        'accepted': len(ids),
+        'rejected': len(errors),
+        'results': results,
+        'analysis_task_ids': list(task_ids),
+        'status': _entry_status(len(ids), buffered, queued),
+    }
+
+
+def ingest(body: bytes) -> Dict[str, Any]:
+    """
+    Validate, store and queue the analysis of a JSON array body.
+
+    Returns:
+        dict: ``accepted`` and ``rejected`` counts, one result per item in
+        request order (``{'index', 'id'}`` or ``{'index', 'errors'}``) and
+        the analysis task IDs
+
+    Raises:
+        BulkIngestError: The body cannot be parsed or holds too many items
+    """
+    config = _bulk_settings()
+    items = parse_bulk_body(body)
+    _check_items(items, config['max_items'])
+
+    valid, errors = validate_items(items)
+    if write_behind_enabled():
+        get_ingest_buffer().append([data for _, data in valid])
+        return _array_result(items, valid, errors)
+    created = insert_entries([data for _, data in valid], config['insert_chunk'])
+    log_entry_ids = [log_entry.id for log_entry in created]
+    task_ids = queue_analysis(log_entry_ids, config['analysis_chunk'])
+    return _array_result(items, valid, errors, log_entry_ids, task_ids)
+
+
+class _StreamTally:
+    """Counts of a streamed upload, and the first rejected lines."""
+
+    def __init__(self, max_errors: int):
+        self.max_errors = max_errors
+        self.zone = current_zone()
+        self.accepted = 0
+        self.rejected = 0
+        self.results = []
+        self.task_ids = []
+        self.queued = True
+
+    def reject(self, index: int, errors):
+        self.rejected += 1
+        if len(self.results) < self.max_errors:
+            self.results.append({'index': index, 'errors': errors})
+
+    def validate(self, index: int, item, parse_error) -> Optional[Dict[str, Any]]:
+        """Return the line's validated data, or None after rejecting it."""
+        if parse_error:
+            self.reject(index, {'non_field_errors': [parse_error]})
+            return None
+        try:
+            return validate_log_entry(item, self.zone)
+        except serializers.ValidationError as exc:
+            self.reject(index, exc.detail)
+            return None
+
+    def add_tasks(self, task_ids: Optional[List[str]]):
+        if task_ids is None:
+            self.queued = False
+        else:
+            self.task_ids.extend(task_ids)
+
+    def result(self, buffered: bool = False) -> Dict[str, Any]:
+        if not self.accepted and not self.rejected:
+            raise BulkIngestError('No log entries provided')
+        metrics.counter('ingest.accepted').inc(self.accepted)
+        metrics.counter('ingest.rejected').inc(self.rejected)
+        logger.info(
+            f"Streamed {self.accepted} log entries ({self.rejected} rejected) "
+            + ('to the ingest buffer' if buffered else f"in {len(self.task_ids)} analysis tasks")
+        )
+        return {
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'results': self.results,
+            'results_truncated': self.rejected > len(self.results),
+            'analysis_task_ids': self.task_ids,
+            'status': _entry_status(self.accepted, buffered, self.queued),
+        }
+
+
+def _check_signature(digest, signature: str):
+    expected = base64.b64encode(digest.digest()).decode()
+    if not hmac.compare_digest(expected, signature):
+        raise BulkSignatureError('Invalid HMAC signature')
+
+
+def verified_copy(stream, signature: str, chunk_size: int, max_bytes: int):
+    """
+    Copy a signed body to a temporary file and check its signature.
+
+    The copy stays in memory up to a few chunks and spills to disk past
+    that. Nothing is stored before the whole body is known to be authentic,
+    so no write transaction is held open while the client uploads.
+
+    Returns:
+        file: The body, rewound; the caller closes it
+
+    Raises:
+        BulkIngestError: The body is larger than ``max_bytes``
+        BulkSignatureError: The body does not match ``signature``
+    """
+    digest = hmac.new(settings.SECRET_KEY.encode(), digestmod=hashlib.sha256)
+    copy = tempfile.SpooledTemporaryFile(max_size=chunk_size * 16)
+    size = 0
+    try:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise BulkIngestError(f'Signed uploads are limited to {max_bytes} bytes')
+            digest.update(chunk)
+            copy.write(chunk)
+        _check_signature(digest, signature)
+    except BaseException:
+        copy.close()
+        raise
+    copy.seek(0)
+    return copy
+
+
+def ingest_stream(stream, signature: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Validate, store and queue the analysis of an NDJSON stream as it is read.
+
+    Each chunk of rows is committed (and its analysis queued) as soon as it
+    is inserted. A signed body is only known to be authentic once fully
+    read, so it is first copied aside with ``verified_copy`` (up to
+    ``ANOMALY_BULK_SIGNED_MAX_BYTES``) and stored only if it matches.
+
+    Returns:
+        dict: ``accepted`` and ``rejected`` counts, the first
+        ``ANOMALY_BULK_MAX_REPORTED_ERRORS`` rejected items as
+        ``{'index', 'errors'}`` results, and the analysis task IDs
+
+    Raises:
+        BulkIngestError: A signed body is too large
+        BulkSignatureError: The body does not match ``signature``
+    """
+    config = _bulk_settings()
+    if signature:
+        with verified_copy(stream, signature, config['stream_chunk'], config['signed_max']) as body:
+            return ingest_stream(body)
+
+    tally = _StreamTally(config['max_errors'])
+    items = iter_ndjson(stream, chunk_size=config['stream_chunk'], max_line_bytes=config['max_line'])
+    if write_behind_enabled():
+        return _buffer_stream(items, tally, config)
+    pending = []
+
+    def flush():
+        with transaction.atomic():
+            created = LogEntry.objects.bulk_create(pending)
+        log_entry_ids = [log_entry.id for log_entry in created]
+        tally.accepted += len(log_entry_ids)
+        pending.clear()
+        transaction.on_commit(lambda: tally.add_tasks(queue_analysis(log_entry_ids, config['analysis_chunk'])))
+
+    for index, (item, parse_error) in enumerate(items):
+        data = tally.validate(index, item, parse_error)
+        if data is not None:
+            pending.append(LogEntry(**data))
+        if len(pending) >= config['insert_chunk']:
+            flush()
+    if pending:
+        flush()
+    return tally.result()
+
+
+def _buffer_stream(items, tally: _StreamTally, config) -> Dict[str, Any]:
+    # The upload is staged whole and only published to the buffer once read,
+    # so a failed upload leaves nothing behind
+    pending = []
+    with get_ingest_buffer().staged() as write:
+        for index, (item, parse_error) in enumerate(items):
+            data = tally.validate(index, item, parse_error)
+            if data is not None:
+                pending.append(data)
+            if len(pending) >= config['insert_chunk']:
+                write(pending)
+                tally.accepted += len(pending)
+                pending = []
+        if pending:
+            write(pending)
+            tally.accepted += len(pending)
+    return tally.result(buffered=True)
+
+
+async def _aqueue_analysis(log_entry_ids: List[int], chunk_size: int) -> Optional[List[str]]:
+    # Publishing to the broker is blocking I/O, so it runs off the event loop
+    return await asyncio.to_thread(queue_analysis, log_entry_ids, chunk_size)
+
+
+async def aingest(body: bytes) -> Dict[str, Any]:
+    """``ingest`` on the async ORM, for ASGI deployments."""
+    if write_behind_enabled():
+        # Appending is blocking file I/O
+        return await asyncio.to_thread(ingest, body)
+    config = _bulk_settings()
+
+    def parse():
+        # Up to ANOMALY_BULK_MAX_ITEMS entries: parsing and validating them
+        # on the event loop would stall every other request meanwhile
+        items = parse_bulk_body(body)
+        _check_items(items, config['max_items'])
+        return items, validate_items(items)
+
+    items, (valid, errors) = await asyncio.to_thread(parse)
+    # One transaction for every batch, as in insert_entries
+    created = await LogEntry.objects.abulk_create(
+        [LogEntry(**data) for _, data in valid], batch_size=config['insert_chunk']
+    )
+    log_entry_ids = [log_entry.id for log_entry in created]
+    task_ids = await _aqueue_analysis(log_entry_ids, config['analysis_chunk'])
+    return _array_result(items, valid, errors, log_entry_ids, task_ids)
+
+
+async def aingest_stream(stream) -> Dict[str, Any]:
+    """
+    ``ingest_stream`` on the async ORM, for unsigned uploads under ASGI.
+
+    The ASGI handler has already spooled the body (to disk past
+    ``FILE_UPLOAD_MAX_MEMORY_SIZE``), so it is read without waiting on the
+    client; reading it may still hit the disk, so that runs in a thread,
+    along with parsing and validation. Signed uploads are copied aside and verified first; run
+    ``ingest_stream`` in a thread for those.
+    """
+    if write_behind_enabled():
+        return await asyncio.to_thread(ingest_stream, stream)
+    config = _bulk_settings()
+    tally = _StreamTally(config['max_errors'])
+    items = enumerate(iter_ndjson(stream, chunk_size=config['stream_chunk'], max_line_bytes=config['max_line']))
+
+    def read_rows() -> List[LogEntry]:
+        # Reading the spooled body, parsing and validating are all blocking,
+        # so each insert chunk's worth is gathered in a thread
+        rows = []
+        for index, (item, parse_error) in items:
+            data = tally.validate(index, item, parse_error)
+            if data is not None:
+                rows.append(LogEntry(**data))
+                if len(rows) >= config['insert_chunk']:
+                    break
+        return rows
+
+    while True:
+        rows = await asyncio.to_thread(read_rows)
+        if not rows:
+            break
+        created = await LogEntry.objects.abulk_create(rows)
+        tally.accepted += len(created)
+        tally.add_tasks(await _aqueue_analysis([log_entry.id for log_entry in created], config['analysis_chunk']))
+    return tally.result()
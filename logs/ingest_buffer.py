@@ -0,0 +1,469 @@
+"""
+Write-behind buffer for log ingestion.
+
+With ``ANOMALY_INGEST_WRITE_BEHIND``, the ingest endpoints append validated
+entries to an append-only segment file in ``ANOMALY_INGEST_BUFFER_DIR`` and
+answer ``202 Accepted`` without touching the database, so bursts no longer
+queue on SQLite's write lock. ``python manage.py run_ingest_flusher`` then
+inserts them in bulk::
+
+    ingest_buffer/
+        active.open                       (appended to by every web process)
+        00001718000000000000-3f2a9c1e.seg (sealed, waiting for the flusher)
+        .lock
+
+Each segment starts with a header line holding its creation time, followed
+by one JSON entry per line. Appends take an exclusive ``flock``, are written
+with a single ``write`` and fsynced (``ANOMALY_INGEST_FSYNC``) before the
+request is acknowledged. The active segment is sealed (renamed to ``.seg``)
+once it reaches ``ANOMALY_INGEST_SEGMENT_BYTES`` or when the flusher comes
+by. Streamed uploads are staged in a private file and published as a sealed
+segment once fully read, so a rejected signature never reaches the buffer.
+
+The flusher inserts each sealed segment in one transaction that also
+records it as an ``IngestSegment``, with the new IDs in ``pending_analysis``.
+It then deletes the file, queues the analysis of the new rows and clears
+``pending_analysis``; IDs still pending after a crash or a broker outage are
+queued again on the next pass. A segment left behind by a crash is replayed
+on the next run; its ``IngestSegment`` row tells whether it was already
+committed, so replays never insert rows twice. A segment that cannot be read
+is moved to ``quarantine/`` so it does not block the ones behind it.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from . import metrics
+from .models import IngestSegment, LogEntry
+
+try:
+    # Only the write-behind buffer locks files, so the rest of the app still
+    # imports on Windows
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_SEGMENT = 'active.open'
+SEGMENT_SUFFIX = '.seg'
+LOCK_FILE = '.lock'
+FLUSHER_LOCK_FILE = '.flusher.lock'
+QUARANTINE_DIR = 'quarantine'
+
+
+class CorruptSegmentError(Exception):
+    """A segment whose header cannot be read"""
+    pass
+
+
+def _encode(rows: List[Dict[str, Any]]) -> bytes:
+    return ''.join(json.dumps(row, cls=DjangoJSONEncoder) + '\n' for row in rows).encode()
+
+
+def _header() -> bytes:
+    return (json.dumps({'segment': {'created': time.time()}}) + '\n').encode()
+
+
+def _write_all(fd: int, data: bytes):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def write_behind_enabled() -> bool:
+    return getattr(settings, 'ANOMALY_INGEST_WRITE_BEHIND', False)
+
+
+class SegmentBuffer:
+    """
+    Append-only segment files shared by every process on the node.
+
+    Args:
+        directory (str): Buffer directory, created if missing
+        segment_bytes (int): Size at which the active segment is sealed
+        fsync (bool): Sync each append to disk before it is acknowledged
+    """
+
+    def __init__(self, directory, segment_bytes: int = 16 * 2**20, fsync: bool = True):
+        if fcntl is None:
+            raise ImproperlyConfigured('The write-behind ingestion buffer needs POSIX file locks (Linux or macOS)')
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+
+    @property
+    def active_path(self) -> Path:
+        return self.directory / ACTIVE_SEGMENT
+
+    @contextmanager
+    def _locked(self):
+        with open(self.directory / LOCK_FILE, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _sealed_path(self) -> Path:
+        # Names sort in sealing order
+        return self.directory / f'{time.time_ns():020d}-{uuid.uuid4().hex[:8]}{SEGMENT_SUFFIX}'
+
+    def append(self, rows: List[Dict[str, Any]]):
+        """Durably append validated entries to the active segment."""
+        if not rows:
+            return
+        data = _encode(rows)
+        with self._locked():
+            fd = os.open(self.active_path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                size = os.fstat(fd).st_size
+                if not size:
+                    data = _header() + data
+                elif os.pread(fd, 1, size - 1) != b'\n':
+                    # A crash cut the previous append short; end its line so
+                    # only that line is lost
+                    data = b'\n' + data
+                _write_all(fd, data)
+                if self.fsync:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+            if size + len(data) >= self.segment_bytes:
+                self._seal()
+        metrics.counter('ingest.buffered').inc(len(rows))
+
+    @contextmanager
+    def staged(self):
+        """
+        Stage entries in a private file, published as one sealed segment
+        when the block exits without an exception and discarded otherwise.
+
+        Yields:
+            Callable: Appends a list of validated entries
+        """
+        path = self.directory / f'.upload-{uuid.uuid4().hex}.tmp'
+        count = [0]
+        with open(path, 'wb') as staging:
+            staging.write(_header())
+
+            def write(rows):
+                staging.write(_encode(rows))
+                count[0] += len(rows)
+
+            try:
+                yield write
+                staging.flush()
+                if self.fsync:
+                    os.fsync(staging.fileno())
+            except BaseException:
+                staging.close()
+                path.unlink(missing_ok=True)
+                raise
+        if count[0]:
+            os.replace(path, self._sealed_path())
+            metrics.counter('ingest.buffered').inc(count[0])
+        else:
+            path.unlink(missing_ok=True)
+
+    def _seal(self) -> Optional[Path]:
+        if not self.active_path.exists() or not self.active_path.stat().st_size:
+            return None
+        sealed = self._sealed_path()
+        os.replace(self.active_path, sealed)
+        return sealed
+
+    def seal(self) -> Optional[Path]:
+        """Seal the active segment if it holds anything."""
+        with self._locked():
+            return self._seal()
+
+    def sealed_segments(self) -> List[Path]:
+        return sorted(self.directory.glob(f'*{SEGMENT_SUFFIX}'))
+
+    def stats(self) -> Dict[str, Any]:
+        """Report the buffer depth: segments and bytes waiting to be flushed."""
+        sealed = []
+        for path in self.sealed_segments():
+            try:
+                sealed.append((path, path.stat().st_size))
+            except FileNotFoundError:
+                continue
+        active = self.active_path.stat().st_size if self.active_path.exists() else 0
+        quarantine = self.directory / QUARANTINE_DIR
+        quarantined = len(list(quarantine.glob(f'*{SEGMENT_SUFFIX}'))) if quarantine.exists() else 0
+        oldest = int(sealed[0][0].name.split('-')[0]) / 1e9 if sealed else None
+        return {
+            'sealed_segments': len(sealed),
+            'sealed_bytes': sum(size for _, size in sealed),
+            'active_bytes': active,
+            'oldest_sealed_age_seconds': time.time() - oldest if oldest else None,
+            'quarantined_segments': quarantined,
+        }
+
+    def quarantine(self, path: Path) -> Path:
+        """Move an unreadable segment out of the flusher's way."""
+        target = self.directory / QUARANTINE_DIR / path.name
+        target.parent.mkdir(exist_ok=True)
+        os.replace(path, target)
+        return target
+
+
+def read_segment(path: Path) -> Tuple[Optional[float], Iterator[Dict[str, Any]]]:
+    """
+    Open a segment.
+
+    Returns:
+        tuple: ``(created, rows)``, the segment's creation time and an
+        iterator over its entries; lines cut short by a crash or otherwise
+        unreadable are skipped
+
+    Raises:
+        CorruptSegmentError: If the header line is not a segment header
+    """
+    segment = open(path, 'rb')
+    try:
+        header = json.loads(segment.readline() or b'{"segment": {}}')['segment']
+        if not isinstance(header, dict):
+            raise TypeError(type(header).__name__)
+    except (ValueError, KeyError, TypeError) as exc:
+        segment.close()
+        raise CorruptSegmentError(f'Unreadable header in ingest segment {path.name}: {exc!r}')
+
+    def rows():
+        with segment:
+            for line in segment:
+                try:
+                    row = json.loads(line)
+                    timestamp = parse_datetime(row['timestamp'])
+                    if timestamp is None:
+                        raise ValueError(f"bad timestamp {row['timestamp']!r}")
+                    row = {'timestamp': timestamp, 'severity': row['severity'], 'message': row['message']}
+                except (ValueError, KeyError, TypeError) as exc:
+                    metrics.counter('ingest.corrupt_lines').inc()
+                    logger.warning(f"Skipping an unreadable line in ingest segment {path.name}: {exc!r}")
+                    continue
+                yield row
+
+    return header.get('created'), rows()
+
+
+def _compact(ids: List[int]) -> List[List[int]]:
+    """``[1, 2, 3, 7]`` -> ``[[1, 3], [7, 7]]``; bulk inserts are mostly contiguous."""
+    ranges = []
+    for value in sorted(ids):
+        if ranges and value == ranges[-1][1] + 1:
+            ranges[-1][1] = value
+        else:
+            ranges.append([value, value])
+    return ranges
+
+
+def _expand(ranges: List[List[int]]) -> List[int]:
+    return [value for first, last in ranges for value in range(first, last + 1)]
+
+
+class IngestFlusher:
+    """
+    Moves sealed segments into the database.
+
+    Args:
+        buffer (SegmentBuffer): Buffer to drain
+        insert_chunk (int): Rows per ``bulk_create`` within a segment's
+            transaction
+        analysis_chunk (int): Entries per ``analyze_log_batch`` task
+    """
+
+    def __init__(self, buffer: SegmentBuffer, insert_chunk: int = 1000, analysis_chunk: int = 500):
+        self.buffer = buffer
+        self.insert_chunk = insert_chunk
+        self.analysis_chunk = analysis_chunk
+        self._leftover = set()
+
+    def redispatch_pending(self) -> int:
+        """
+        Queue the analysis of rows committed by earlier flushes whose tasks
+        were never queued (broker outage, crash right after the commit).
+
+        Returns:
+            int: Number of entries queued again
+        """
+        queued = 0
+        for segment in IngestSegment.objects.filter(pending_analysis__isnull=False).order_by('id'):
+            if self._dispatch(segment, _expand(segment.pending_analysis)):
+                queued += segment.rows
+                metrics.counter('ingest.analysis_redispatched').inc(segment.rows)
+        return queued
+
+    def _dispatch(self, segment: IngestSegment, log_entry_ids: List[int]) -> bool:
+        from .ingest import dispatch_analysis
+
+        try:
+            dispatch_analysis(log_entry_ids, self.analysis_chunk)
+        except Exception as exc:
+            logger.error(f"Error queueing the analysis of {segment.name}, will retry: {str(exc)}")
+            return False
+        # At-least-once: a crash before this update queues the chunks again
+        IngestSegment.objects.filter(pk=segment.pk).update(pending_analysis=None)
+        return True
+
+    def recover(self) -> int:
+        """
+        Seal what a previous run left in the active segment and mark every
+        pending segment as a replay.
+
+        Returns:
+            int: Number of segments to replay
+        """
+        self.buffer.seal()
+        self._leftover = {path.name for path in self.buffer.sealed_segments()}
+        if self._leftover:
+            logger.warning(f"Replaying {len(self._leftover)} ingest segments left by a previous run")
+        return len(self._leftover)
+
+    def flush_once(self) -> int:
+        """Seal the active segment and flush every sealed one; return the rows inserted."""
+        self.redispatch_pending()
+        self.buffer.seal()
+        return sum(self.flush_segment(path) for path in self.buffer.sealed_segments())
+
+    def flush_segment(self, path: Path) -> int:
+        replayed = path.name in self._leftover
+        self._leftover.discard(path.name)
+        if IngestSegment.objects.filter(name=path.name).exists():
+            # Committed before a crash, but the file was never deleted
+            logger.warning(f"Ingest segment {path.name} was already flushed, dropping it")
+            metrics.counter('ingest.duplicate_segments').inc()
+            path.unlink(missing_ok=True)
+            return 0
+
+        start = time.perf_counter()
+        size = path.stat().st_size
+        sealed_at = int(path.name.split('-')[0]) / 1e9
+        try:
+            created, rows = read_segment(path)
+        except CorruptSegmentError as exc:
+            target = self.buffer.quarantine(path)
+            metrics.counter('ingest.quarantined_segments').inc()
+            logger.error(f"{exc}; moved to {target}")
+            return 0
+        log_entry_ids = []
+        with transaction.atomic():
+            chunk = []
+            for row in rows:
+                chunk.append(LogEntry(**row))
+                if len(chunk) >= self.insert_chunk:
+                    log_entry_ids.extend(log_entry.id for log_entry in LogEntry.objects.bulk_create(chunk))
+                    chunk = []
+            if chunk:
+                log_entry_ids.extend(log_entry.id for log_entry in LogEntry.objects.bulk_create(chunk))
+            flush_seconds = time.perf_counter() - start
+            segment = IngestSegment.objects.create(
+                name=path.name,
+                rows=len(log_entry_ids),
+                bytes=size,
+                flush_seconds=flush_seconds,
+                lag_seconds=max(0.0, time.time() - sealed_at),
+                replayed=replayed,
+                pending_analysis=_compact(log_entry_ids) or None,
+            )
+        path.unlink(missing_ok=True)
+
+        metrics.counter('ingest.flushed').inc(len(log_entry_ids))
+        metrics.histogram('ingest.flush_seconds').observe(flush_seconds)
+        if created:
+            # From the segment's first append to its rows being committed
+            metrics.histogram('ingest.flush_lag_seconds').observe(time.time() - created)
+        if replayed:
+            metrics.counter('ingest.replayed_segments').inc()
+        logger.info(
+            f"Flushed {len(log_entry_ids)} buffered log entries from {path.name} in {flush_seconds:.2f}s"
+            + (' (replay)' if replayed else '')
+        )
+
+        if log_entry_ids:
+            self._dispatch(segment, log_entry_ids)
+        return len(log_entry_ids)
+
+    @contextmanager
+    def exclusive(self):
+        """
+        Hold the buffer's flusher lock, so two flushers never race on one segment.
+
+        Raises:
+            RuntimeError: Another flusher holds it
+        """
+        lock = open(self.buffer.directory / FLUSHER_LOCK_FILE, 'a')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            raise RuntimeError(f'Another flusher is draining {self.buffer.directory}')
+        try:
+            yield
+        finally:
+            lock.close()
+
+    def run(self, interval: float, stop: threading.Event):
+        """Flush every ``interval`` seconds until ``stop`` is set."""
+        with self.exclusive():
+            self.recover()
+            while not stop.is_set():
+                try:
+                    self.flush_once()
+                except Exception as exc:
+                    metrics.counter('ingest.flush_failures').inc()
+                    logger.error(f"Error flushing the ingest buffer: {str(exc)}")
+                stop.wait(interval)
+            # Drain what was accepted before the stop
+            self.flush_once()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_ingest_buffer() -> SegmentBuffer:
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = SegmentBuffer(
+                    settings.ANOMALY_INGEST_BUFFER_DIR,
+                    segment_bytes=getattr(settings, 'ANOMALY_INGEST_SEGMENT_BYTES', 16 * 2**20),
+                    fsync=getattr(settings, 'ANOMALY_INGEST_FSYNC', True),
+                )
+    return _buffer
+
+
+def buffer_stats() -> Dict[str, Any]:
+    """Buffer depth plus the outcome of the most recent flushes."""
+    stats = get_ingest_buffer().stats()
+    recent = list(IngestSegment.objects.order_by('-flushed_at')[:20])
+    stats['last_flush'] = {
+        'flushed_at': recent[0].flushed_at.isoformat(),
+        'rows': recent[0].rows,
+        'flush_seconds': recent[0].flush_seconds,
+        'lag_seconds': recent[0].lag_seconds,
+    } if recent else None
+    stats['recent_flushes'] = {
+        'segments': len(recent),
+        'rows': sum(segment.rows for segment in recent),
+        'max_lag_seconds': max((segment.lag_seconds for segment in recent), default=None),
+        'replayed': sum(segment.replayed for segment in recent),
+    }
+    stats['pending_analysis_segments'] = IngestSegment.objects.filter(pending_analysis__isnull=False).count()
+    return stats
@@ -0,0 +1,119 @@
+"""
+Django management command to benchmark anomaly classifier inference modes.
+"""
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from logs.benchmark import MODES, benchmark_modes, calibrate, load_corpus
+
+
+class Command(BaseCommand):
+    help = 'Compare throughput, memory and verdict parity of classifier inference modes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--modes',
+            type=str,
+            default='fp32,int8',
+            help=f'Comma-separated inference modes, the first is the reference ({", ".join(MODES)})'
+        )
+        parser.add_argument(
+            '--corpus',
+            type=str,
+            default=None,
+            help='Message file (plain lines or JSON lines with "message" and "label"); '
+                 'defaults to recent log entries, which are unlabelled'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=500,
+            help='Maximum number of messages to benchmark'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=16,
+            help='Messages per forward pass'
+        )
+        parser.add_argument(
+            '--repeats',
+            type=int,
+            default=1,
+            help='Number of timed passes over the corpus'
+        )
+        parser.add_argument(
+            '--calibrate',
+            action='store_true',
+            help='Also fit ANOMALY_CALIBRATION_TEMPERATURE on the labelled corpus'
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print the reports as JSON'
+        )
+
+    def handle(self, *args, **options):
+        modes = [mode.strip() for mode in options['modes'].split(',') if mode.strip()]
+        unknown = [mode for mode in modes if mode not in MODES]
+        if unknown:
+            raise CommandError(f'Unknown inference modes: {", ".join(unknown)}')
+
+        # Severities pick the early-exit thresholds
+        messages, labels, severities = load_corpus(options['corpus'], options['limit'], with_severities=True)
+        if not messages:
+            raise CommandError('The benchmark corpus is empty')
+        if options['calibrate'] and not labels:
+            raise CommandError('--calibrate needs a labelled --corpus file')
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Benchmarking {", ".join(modes)} on {len(messages)} messages '
+                f'({"labelled" if labels else "unlabelled"})'
+            )
+        )
+
+        reports = benchmark_modes(
+            modes,
+            settings.ANOMALY_MODEL_NAME,
+            messages,
+            labels=labels,
+            batch_size=options['batch_size'],
+            repeats=options['repeats'],
+            severities=severities,
+        )
+
+        calibration = None
+        if options['calibrate']:
+            calibration = calibrate(
+                settings.ANOMALY_MODEL_NAME, messages, labels, batch_size=options['batch_size']
+            )
+
+        if options['json']:
+            output = {'modes': reports, 'calibration': calibration} if calibration else reports
+            self.stdout.write(json.dumps(output, indent=2))
+            return
+
+        for report in reports:
+            accuracy = f"{report['accuracy']:.3f}" if report['accuracy'] is not None else 'n/a'
+            self.stdout.write(
+                f"{report['mode']:>10} ({report['precision']})  "
+                f"{report['throughput']:8.1f} msg/s  "
+                f"x{report['speedup']:.2f}  "
+                f"model {report['model_bytes'] / 2**20:7.1f} MiB  "
+                f"RSS +{report['rss_delta_bytes'] / 2**20:7.1f} MiB  "
+                f"layers {report['avg_layers']:5.2f}  "
+                f"agreement {report['agreement']:.3f}  "
+                f"drift {report['max_probability_drift']:.4f}  "
+                f"accuracy {accuracy}"
+            )
+
+        if calibration:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Calibration: ANOMALY_CALIBRATION_TEMPERATURE = {calibration['temperature']} "
+                    f"(NLL {calibration['nll_before']:.4f} -> {calibration['nll_after']:.4f})"
+                )
+            )
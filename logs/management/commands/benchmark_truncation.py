@@ -0,0 +1,88 @@
+"""
+Django management command to benchmark sequence-length truncation policies.
+"""
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from logs.benchmark import benchmark_truncation, load_corpus
+from logs.truncation import POLICIES
+
+
+class Command(BaseCommand):
+    help = 'Compare latency and verdict agreement of the long-message truncation policies'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--policies',
+            type=str,
+            default=','.join(POLICIES),
+            help=f'Comma-separated truncation policies ({", ".join(POLICIES)})'
+        )
+        parser.add_argument(
+            '--corpus',
+            type=str,
+            default=None,
+            help='JSON lines with "message" and optional "label" and "severity"; '
+                 'defaults to recent log entries'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=500,
+            help='Maximum number of messages to benchmark'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=16,
+            help='Messages per forward pass'
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print the reports as JSON'
+        )
+
+    def handle(self, *args, **options):
+        policies = [policy.strip() for policy in options['policies'].split(',') if policy.strip()]
+        unknown = [policy for policy in policies if policy not in POLICIES]
+        if unknown:
+            raise CommandError(f'Unknown truncation policies: {", ".join(unknown)}')
+
+        messages, labels, severities = load_corpus(options['corpus'], options['limit'], with_severities=True)
+        if not messages:
+            raise CommandError('The benchmark corpus is empty')
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Benchmarking {", ".join(policies)} truncation on {len(messages)} messages '
+                f'(default budget {settings.ANOMALY_TOKEN_BUDGET}, per severity {settings.ANOMALY_TOKEN_BUDGETS})'
+            )
+        )
+
+        reports = benchmark_truncation(
+            policies,
+            settings.ANOMALY_MODEL_NAME,
+            messages,
+            severities=severities,
+            labels=labels,
+            batch_size=options['batch_size'],
+        )
+
+        if options['json']:
+            self.stdout.write(json.dumps(reports, indent=2))
+            return
+
+        for report in reports:
+            accuracy = f"{report['accuracy']:.3f}" if report['accuracy'] is not None else 'n/a'
+            self.stdout.write(
+                f"{report['policy']:>10}  "
+                f"{report['throughput']:8.1f} msg/s  "
+                f"batch p50 {report['batch_p50_seconds'] * 1000:7.1f} ms  "
+                f"p99 {report['batch_p99_seconds'] * 1000:7.1f} ms  "
+                f"{report['mean_tokens']:6.1f} tokens/msg  "
+                f"agreement {report['agreement']:.3f}  "
+                f"accuracy {accuracy}"
+            )
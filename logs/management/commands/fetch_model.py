@@ -0,0 +1,142 @@
+"""
+Django management command to store a pinned copy of a classifier in ANOMALY_MODEL_ROOT.
+"""
+import os
+import platform
+import shutil
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from logs.model_registry import ModelRegistry
+from logs.model_versions import (
+    WEIGHTS_FILE, activate, list_versions, model_root, verify_manifest, version_dir, write_manifest
+)
+
+
+class Command(BaseCommand):
+    help = 'Download a classifier into ANOMALY_MODEL_ROOT as a checksummed version for offline workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'version',
+            help='Name of the version directory to create, or to check with --verify'
+        )
+        parser.add_argument(
+            '--source',
+            type=str,
+            default=None,
+            help='Hugging Face model name or local checkpoint (defaults to ANOMALY_MODEL_NAME)'
+        )
+        parser.add_argument(
+            '--hub-revision',
+            type=str,
+            default=None,
+            help='Hub branch, tag or commit to pin (defaults to the latest commit of main)'
+        )
+        parser.add_argument(
+            '--activate',
+            action='store_true',
+            help='Point CURRENT at the new version'
+        )
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Check an existing version against its manifest and time a local load'
+        )
+
+    def handle(self, *args, **options):
+        root = model_root()
+        if not root:
+            raise CommandError('Set ANOMALY_MODEL_ROOT to store model versions')
+        try:
+            directory = version_dir(root, options['version'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        if options['verify']:
+            self.verify(options['version'], directory)
+            return
+        if directory.exists():
+            raise CommandError(f'{directory} already exists; versions are immutable, pick a new name')
+
+        self.fetch(options, directory)
+        self.verify(options['version'], directory)
+        if options['activate']:
+            activate(root, options['version'])
+            self.stdout.write(self.style.SUCCESS(f"CURRENT -> {options['version']}"))
+
+    def fetch(self, options, directory):
+        import torch
+        import transformers
+        from transformers import BertForSequenceClassification, BertTokenizer
+
+        source = options['source'] or settings.ANOMALY_MODEL_NAME
+        self.stdout.write(f"Fetching {source} ({options['hub_revision'] or 'latest'})")
+        start = time.perf_counter()
+        tokenizer = BertTokenizer.from_pretrained(source, revision=options['hub_revision'])
+        model = BertForSequenceClassification.from_pretrained(
+            source, num_labels=settings.ANOMALY_MODEL_NUM_LABELS, revision=options['hub_revision']
+        )
+
+        # Written next to the final directory and renamed, so a half-written
+        # version is never listed
+        tmp_dir = directory.with_name(f'.{directory.name}.{os.getpid()}.tmp')
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        try:
+            tokenizer.save_pretrained(tmp_dir)
+            model.save_pretrained(tmp_dir, safe_serialization=True)
+            if not (tmp_dir / WEIGHTS_FILE).exists():
+                raise CommandError(f'Expected a single {WEIGHTS_FILE}; sharded checkpoints cannot be memory-mapped')
+            manifest = write_manifest(tmp_dir, {
+                'source': source,
+                # Commit the hub resolved the revision to, so the version can be rebuilt
+                'hub_revision': getattr(model.config, '_commit_hash', None) or options['hub_revision'],
+                'num_labels': settings.ANOMALY_MODEL_NUM_LABELS,
+                'transformers': transformers.__version__,
+                'torch': torch.__version__,
+                'python': platform.python_version(),
+                'fetched_at': timezone.now().isoformat(),
+            })
+            os.replace(tmp_dir, directory)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        size = sum(entry['bytes'] for entry in manifest['files'].values())
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Stored {len(manifest['files'])} files ({size / 2**20:.1f} MiB) in {directory} "
+                f"in {time.perf_counter() - start:.1f}s, pinned at {manifest['hub_revision']}"
+            )
+        )
+
+    def verify(self, version, directory):
+        if version not in list_versions(directory.parent):
+            raise CommandError(f"Model version '{version}' not found in {directory.parent}")
+        try:
+            # A full check, whatever the last verification recorded
+            problems = verify_manifest(directory, trust_stamp=False)
+        except FileNotFoundError:
+            raise CommandError(f'{directory} has no manifest')
+        if problems:
+            raise CommandError(f"Model version '{version}' is corrupt: {'; '.join(problems)}")
+
+        # The same local load the workers do, memory-mapped only if theirs is
+        registry = ModelRegistry(
+            str(directory),
+            num_labels=settings.ANOMALY_MODEL_NUM_LABELS,
+            revision=version,
+            local_files_only=True,
+            verify_checksums=True,
+            mmap_weights=getattr(settings, 'ANOMALY_MODEL_MMAP_WEIGHTS', False),
+        )
+        stats = registry.warm_up()
+        registry.unload()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{version}: checksums OK ({stats['verify_time']:.2f}s), offline load {stats['load_time']:.2f}s, "
+                f"first passes {stats['warmup_time']:.2f}s"
+            )
+        )
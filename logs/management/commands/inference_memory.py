@@ -0,0 +1,76 @@
+"""
+Django management command to report the memory of a Celery worker's processes.
+"""
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from logs.model_registry import process_memory
+
+
+def child_pids(pid: int):
+    """Return the PIDs of a process's direct children (Linux)."""
+    children = []
+    for task in Path(f'/proc/{pid}/task').iterdir():
+        children.extend(int(child) for child in (task / 'children').read_text().split())
+    return sorted(set(children))
+
+
+class Command(BaseCommand):
+    help = 'Report RSS, PSS and USS of a Celery worker and its pool processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'pid',
+            type=int,
+            help='PID of the Celery worker main process'
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print the report as JSON'
+        )
+
+    def handle(self, *args, **options):
+        pid = options['pid']
+        try:
+            pids = [pid] + child_pids(pid)
+        except OSError as exc:
+            raise CommandError(f'Cannot read the processes of {pid}: {exc}')
+
+        processes = []
+        for process_pid in pids:
+            memory = process_memory(process_pid)
+            if memory['pss'] is None:
+                raise CommandError(f'No smaps_rollup for process {process_pid}, this report needs Linux')
+            processes.append(dict(memory, pid=process_pid, role='main' if process_pid == pid else 'child'))
+
+        # Summing RSS counts shared pages once per process: it is what
+        # the worker would use if every child loaded its own model copy.
+        # PSS splits shared pages between the processes mapping them.
+        totals = {
+            'rss': sum(process['rss'] for process in processes),
+            'pss': sum(process['pss'] for process in processes),
+            'uss': sum(process['uss'] for process in processes),
+        }
+        totals['shared_savings'] = totals['rss'] - totals['pss']
+
+        if options['json']:
+            self.stdout.write(json.dumps({'processes': processes, 'totals': totals}, indent=2))
+            return
+
+        self.stdout.write(f"{'pid':>8} {'role':>6} {'RSS MiB':>9} {'PSS MiB':>9} {'USS MiB':>9} {'shared MiB':>11}")
+        for process in processes:
+            self.stdout.write(
+                f"{process['pid']:>8} {process['role']:>6} "
+                f"{process['rss'] / 2**20:9.1f} {process['pss'] / 2**20:9.1f} "
+                f"{process['uss'] / 2**20:9.1f} {process['shared'] / 2**20:11.1f}"
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Total: RSS {totals['rss'] / 2**20:.1f} MiB, PSS {totals['pss'] / 2**20:.1f} MiB "
+                f"(actual), USS {totals['uss'] / 2**20:.1f} MiB; sharing saves "
+                f"{totals['shared_savings'] / 2**20:.1f} MiB over per-process copies"
+            )
+        )
@@ -0,0 +1,212 @@
+"""
+Django management command to load test the bulk ingestion endpoints over HTTP.
+"""
+import asyncio
+import json
+import random
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+SEVERITIES = ['DEBUG', 'INFO', 'INFO', 'INFO', 'WARNING', 'ERROR']
+MESSAGES = [
+    'GET /api/orders/{n} 200 in {ms}ms',
+    'Heartbeat {n} ok from worker-{w}',
+    'Cache miss for session {n}, loading from database',
+    'Timeout after {ms}ms waiting for payment gateway on worker-{w}',
+    'Connection reset by peer while reading from replica-{w}',
+]
+
+
+def make_body(entries: int) -> bytes:
+    """Return an NDJSON body of synthetic log entries."""
+    timestamp = timezone.now().isoformat()
+    lines = []
+    for _ in range(entries):
+        message = random.choice(MESSAGES).format(
+            n=random.randint(1, 10**6), ms=random.randint(1, 5000), w=random.randint(1, 32)
+        )
+        lines.append(json.dumps({'timestamp': timestamp, 'severity': random.choice(SEVERITIES), 'message': message}))
+    return '\n'.join(lines).encode()
+
+
+class HttpConnection:
+    """Minimal keep-alive HTTP/1.1 client on asyncio streams."""
+
+    def __init__(self, url: str):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.path = parts.path or '/'
+        self.reader = self.writer = None
+
+    async def post(self, body: bytes, timeout: float) -> int:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), timeout
+            )
+        head = (
+            f'POST {self.path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n'
+            f'Content-Type: application/x-ndjson\r\nContent-Length: {len(body)}\r\n\r\n'
+        )
+        self.writer.write(head.encode() + body)
+        return await asyncio.wait_for(self._read_response(), timeout)
+
+    async def _read_response(self) -> int:
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('Connection closed by the server')
+        status = int(status_line.split()[1])
+        length, close = 0, False
+        while True:
+            line = (await self.reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            if name.lower() == 'content-length':
+                length = int(value)
+            elif name.lower() == 'connection' and value.strip().lower() == 'close':
+                close = True
+        await self.reader.readexactly(length)
+        if close:
+            self.close()
+        return status
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def run_level(url: str, connections: int, duration: float, body: bytes, timeout: float):
+    """Keep ``connections`` clients posting for ``duration`` seconds."""
+    latencies, statuses, errors = [], {}, {}
+    deadline = time.perf_counter() + duration
+
+    async def client():
+        connection = HttpConnection(url)
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                status = await connection.post(body, timeout)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError) as exc:
+                errors[type(exc).__name__] = errors.get(type(exc).__name__, 0) + 1
+                connection.close()
+                await asyncio.sleep(0.05)
+                continue
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+        connection.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(connections)))
+    return latencies, statuses, errors, time.perf_counter() - start
+
+
+def failed_requests(statuses: dict, errors: dict) -> int:
+    """Requests that raised, or were answered with anything but a 2xx status."""
+    return sum(errors.values()) + sum(count for status, count in statuses.items() if not 200 <= status < 300)
+
+
+class Command(BaseCommand):
+    help = 'Compare how many concurrent connections the WSGI and ASGI bulk ingestion paths sustain'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--target',
+            action='append',
+            required=True,
+            help='name=URL of a bulk endpoint, repeatable, e.g. '
+                 'wsgi=http://127.0.0.1:8000/api/logs/bulk/ asgi=http://127.0.0.1:8001/api/logs/bulk/async/'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=str,
+            default='10,50,200,500',
+            help='Comma-separated numbers of concurrent connections to try'
+        )
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=15.0,
+            help='Seconds per concurrency level'
+        )
+        parser.add_argument(
+            '--entries',
+            type=int,
+            default=100,
+            help='Log entries per request'
+        )
+        parser.add_argument(
+            '--timeout',
+            type=float,
+            default=10.0,
+            help='Seconds before a request counts as failed'
+        )
+        parser.add_argument(
+            '--slo-ms',
+            type=float,
+            default=1000.0,
+            help='p99 latency a level must stay under to count as sustained'
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print the reports as JSON'
+        )
+
+    def handle(self, *args, **options):
+        targets = []
+        for target in options['target']:
+            name, _, url = target.partition('=')
+            if not url.startswith('http://'):
+                raise CommandError(f"Expected name=http://host:port/path, got '{target}'")
+            targets.append((name, url))
+        levels = [int(level) for level in options['concurrency'].split(',') if level.strip()]
+        body = make_body(options['entries'])
+
+        reports = []
+        for name, url in targets:
+            sustained = 0
+            for connections in levels:
+                self.stdout.write(f'{name}: {connections} connections for {options["duration"]:.0f}s')
+                latencies, statuses, errors, elapsed = asyncio.run(
+                    run_level(url, connections, options['duration'], body, options['timeout'])
+                )
+                completed = len(latencies)
+                failed = failed_requests(statuses, errors)
+                # Throughput only counts requests whose entries were accepted
+                succeeded = completed + sum(errors.values()) - failed
+                p50, p99 = (np.percentile(latencies, [50, 99]) * 1000).tolist() if latencies else (None, None)
+                error_rate = failed / (completed + sum(errors.values())) if completed or errors else 1.0
+                ok = error_rate < 0.01 and p99 is not None and p99 <= options['slo_ms']
+                if ok:
+                    sustained = connections
+                reports.append({
+                    'target': name,
+                    'connections': connections,
+                    'requests_per_second': succeeded / elapsed,
+                    'entries_per_second': succeeded * options['entries'] / elapsed,
+                    'p50_ms': p50,
+                    'p99_ms': p99,
+                    'error_rate': error_rate,
+                    'statuses': statuses,
+                    'errors': errors,
+                    'within_slo': ok,
+                })
+                report = reports[-1]
+                self.stdout.write(
+                    f"  {report['requests_per_second']:8.1f} req/s  {report['entries_per_second']:10.0f} entries/s  "
+                    f"p50 {p50 or 0:7.1f} ms  p99 {p99 or 0:7.1f} ms  errors {error_rate:.1%}"
+                    + ('' if ok else '  (over SLO)')
+                )
+            self.stdout.write(self.style.SUCCESS(
+                f'{name}: sustained {sustained} concurrent connections '
+                f'(p99 <= {options["slo_ms"]:.0f} ms, < 1% errors)'
+            ))
+
+        if options['json']:
+            self.stdout.write(json.dumps(reports, indent=2))
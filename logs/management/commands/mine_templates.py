@@ -0,0 +1,39 @@
+"""
+Django management command to assign templates to existing log entries.
+"""
+from django.core.management.base import BaseCommand
+
+from logs.models import LogEntry
+from logs.template_miner import assign_templates
+
+
+class Command(BaseCommand):
+    help = 'Mine message templates for log entries that do not have one yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of log entries mined per database round trip'
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        total = 0
+        last_id = 0
+
+        while True:
+            chunk = list(
+                LogEntry.objects.filter(template__isnull=True, id__gt=last_id).order_by('id')[:chunk_size]
+            )
+            if not chunk:
+                break
+            assign_templates(chunk)
+            total += len(chunk)
+            last_id = chunk[-1].id
+            self.stdout.write(f'Mined {total} log entries')
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Assigned templates to {total} log entries')
+        )
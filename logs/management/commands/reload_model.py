@@ -0,0 +1,84 @@
+"""
+Django management command to switch the anomaly classifier to another model version.
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from anomaly_detection.celery import app
+from logs.model_versions import activate, current_version, list_versions, model_root
+
+
+class Command(BaseCommand):
+    help = 'Point ANOMALY_MODEL_ROOT at a model version and hot-swap it into running workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'version',
+            nargs='?',
+            help='Model version (a directory in ANOMALY_MODEL_ROOT)'
+        )
+        parser.add_argument(
+            '--list',
+            action='store_true',
+            help='List the available versions and exit'
+        )
+        parser.add_argument(
+            '--no-broadcast',
+            action='store_true',
+            help='Only move the CURRENT pointer; workers switch when they restart'
+        )
+        parser.add_argument(
+            '--destination',
+            type=str,
+            default=None,
+            help='Comma-separated worker hostnames to reload (defaults to all workers)'
+        )
+        parser.add_argument(
+            '--timeout',
+            type=float,
+            default=5.0,
+            help='Seconds to wait for worker replies'
+        )
+
+    def handle(self, *args, **options):
+        root = model_root()
+        if not root:
+            raise CommandError('Set ANOMALY_MODEL_ROOT to use versioned models')
+
+        versions = list_versions(root)
+        if options['list'] or not options['version']:
+            current = current_version(root)
+            for version in versions:
+                self.stdout.write(f"{'*' if version == current else ' '} {version}")
+            if not versions:
+                self.stdout.write(self.style.WARNING(f'No model versions in {root}'))
+            return
+
+        version = options['version']
+        try:
+            activate(root, version)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(f"CURRENT -> {version}"))
+        if options['no_broadcast']:
+            return
+
+        destination = options['destination'].split(',') if options['destination'] else None
+        replies = app.control.broadcast(
+            'reload_model',
+            arguments={'revision': version},
+            destination=destination,
+            reply=True,
+            timeout=options['timeout'],
+        )
+        if not replies:
+            self.stdout.write(self.style.WARNING('No worker replied; running workers keep their model'))
+        for reply in replies:
+            for hostname, answer in reply.items():
+                if 'error' in answer:
+                    self.stdout.write(self.style.ERROR(f"{hostname}: {answer['error']}"))
+                else:
+                    self.stdout.write(f"{hostname}: {answer['ok']}")
+        self.stdout.write(
+            'Workers load and warm up the new version in the background; '
+            'check /api/health/ for the version each worker runs'
+        )
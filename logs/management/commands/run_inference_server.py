@@ -0,0 +1,77 @@
+"""
+Django management command to run the node-local inference server.
+"""
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from logs import model_reload
+from logs.inference import get_engine
+from logs.inference_server import InferenceServer
+from logs.model_registry import get_registry
+from logs.model_versions import current_version, model_root
+from logs.thread_budget import apply_thread_budget, plan_threads
+
+
+class Command(BaseCommand):
+    help = 'Serve the anomaly classifier to every worker on this node over a Unix socket'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--socket',
+            type=str,
+            default=None,
+            help='Socket path (defaults to ANOMALY_INFERENCE_SOCKET)'
+        )
+        parser.add_argument(
+            '--no-warmup',
+            action='store_true',
+            help='Load the model on the first request instead of at startup'
+        )
+
+    def handle(self, *args, **options):
+        path = options['socket'] or settings.ANOMALY_INFERENCE_SOCKET
+        if not path:
+            raise CommandError('Pass --socket or set ANOMALY_INFERENCE_SOCKET')
+        path = str(path)
+
+        # The server is the only inference process, so it gets every core
+        budget = plan_threads(processes=1)
+        apply_thread_budget(budget)
+        registry = get_registry()
+        if not options['no_warmup']:
+            stats = registry.warm_up()
+            self.stdout.write(f"Warmed up {stats['model_version']} in {stats['warmup_time']:.2f}s")
+
+        root = model_root()
+        if root:
+            # Not a Celery worker, so follow the CURRENT pointer instead of broadcasts
+            reloader = model_reload.ModelReloader(
+                getattr(settings, 'ANOMALY_WARMUP_MESSAGES', None),
+                warmup_rounds=getattr(settings, 'ANOMALY_WARMUP_ROUNDS', 1),
+            )
+            model_reload.watch(
+                reloader, lambda: current_version(root), interval=getattr(settings, 'ANOMALY_MODEL_RELOAD_POLL', 1.0)
+            )
+
+        server = InferenceServer(path, get_engine())
+
+        def stop(signum, frame):
+            # shutdown() waits for serve_forever(), so it cannot run on this thread
+            threading.Thread(target=server.shutdown).start()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Inference server listening on {path} ({budget})')
+        )
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            get_engine().shutdown()
+            get_registry().unload()
+        self.stdout.write(self.style.WARNING('Inference server stopped'))
@@ -0,0 +1,59 @@
+"""
+Django management command to drain the write-behind ingestion buffer.
+"""
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from logs.ingest_buffer import IngestFlusher, get_ingest_buffer
+
+
+class Command(BaseCommand):
+    help = 'Insert buffered log entries in bulk and queue their analysis'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=None,
+            help='Seconds between flushes (defaults to ANOMALY_INGEST_FLUSH_INTERVAL)'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Flush what is buffered now, including segments left by a crash, and exit'
+        )
+
+    def handle(self, *args, **options):
+        buffer = get_ingest_buffer()
+        flusher = IngestFlusher(
+            buffer,
+            insert_chunk=getattr(settings, 'ANOMALY_BULK_INSERT_CHUNK', 1000),
+            analysis_chunk=getattr(settings, 'ANOMALY_BULK_ANALYSIS_CHUNK', 500),
+        )
+
+        if options['once']:
+            try:
+                with flusher.exclusive():
+                    replayed = flusher.recover()
+                    rows = flusher.flush_once()
+            except RuntimeError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(
+                f'Flushed {rows} log entries ({replayed} segments replayed) from {buffer.directory}'
+            ))
+            return
+
+        interval = options['interval'] or getattr(settings, 'ANOMALY_INGEST_FLUSH_INTERVAL', 1.0)
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+        signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+
+        self.stdout.write(self.style.SUCCESS(f'Flushing {buffer.directory} every {interval:g}s'))
+        try:
+            flusher.run(interval, stop)
+        except RuntimeError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.WARNING('Ingest flusher stopped'))
@@ -1,7 +1,9 @@
 """
 Django management command to start Celery worker.
 """
+from django.conf import settings
 from django.core.management.base import BaseCommand
+from logs.thread_budget import plan_threads
 import subprocess
 import sys
 import os
@@ -38,6 +40,12 @@ class Command(BaseCommand):
         self.stdout.write(
             self.style.SUCCESS(f'Starting Celery worker with queues: {queues}')
         )
+
+        # Report how the inference processes will share the cores
+        if set(queues.split(',')) & set(settings.ANOMALY_INFERENCE_QUEUES) and settings.ANOMALY_THREAD_BUDGET_ENABLED:
+            budget = plan_threads(processes=concurrency)
+            style = self.style.WARNING if budget.oversubscribed else self.style.SUCCESS
+            self.stdout.write(style(f'CPU thread budget: {budget}'))
         
         # Build the celery command
         cmd = [
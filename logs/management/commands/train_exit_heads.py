@@ -0,0 +1,141 @@
+"""
+Django management command to train the early-exit heads of the anomaly classifier.
+"""
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from logs.benchmark import load_corpus
+from logs.early_exit import ExitHeads, fit_head, fit_head_temperature, get_early_exit_policy
+from logs.inference import run_bucketed
+from logs.model_registry import build_registry
+from logs.model_versions import EXIT_HEADS_FILE, model_root
+
+
+class Command(BaseCommand):
+    help = 'Distil linear heads on intermediate encoder layers from the full classifier, for early exit'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'version',
+            nargs='?',
+            help='Model version (a directory in ANOMALY_MODEL_ROOT) to distil the heads from; defaults to CURRENT'
+        )
+        parser.add_argument(
+            '--corpus',
+            type=str,
+            default=None,
+            help='Message file (plain lines or JSON lines with "message" and optional "severity"); '
+                 'defaults to recent log entries. No labels needed: the heads learn the full model\'s verdicts'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=20000,
+            help='Maximum number of training messages'
+        )
+        parser.add_argument(
+            '--layers',
+            type=str,
+            default=','.join(str(layer) for layer in settings.ANOMALY_EARLY_EXIT_LAYERS),
+            help='Comma-separated encoder layers (1-based) to attach a head to'
+        )
+        parser.add_argument(
+            '--epochs',
+            type=int,
+            default=200,
+            help='Gradient descent steps per head'
+        )
+        parser.add_argument(
+            '--holdout',
+            type=float,
+            default=0.2,
+            help='Fraction of the corpus held out to measure agreement with the full model'
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            default=None,
+            help='Where to write the heads; defaults to the version\'s directory, or ANOMALY_EARLY_EXIT_HEADS '
+                 'for unversioned models'
+        )
+
+    def handle(self, *args, **options):
+        import torch
+
+        try:
+            layers = sorted({int(layer) for layer in options['layers'].split(',') if layer.strip()})
+        except ValueError:
+            raise CommandError('--layers takes comma-separated layer numbers')
+        messages, _, severities = load_corpus(options['corpus'], options['limit'], with_severities=True)
+        if not messages:
+            raise CommandError('The training corpus is empty')
+
+        if options['version'] and not model_root():
+            raise CommandError('A model version needs ANOMALY_MODEL_ROOT')
+        registry = build_registry(options['version'])
+        output = options['output']
+        if output is None and registry.revision:
+            # Heads belong to the weights they were distilled from
+            output = str(Path(registry.model_name) / EXIT_HEADS_FILE)
+        elif output is None:
+            output = str(settings.ANOMALY_EARLY_EXIT_HEADS or settings.BASE_DIR / 'model_cache' / EXIT_HEADS_FILE)
+        _, model = registry.get()
+        num_layers = model.config.num_hidden_layers
+        if not layers or layers[0] < 1 or layers[-1] >= num_layers:
+            raise CommandError(f'Head layers must lie between 1 and {num_layers - 1}')
+
+        def forward(inputs):
+            # hidden_states[0] is the embedding output, so layer n is at index n
+            outputs = model(**inputs, output_hidden_states=True)
+            return torch.cat([outputs.hidden_states[layer][:, 0] for layer in layers] + [outputs.logits], dim=-1)
+
+        self.stdout.write(f'Collecting [CLS] states of layers {layers} over {len(messages)} messages')
+        rows = run_bucketed(messages, forward, registry, severities=severities).numpy()
+        hidden = model.config.hidden_size
+        features = {layer: rows[:, index * hidden:(index + 1) * hidden] for index, layer in enumerate(layers)}
+        full_logits = rows[:, len(layers) * hidden:] / registry.temperature
+        targets = full_logits.argmax(axis=-1)
+        full_probabilities = np.exp(full_logits - full_logits.max(axis=-1, keepdims=True))
+        full_probabilities /= full_probabilities.sum(axis=-1, keepdims=True)
+
+        order = np.random.default_rng(0).permutation(len(messages))
+        holdout = int(len(messages) * options['holdout'])
+        train, test = order[holdout:], order[:holdout]
+
+        fitted = {
+            layer: fit_head(features[layer][train], targets[train], num_labels=model.config.num_labels,
+                            epochs=options['epochs'])
+            for layer in layers
+        }
+        # Calibrate each head on the holdout (the training split when there is none)
+        calibration = test if len(test) else train
+        temperatures = {
+            layer: fit_head_temperature(features[layer][calibration] @ weight + bias, full_probabilities[calibration])
+            for layer, (weight, bias) in fitted.items()
+        }
+        heads = ExitHeads(fitted, temperatures)
+        heads.save(output)
+        self.stdout.write(
+            self.style.SUCCESS(f'Trained heads for layers {layers} on {len(train)} messages, saved to {output}')
+        )
+        self.stdout.write('Head temperatures: ' + ', '.join(f'{layer}: {temperatures[layer]}' for layer in layers))
+
+        if not len(test):
+            return
+        policy = get_early_exit_policy()
+        thresholds = np.array([policy.threshold(severities[i]) for i in test])
+        for layer in layers:
+            weight, bias = heads.heads[layer]
+            logits = (features[layer][test] @ weight + bias) / heads.temperatures[layer]
+            probabilities = np.exp(logits - logits.max(axis=-1, keepdims=True))
+            probabilities /= probabilities.sum(axis=-1, keepdims=True)
+            predictions = probabilities.argmax(axis=-1)
+            confident = probabilities.max(axis=-1) >= thresholds
+            agreement = (predictions[confident] == targets[test][confident]).mean() if confident.any() else 0.0
+            self.stdout.write(
+                f'Layer {layer:>2}: agrees with the full model on {(predictions == targets[test]).mean():.1%} '
+                f'of the holdout; {confident.mean():.1%} confident enough to exit, {agreement:.1%} of them agreeing'
+            )
@@ -0,0 +1,87 @@
+"""
+Django management command to train the tier-0 cascade scorer.
+"""
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from logs.benchmark import load_corpus
+from logs.cascade import Tier0Scorer, split_by_confidence
+
+
+class Command(BaseCommand):
+    help = 'Train the hashed-feature tier-0 scorer that decides confident messages before BERT'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--corpus',
+            type=str,
+            default=None,
+            help='JSON lines with "message", "label" and optional "severity"; '
+                 'defaults to log entries labelled by their anomaly reports'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=100000,
+            help='Maximum number of training messages'
+        )
+        parser.add_argument(
+            '--epochs',
+            type=int,
+            default=5,
+            help='Passes of stochastic gradient descent over the corpus'
+        )
+        parser.add_argument(
+            '--dimensions',
+            type=int,
+            default=2 ** 18,
+            help='Number of hashed feature buckets'
+        )
+        parser.add_argument(
+            '--holdout',
+            type=float,
+            default=0.2,
+            help='Fraction of the corpus held out to evaluate the confidence band'
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            default=str(settings.ANOMALY_TIER0_WEIGHTS),
+            help='Where to write the weights'
+        )
+
+    def handle(self, *args, **options):
+        messages, labels, severities = load_corpus(
+            options['corpus'], options['limit'], with_severities=True, report_labels=True
+        )
+        if not messages or labels is None:
+            raise CommandError('The tier-0 scorer needs a non-empty labelled corpus')
+
+        order = np.random.default_rng(0).permutation(len(messages))
+        holdout = int(len(messages) * options['holdout'])
+        train, test = order[holdout:], order[:holdout]
+
+        scorer = Tier0Scorer.fit(
+            [messages[i] for i in train],
+            [labels[i] for i in train],
+            [severities[i] for i in train],
+            dimensions=options['dimensions'],
+            epochs=options['epochs'],
+        )
+        scorer.save(options['output'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Trained tier-0 scorer on {len(train)} messages, saved to {options["output"]}')
+        )
+
+        if len(test):
+            low, high = settings.ANOMALY_TIER0_BAND
+            probabilities = scorer.score([messages[i] for i in test], [severities[i] for i in test])
+            decided, uncertain = split_by_confidence(probabilities, low, high)
+            correct = sum(int(probability >= 0.5) == labels[test[index]] for index, probability in decided.items())
+            self.stdout.write(
+                f'Holdout of {len(test)} messages with band ({low}, {high}): '
+                f'{len(decided) / len(test):.1%} decided at tier 0, '
+                f'{correct / len(decided) if decided else 0:.1%} of them correct, '
+                f'{len(uncertain)} sent to BERT'
+            )
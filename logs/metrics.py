@@ -0,0 +1,133 @@
+"""
+Lightweight in-process metrics for the inference path.
+
+Counters and histograms live in the process that records them (typically a
+Celery worker child) and are reported through ``get_inference_stats``.
+"""
+import bisect
+import threading
+from typing import Any, Dict, List, Sequence
+
+# Bucket upper bounds, in seconds, for latency histograms
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+
+class Counter:
+    """Monotonic counter."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+    def snapshot(self) -> int:
+        return self._value
+
+    def reset(self):
+        with self._lock:
+            self._value = 0
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram with approximate percentiles.
+
+    Args:
+        name (str): Metric name
+        buckets (Sequence[float]): Sorted bucket upper bounds
+    """
+
+    def __init__(self, name: str, buckets: Sequence[float]):
+        self.name = name
+        self.buckets = list(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._max = None
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._sum += value
+            if self._max is None or value > self._max:
+                self._max = value
+
+    def percentile(self, fraction: float):
+        """Return the upper bound of the bucket holding the given percentile."""
+        if not self._count:
+            return None
+        target = fraction * self._count
+        cumulative = 0
+        for index, count in enumerate(self._counts):
+            cumulative += count
+            if cumulative >= target:
+                return self.buckets[index] if index < len(self.buckets) else self._max
+        return self._max
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            buckets = {
+                str(bound): count for bound, count in zip(self.buckets + ['+Inf'], self._counts)
+            }
+            return {
+                'count': self._count,
+                'sum': self._sum,
+                'mean': self._sum / self._count if self._count else None,
+                'max': self._max,
+                'p50': self.percentile(0.5),
+                'p99': self.percentile(0.99),
+                'buckets': buckets,
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counts = [0] * (len(self.buckets) + 1)
+            self._count = 0
+            self._sum = 0.0
+            self._max = None
+
+
+_metrics: Dict[str, Any] = {}
+_metrics_lock = threading.Lock()
+
+
+def counter(name: str) -> Counter:
+    """Return the process-wide counter with the given name."""
+    with _metrics_lock:
+        if name not in _metrics:
+            _metrics[name] = Counter(name)
+        return _metrics[name]
+
+
+def histogram(name: str, buckets: List[float] = LATENCY_BUCKETS) -> Histogram:
+    """Return the process-wide histogram with the given name."""
+    with _metrics_lock:
+        if name not in _metrics:
+            _metrics[name] = Histogram(name, buckets)
+        return _metrics[name]
+
+
+def snapshot() -> Dict[str, Any]:
+    """Return the current value of every metric in this process."""
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    return {name: metric.snapshot() for name, metric in sorted(metrics.items())}
+
+
+def reset():
+    """Reset every metric in this process."""
+    with _metrics_lock:
+        metrics = list(_metrics.values())
+    for metric in metrics:
+        metric.reset()
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.1 on 2026-10-17 02:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logs', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LogTemplate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('template', models.TextField()),
+                ('signature', models.CharField(max_length=32, unique=True)),
+                ('token_count', models.PositiveIntegerField()),
+                ('count', models.PositiveBigIntegerField(default=0)),
+                ('first_seen', models.DateTimeField(blank=True, null=True)),
+                ('last_seen', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='logentry',
+            name='template',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='entries', to='logs.logtemplate'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-17 02:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logs', '0002_log_templates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='logentry',
+            name='anomaly_probability',
+            field=models.FloatField(blank=True, db_index=True, null=True),
+        ),
+    ]
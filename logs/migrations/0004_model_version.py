@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-17 02:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logs', '0003_anomaly_probability'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='logentry',
+            name='model_version',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
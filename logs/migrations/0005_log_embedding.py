@@ -0,0 +1,22 @@
+# Generated by Django 5.2.1 on 2026-10-17 02:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logs', '0004_model_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LogEmbedding',
+            fields=[
+                ('log_entry', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='embedding', serialize=False, to='logs.logentry')),
+                ('model_version', models.CharField(db_index=True, max_length=255)),
+                ('vector', models.BinaryField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.1 on 2026-10-17 02:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logs', '0005_log_embedding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LogRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('pattern', models.TextField(help_text='Regular expression (regex module syntax) searched in the message')),
+                ('verdict', models.CharField(choices=[('anomalous', 'Anomalous'), ('normal', 'Normal')], max_length=10)),
+                ('enabled', models.BooleanField(default=True)),
+                ('hit_count', models.PositiveBigIntegerField(default=0)),
+                ('last_hit', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
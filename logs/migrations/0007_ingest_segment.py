@@ -0,0 +1,26 @@
+# Generated by Django 5.2.1 on 2026-10-17 03:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logs', '0006_log_rules'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('rows', models.PositiveIntegerField()),
+                ('bytes', models.PositiveBigIntegerField()),
+                ('flush_seconds', models.FloatField()),
+                ('lag_seconds', models.FloatField(help_text='Time from the segment being sealed to its rows being committed')),
+                ('replayed', models.BooleanField(default=False, help_text='Left over by a previous flusher run')),
+                ('flushed_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
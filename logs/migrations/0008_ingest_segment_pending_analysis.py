@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-17 03:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logs', '0007_ingest_segment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestsegment',
+            name='pending_analysis',
+            field=models.JSONField(blank=True, help_text='[first, last] ID ranges whose analysis has not been queued yet', null=True),
+        ),
+    ]
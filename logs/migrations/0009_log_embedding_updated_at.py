@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-17 03:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logs', '0008_ingest_segment_pending_analysis'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='logembedding',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,512 @@
+"""
+Process-scoped registry for the BERT anomaly classifier.
+
+The tokenizer and model are loaded lazily on first use, so web processes,
+management commands and tests that never run inference do not pay the
+torch + BERT import and load cost. Celery workers consuming the inference
+queues warm the registry up from the worker lifecycle hooks in
+``logs/worker.py``.
+"""
+import gc
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+PRECISIONS = ('fp32', 'int8', 'bf16')
+
+# CPU flags of native bf16 matmul support: AVX512-BF16 and AMX on x86,
+# the BF16 extension on Arm
+BF16_CPU_FLAGS = ('avx512_bf16', 'amx_bf16', 'bf16')
+
+DEFAULT_WARMUP_MESSAGES = [
+    'Service started successfully',
+    'Database connection timeout after 30 seconds',
+]
+
+
+def current_rss_bytes() -> int:
+    """
+    Return the resident set size of the current process in bytes.
+
+    Reads ``/proc/self/statm`` where available and falls back to the peak
+    RSS reported by ``getrusage`` on other POSIX platforms; returns 0 where
+    neither exists (Windows).
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            resident_pages = int(statm.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux and the BSDs
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def cpu_supports_bf16(cpuinfo_path: str = '/proc/cpuinfo') -> bool:
+    """
+    Return True when the CPU has native bf16 instructions.
+
+    Without them PyTorch emulates bf16 and autocast is slower than fp32.
+    Reads the flags in ``/proc/cpuinfo`` (Linux); elsewhere returns False.
+    """
+    try:
+        with open(cpuinfo_path) as cpuinfo:
+            for line in cpuinfo:
+                key, _, value = line.partition(':')
+                if key.strip() in ('flags', 'Features'):
+                    return any(flag in BF16_CPU_FLAGS for flag in value.split())
+    except OSError:
+        pass
+    return False
+
+
+def process_memory(pid: Optional[int] = None) -> Dict[str, Optional[int]]:
+    """
+    Return the RSS, PSS, USS and shared memory of a process in bytes.
+
+    USS (pages only this process maps) is what the process really costs;
+    RSS counts pages shared with forked siblings in full. Reads
+    ``/proc/<pid>/smaps_rollup`` (Linux); elsewhere only RSS is known.
+    """
+    fields = {}
+    try:
+        with open(f"/proc/{pid or 'self'}/smaps_rollup") as smaps:
+            for line in smaps:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == 'kB':
+                    fields[parts[0].rstrip(':')] = int(parts[1]) * 1024
+    except OSError:
+        pass
+
+    if not fields:
+        return {'rss': current_rss_bytes() if pid is None else None, 'pss': None, 'uss': None, 'shared': None}
+    return {
+        'rss': fields.get('Rss'),
+        'pss': fields.get('Pss'),
+        'uss': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0),
+        'shared': fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0),
+    }
+
+
+class ModelRegistry:
+    """
+    Lazily loads and holds one tokenizer/model pair per process.
+
+    Args:
+        model_name (str): Hugging Face model name or local path
+        num_labels (int): Number of output classes of the classifier
+        precision (str): ``'fp32'``, ``'int8'`` for dynamic int8
+            quantization of the linear layers (CPU only), or ``'bf16'`` to
+            run the forward pass under CPU autocast. ``'bf16'`` falls back
+            to ``'fp32'`` when the CPU lacks native bf16 support, unless
+            ``allow_emulated_bf16`` is set
+        backend (str): Execution backend from ``logs.backends.BACKENDS``
+        cache_dir (str): Directory for compiled backend artifacts
+        temperature (float): Softmax temperature calibrating the anomaly
+            probabilities of this model
+        mmap_weights (bool): Back fp32 weights with a memory-mapped
+            safetensors file in ``cache_dir``, shared between processes
+        allow_emulated_bf16 (bool): Keep ``'bf16'`` on CPUs without native
+            support, e.g. to check parity on a development machine
+        revision (str): Version name in ``ANOMALY_MODEL_ROOT``; identifies
+            the model in place of its path
+        local_files_only (bool): Never contact the Hugging Face hub
+        verify_checksums (bool): Check a versioned model's files against
+            its manifest before loading them
+        exit_heads (str): Path of early-exit heads (``logs.early_exit``)
+            distilled from this model; when the file exists, the encoder
+            runs layer by layer and confident messages stop at an
+            intermediate head
+        early_exit (EarlyExitPolicy): Per-severity exit thresholds,
+            defaults to the configured ones
+    """
+
+    def __init__(self, model_name: str, num_labels: int = 2, precision: str = 'fp32',
+                 backend: str = 'eager', cache_dir: Optional[str] = None, temperature: float = 1.0,
+                 mmap_weights: bool = False, allow_emulated_bf16: bool = False,
+                 revision: Optional[str] = None, local_files_only: bool = False,
+                 verify_checksums: bool = False, exit_heads: Optional[str] = None, early_exit=None):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown inference precision '{precision}', expected one of {PRECISIONS}")
+        if precision == 'bf16' and backend != 'eager':
+            raise ValueError(f"bf16 autocast runs on the eager backend, not '{backend}'")
+        if exit_heads and backend != 'eager':
+            raise ValueError(f"Early exit runs the encoder layer by layer on the eager backend, not '{backend}'")
+        self.model_name = model_name
+        self.revision = revision
+        self.num_labels = num_labels
+        self.requested_precision = precision
+        if precision == 'bf16' and not (allow_emulated_bf16 or cpu_supports_bf16()):
+            logger.warning("This CPU has no native bf16 support, running the anomaly classifier in fp32")
+            precision = 'fp32'
+        self.precision = precision
+        self.backend = backend
+        self.cache_dir = cache_dir
+        self.temperature = temperature
+        self.mmap_weights = mmap_weights
+        self.local_files_only = local_files_only
+        self.verify_checksums = verify_checksums
+        self.exit_heads = exit_heads
+        self.exit_heads_digest = None
+        self.early_exit = None
+        if exit_heads and os.path.isfile(exit_heads):
+            from .early_exit import get_early_exit_policy
+            from .model_versions import sha256_file
+
+            # The heads change verdicts as much as the thresholds do
+            self.exit_heads_digest = sha256_file(exit_heads)[:8]
+            self.early_exit = early_exit or get_early_exit_policy()
+        elif exit_heads:
+            logger.warning(f"No early-exit heads at {exit_heads}, every message runs the full encoder")
+        self.exit_stats = {'messages': 0, 'layers': 0, 'exits': {}}
+        self._exit_heads = None
+        self._lock = threading.Lock()
+        self._tokenizer = None
+        self._model = None
+        self._backend = None
+        self._load_time = None
+        self._verify_time = None
+        self._loaded_at = None
+        self._rss_before_load = None
+        self._rss_after_load = None
+        self._loaded_in_pid = None
+        self._weights_mapped = False
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._model is not None
+
+    @property
+    def version(self) -> str:
+        """Identifies the verdicts this model produces, for caching and tagging results."""
+        version = f'{self.revision or self.model_name}:{self.precision}:t{self.temperature}'
+        if self.early_exit is not None:
+            version = f'{version}:exit-{self.early_exit.signature}-{self.exit_heads_digest}'
+        return version
+
+    def get(self):
+        """
+        Return the ``(tokenizer, model)`` pair, loading it on first call.
+        """
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._load()
+        return self._tokenizer, self._model
+
+    def forward(self, inputs):
+        """
+        Run the configured backend over tokenized inputs and return the logits.
+
+        In bf16 mode the weights stay fp32 and autocast runs the matmuls in
+        bf16; the logits come back as bf16.
+        """
+        self.get()
+        if self.precision == 'bf16':
+            import torch
+
+            with torch.inference_mode(), torch.autocast('cpu', dtype=torch.bfloat16):
+                return self._backend(inputs)
+        return self._backend(inputs)
+
+    def forward_early_exit(self, inputs, thresholds):
+        """
+        Run the encoder layer by layer and return the logits, letting each
+        row exit at the first head reaching its threshold.
+
+        Falls back to ``forward`` when no heads were loaded.
+        """
+        from .early_exit import early_exit_logits
+
+        _, model = self.get()
+        if self._exit_heads is None:
+            return self.forward(inputs)
+        if self.precision == 'bf16':
+            import torch
+
+            with torch.inference_mode(), torch.autocast('cpu', dtype=torch.bfloat16):
+                logits, layers = early_exit_logits(model, self._exit_heads, inputs, thresholds, self.temperature)
+        else:
+            logits, layers = early_exit_logits(model, self._exit_heads, inputs, thresholds, self.temperature)
+
+        histogram = metrics.histogram('inference.exit_layer', list(range(1, model.config.num_hidden_layers + 1)))
+        for layer in layers:
+            histogram.observe(layer)
+            self.exit_stats['exits'][layer] = self.exit_stats['exits'].get(layer, 0) + 1
+        self.exit_stats['messages'] += len(layers)
+        self.exit_stats['layers'] += sum(layers)
+        return logits
+
+    def embed(self, inputs):
+        """
+        Return the pooled ``[CLS]`` embedding of tokenized inputs.
+
+        Runs the eager encoder whatever the configured backend, since
+        compiled graphs only return the logits.
+        """
+        _, model = self.get()
+        if self.precision == 'bf16':
+            import torch
+
+            with torch.inference_mode(), torch.autocast('cpu', dtype=torch.bfloat16):
+                return model.bert(**inputs).pooler_output
+        return model.bert(**inputs).pooler_output
+
+    def _mapped_weights_path(self, weights: str):
+        from pathlib import Path
+
+        from .backends import cache_key
+        from .model_versions import WEIGHTS_FILE
+        from .shared_weights import weights_path
+
+        # bf16 autocast keeps the fp32 weights, so they can be mapped as well
+        if not self.mmap_weights or self.precision == 'int8':
+            return None
+        # A versioned model's own safetensors file is mapped directly
+        if self.revision and (Path(self.model_name) / WEIGHTS_FILE).exists():
+            return Path(self.model_name) / WEIGHTS_FILE
+        if self.cache_dir:
+            return weights_path(self.cache_dir, cache_key(self.model_name, 'fp32', weights))
+        return None
+
+    def _load(self):
+        from transformers import BertTokenizer, BertForSequenceClassification
+
+        from .backends import build_backend, cache_key, weights_fingerprint
+        from .model_versions import verify_manifest
+        from .shared_weights import map_weights
+
+        logger.info(f"Loading anomaly classifier '{self.model_name}' in process {os.getpid()}")
+        self._rss_before_load = current_rss_bytes()
+        start = time.perf_counter()
+
+        if self.revision and self.verify_checksums:
+            try:
+                problems = verify_manifest(self.model_name)
+            except FileNotFoundError:
+                logger.warning(f"Model version '{self.revision}' has no manifest, loading it unchecked")
+            else:
+                if problems:
+                    raise ValueError(f"Model version '{self.revision}' is corrupt: {'; '.join(problems)}")
+                self._verify_time = time.perf_counter() - start
+
+        tokenizer = BertTokenizer.from_pretrained(self.model_name, local_files_only=self.local_files_only)
+        model = BertForSequenceClassification.from_pretrained(
+            self.model_name, num_labels=self.num_labels, local_files_only=self.local_files_only
+        )
+        model.eval()
+        # Compiled artifacts and exported weights are only reused for the same weights
+        weights = weights_fingerprint(self.model_name, model)
+        mapped_path = self._mapped_weights_path(weights)
+        if mapped_path is not None:
+            model = map_weights(model, mapped_path)
+            self._weights_mapped = True
+        elif self.mmap_weights:
+            logger.info(
+                f"Only fp32 and bf16 weights of a versioned model or with a cache directory "
+                f"can be memory-mapped, loading {self.precision} weights privately"
+            )
+        model = self._apply_precision(model)
+        if self.early_exit is not None:
+            from .early_exit import load_exit_heads
+
+            self._exit_heads = load_exit_heads(self.exit_heads)
+        backend = build_backend(
+            self.backend, model, tokenizer, self.cache_dir, cache_key(self.model_name, self.precision, weights)
+        )
+
+        self._load_time = time.perf_counter() - start
+        metrics.histogram('model.load_seconds').observe(self._load_time)
+        self._loaded_at = time.time()
+        self._tokenizer = tokenizer
+        self._backend = backend
+        self._model = model
+        self._rss_after_load = current_rss_bytes()
+        self._loaded_in_pid = os.getpid()
+
+        logger.info(
+            f"Loaded {self.precision} anomaly classifier ({backend.name} backend) in {self._load_time:.2f}s "
+            f"(checksums {self._verify_time or 0:.2f}s, RSS {self._rss_after_load / 2**20:.0f} MiB)"
+        )
+
+    def _apply_precision(self, model):
+        if self.precision == 'int8':
+            import torch
+
+            # Weights of every nn.Linear are stored as int8; activations are
+            # quantized on the fly, so no calibration data is needed
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        return model
+
+    def warm_up(self, messages: Optional[Iterable[str]] = None, rounds: int = 1) -> Dict[str, Any]:
+        """
+        Load the model and run forward passes so the first real request
+        does not pay initialisation costs.
+
+        Args:
+            messages (Iterable[str]): Messages used for the warm-up batch
+            rounds (int): Number of passes over the batch; traced and
+                compiled backends specialize during the first few
+
+        Returns:
+            dict: Registry statistics including warm-up time, in total and
+            per round
+        """
+        import torch
+
+        tokenizer, _ = self.get()
+        messages = list(messages or DEFAULT_WARMUP_MESSAGES)
+
+        timings = []
+        for _ in range(max(rounds, 1)):
+            start = time.perf_counter()
+            inputs = tokenizer(messages, return_tensors='pt', truncation=True, padding=True, max_length=512)
+            with torch.no_grad():
+                self.forward(inputs)
+            timings.append(time.perf_counter() - start)
+        warmup_time = sum(timings)
+
+        logger.info(
+            f"Warmed up anomaly classifier with {len(messages)} messages x {len(timings)} rounds "
+            f"in {warmup_time:.2f}s"
+        )
+        stats = self.stats()
+        stats['warmup_time'] = warmup_time
+        stats['warmup_rounds'] = timings
+        return stats
+
+    def unload(self):
+        """
+        Release the model and tokenizer held by this process.
+        """
+        with self._lock:
+            if self._model is None:
+                return
+            self._tokenizer = None
+            self._backend = None
+            self._model = None
+            self._exit_heads = None
+            self._load_time = None
+            self._verify_time = None
+            self._loaded_at = None
+            self._loaded_in_pid = None
+            self._weights_mapped = False
+        gc.collect()
+        logger.info(f"Unloaded anomaly classifier in process {os.getpid()}")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Report load state, load time and memory for this process.
+
+        ``inherited`` is True in a prefork child using the model its parent
+        loaded before forking.
+        """
+        memory = process_memory()
+        return {
+            'pid': os.getpid(),
+            'model_name': self.model_name,
+            'revision': self.revision,
+            'model_version': self.version,
+            'precision': self.precision,
+            'requested_precision': self.requested_precision,
+            'backend': self._backend.name if self._backend else self.backend,
+            'loaded': self.is_loaded,
+            'load_time': self._load_time,
+            'verify_time': self._verify_time,
+            'loaded_at': self._loaded_at,
+            'inherited': self.is_loaded and self._loaded_in_pid != os.getpid(),
+            'weights_mapped': self._weights_mapped,
+            'early_exit': self._exit_heads.layers if self._exit_heads is not None else None,
+            'avg_layers': (
+                self.exit_stats['layers'] / self.exit_stats['messages'] if self.exit_stats['messages'] else None
+            ),
+            'rss_bytes': memory['rss'],
+            'pss_bytes': memory['pss'],
+            'uss_bytes': memory['uss'],
+            'shared_bytes': memory['shared'],
+            'rss_before_load_bytes': self._rss_before_load,
+            'rss_after_load_bytes': self._rss_after_load,
+        }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def build_registry(revision: Optional[str] = None) -> ModelRegistry:
+    """
+    Create a registry from settings.
+
+    With ``ANOMALY_MODEL_ROOT`` the model is loaded from the given version's
+    directory, or the one ``CURRENT`` points at, without contacting the hub;
+    otherwise from ``ANOMALY_MODEL_NAME``. Early-exit heads come with the
+    version (see ``logs.early_exit.find_exit_heads``).
+    """
+    from .early_exit import find_exit_heads
+    from .model_versions import current_version, model_root, read_temperature, version_dir
+
+    model_name = getattr(settings, 'ANOMALY_MODEL_NAME', 'bert-base-uncased')
+    temperature = getattr(settings, 'ANOMALY_CALIBRATION_TEMPERATURE', 1.0)
+    root = model_root()
+    revision = revision or (current_version(root) if root else None)
+    if revision:
+        model_name = str(version_dir(root, revision))
+        temperature = read_temperature(root, revision) or temperature
+    backend = getattr(settings, 'ANOMALY_INFERENCE_BACKEND', 'eager')
+    exit_heads = find_exit_heads(model_name, versioned=bool(revision))
+    if exit_heads and backend != 'eager':
+        logger.warning(f"Ignoring the early-exit heads at {exit_heads}, they need the eager backend")
+        exit_heads = None
+    return ModelRegistry(
+        model_name=model_name,
+        num_labels=getattr(settings, 'ANOMALY_MODEL_NUM_LABELS', 2),
+        precision=getattr(settings, 'ANOMALY_INFERENCE_PRECISION', 'fp32'),
+        backend=backend,
+        cache_dir=getattr(settings, 'ANOMALY_COMPILED_CACHE_DIR', None),
+        temperature=temperature,
+        mmap_weights=getattr(settings, 'ANOMALY_MODEL_MMAP_WEIGHTS', False),
+        allow_emulated_bf16=getattr(settings, 'ANOMALY_BF16_ALLOW_EMULATED', False),
+        revision=revision,
+        local_files_only=bool(revision) or getattr(settings, 'ANOMALY_MODEL_OFFLINE', False),
+        verify_checksums=getattr(settings, 'ANOMALY_MODEL_VERIFY_CHECKSUMS', True),
+        exit_heads=exit_heads,
+    )
+
+
+def get_registry() -> ModelRegistry:
+    """
+    Return the process-wide model registry, creating it from settings.
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = build_registry()
+    return _registry
+
+
+def swap_registry(registry: ModelRegistry) -> Optional[ModelRegistry]:
+    """
+    Make ``registry`` the process-wide one and return the previous registry.
+
+    Inference resolves the registry once per batch, so batches already
+    running finish on the previous model.
+    """
+    global _registry
+    with _registry_lock:
+        previous, _registry = _registry, registry
+    return previous
@@ -0,0 +1,131 @@
+"""
+Hot reload of the anomaly classifier.
+
+A ``ModelReloader`` loads a new model version on a background thread while
+the current one keeps serving, warms it up, and swaps it in with
+``swap_registry``. Inference resolves the registry once per batch, so the
+swap happens between batches; the previous model is released once the
+batches still using it finish.
+
+Each process holding a model runs ``watch``, which polls a source for the
+version it should run: Celery pool processes read the version the worker's
+``reload_model`` broadcast handler stored in shared memory, and the
+inference server reads the ``CURRENT`` pointer of ``ANOMALY_MODEL_ROOT``.
+"""
+import gc
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from . import metrics
+from .model_registry import build_registry, get_registry, swap_registry
+
+logger = logging.getLogger(__name__)
+
+
+class ModelReloader:
+    """
+    Loads model versions in the background and swaps them in.
+
+    Args:
+        warmup_messages (Iterable[str]): Messages for the new model's warm-up
+        warmup_rounds (int): Warm-up passes before the swap
+        on_swap (Callable): Called with the new model's warm-up statistics
+            after each swap
+    """
+
+    def __init__(self, warmup_messages: Optional[Iterable[str]] = None, warmup_rounds: int = 1,
+                 on_swap: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.warmup_messages = warmup_messages
+        self.warmup_rounds = warmup_rounds
+        self.on_swap = on_swap
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pending = None
+        self.last_reload = None
+
+    def request(self, revision: str) -> bool:
+        """
+        Start loading ``revision`` unless it is already running or loading.
+
+        Returns:
+            bool: True when a reload was started
+        """
+        with self._lock:
+            if revision in (get_registry().revision, self._pending):
+                return False
+            if self._thread is not None and self._thread.is_alive():
+                # The next poll retries once the running reload is done
+                return False
+            self._pending = revision
+            self._thread = threading.Thread(
+                target=self._reload, args=(revision,), name='model-reload', daemon=True
+            )
+            self._thread.start()
+            return True
+
+    def join(self, timeout: Optional[float] = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _reload(self, revision: str):
+        start = time.perf_counter()
+        try:
+            registry = build_registry(revision)
+            stats = registry.warm_up(self.warmup_messages, rounds=self.warmup_rounds)
+        except Exception as exc:
+            logger.error(f"Could not load model version '{revision}', keeping the current one: {str(exc)}")
+            metrics.counter('model.reload_failures').inc()
+            self.last_reload = {'revision': revision, 'error': str(exc), 'finished_at': time.time()}
+            with self._lock:
+                self._pending = None
+            return
+
+        previous = swap_registry(registry)
+        with self._lock:
+            self._pending = None
+        self.last_reload = {
+            'revision': revision,
+            'previous': previous.version if previous else None,
+            'seconds': time.perf_counter() - start,
+            'finished_at': time.time(),
+        }
+        logger.info(
+            f"Swapped in model {registry.version} after {self.last_reload['seconds']:.2f}s "
+            f"(was {self.last_reload['previous']})"
+        )
+        metrics.counter('model.reloads').inc()
+
+        # Batches still running keep their own reference to the previous
+        # model; it is freed as soon as they finish
+        del previous
+        gc.collect()
+
+        if self.on_swap is not None:
+            try:
+                self.on_swap(stats)
+            except Exception as exc:
+                logger.error(f"Model swap callback failed: {str(exc)}")
+
+
+def watch(reloader: ModelReloader, source: Callable[[], Optional[str]], interval: float = 1.0) -> threading.Thread:
+    """
+    Poll ``source`` for the wanted version and reload whenever it changes.
+
+    Returns:
+        threading.Thread: The daemon thread running the poll loop
+    """
+    def poll():
+        while True:
+            time.sleep(interval)
+            try:
+                revision = source()
+                if revision:
+                    reloader.request(revision)
+            except Exception as exc:
+                logger.error(f"Model version poll failed: {str(exc)}")
+
+    thread = threading.Thread(target=poll, name='model-version-watch', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,193 @@
+"""
+Versioned model directory.
+
+With ``ANOMALY_MODEL_ROOT`` set, each classifier version lives in its own
+subdirectory holding a ``save_pretrained`` model and tokenizer::
+
+    models/
+        2024-06-01/
+        2024-07-15/
+            config.json
+            model.safetensors
+            vocab.txt
+            calibration.json    (optional: {"temperature": 1.3})
+            exit_heads.npz      (optional: early-exit heads distilled from these weights)
+            MANIFEST.json       (source, pinned revision and file checksums)
+            .verified.json      (size, mtime and inode of the files last found intact)
+        CURRENT                 (name of the active version)
+
+``CURRENT`` is the pointer workers load on boot. ``reload_model`` moves it
+and tells running workers to switch (see ``logs.model_reload``).
+
+``python manage.py fetch_model`` fills a version from the Hugging Face hub
+(or a local checkpoint) on a machine with network access. Workers then load
+versions with ``local_files_only`` and check them against their manifest, so
+they never reach out to the hub. A file is only hashed again when its size,
+mtime or inode changed since it was last found intact, so pool children and
+reloads do not re-read hundreds of megabytes each.
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+
+POINTER_FILE = 'CURRENT'
+CALIBRATION_FILE = 'calibration.json'
+MANIFEST_FILE = 'MANIFEST.json'
+VERIFIED_FILE = '.verified.json'
+WEIGHTS_FILE = 'model.safetensors'
+EXIT_HEADS_FILE = 'exit_heads.npz'
+
+
+def model_root() -> Optional[Path]:
+    """Return ``ANOMALY_MODEL_ROOT``, or None when models are not versioned."""
+    root = getattr(settings, 'ANOMALY_MODEL_ROOT', None)
+    return Path(root) if root else None
+
+
+def version_dir(root: Path, version: str) -> Path:
+    """Return the directory of a version, refusing names that leave the root."""
+    if not version or version != Path(version).name or version.startswith('.'):
+        raise ValueError(f"Invalid model version '{version}'")
+    return Path(root) / version
+
+
+def list_versions(root: Path) -> List[str]:
+    """Return the versions in the root that hold a model, oldest name first."""
+    if not Path(root).is_dir():
+        return []
+    return sorted(path.name for path in Path(root).iterdir() if (path / 'config.json').is_file())
+
+
+def current_version(root: Path) -> Optional[str]:
+    """Return the version ``CURRENT`` points at, or None when there is no pointer."""
+    try:
+        return (Path(root) / POINTER_FILE).read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def activate(root: Path, version: str):
+    """
+    Point ``CURRENT`` at a version.
+
+    The pointer is replaced atomically, so a worker booting meanwhile reads
+    either the old or the new version.
+
+    Raises:
+        ValueError: The version does not exist in the root
+    """
+    if version not in list_versions(root):
+        raise ValueError(f"Model version '{version}' not found in {root}")
+    pointer = Path(root) / POINTER_FILE
+    tmp_path = pointer.with_name(f'.{POINTER_FILE}.{os.getpid()}.tmp')
+    tmp_path.write_text(f'{version}\n')
+    os.replace(tmp_path, pointer)
+
+
+def read_temperature(root: Path, version: str) -> Optional[float]:
+    """Return the calibration temperature shipped with a version, if any."""
+    try:
+        calibration = json.loads((version_dir(root, version) / CALIBRATION_FILE).read_text())
+    except FileNotFoundError:
+        return None
+    return float(calibration['temperature'])
+
+
+def sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as artifact:
+        for chunk in iter(lambda: artifact.read(2**20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_manifest(directory: Path, info: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Record the checksum and size of every file of a version in its manifest.
+    ``calibration.json`` and ``exit_heads.npz`` are left out, as they are
+    fitted after the fact.
+
+    Args:
+        directory (Path): Version directory
+        info (dict): Provenance stored alongside, e.g. the source model and
+            its pinned hub revision
+
+    Returns:
+        dict: The manifest
+    """
+    directory = Path(directory)
+    files = {
+        path.name: {'sha256': sha256_file(path), 'bytes': path.stat().st_size}
+        for path in sorted(directory.iterdir())
+        if path.is_file() and path.name not in (MANIFEST_FILE, CALIBRATION_FILE, EXIT_HEADS_FILE, VERIFIED_FILE)
+    }
+    manifest = dict(info, files=files)
+    (directory / MANIFEST_FILE).write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    # Just hashed, so the first load does not hash them again
+    _write_verified(directory, files)
+    return manifest
+
+
+def _stat_key(path: Path) -> List[int]:
+    stat = path.stat()
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+
+def _read_verified(directory: Path) -> Dict[str, Any]:
+    try:
+        return json.loads((directory / VERIFIED_FILE).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_verified(directory: Path, files: Dict[str, Dict[str, Any]]):
+    stamp = {name: {'sha256': entry['sha256'], 'stat': _stat_key(directory / name)} for name, entry in files.items()}
+    tmp_path = directory / f'{VERIFIED_FILE}.{os.getpid()}.tmp'
+    try:
+        tmp_path.write_text(json.dumps(stamp))
+        os.replace(tmp_path, directory / VERIFIED_FILE)
+    except OSError:
+        # A read-only model root just means hashing on every load
+        tmp_path.unlink(missing_ok=True)
+
+
+def verify_manifest(directory: Path, trust_stamp: bool = True) -> List[str]:
+    """
+    Check a version's files against its manifest.
+
+    Args:
+        directory (Path): Version directory
+        trust_stamp (bool): Skip hashing files whose size, mtime and inode
+            match the last successful check; False hashes every file
+
+    Returns:
+        List[str]: One line per missing or altered file; empty when the
+        version is intact
+
+    Raises:
+        FileNotFoundError: The version has no manifest
+    """
+    directory = Path(directory)
+    manifest = json.loads((directory / MANIFEST_FILE).read_text())
+    verified = _read_verified(directory) if trust_stamp else {}
+    problems = []
+    hashed = False
+    for name, expected in manifest['files'].items():
+        path = directory / name
+        if not path.is_file():
+            problems.append(f'{name}: missing')
+        elif path.stat().st_size != expected['bytes']:
+            problems.append(f"{name}: {path.stat().st_size} bytes, expected {expected['bytes']}")
+        elif verified.get(name) == {'sha256': expected['sha256'], 'stat': _stat_key(path)}:
+            continue
+        elif sha256_file(path) != expected['sha256']:
+            problems.append(f'{name}: checksum mismatch')
+        else:
+            hashed = True
+    if hashed and not problems:
+        _write_verified(directory, manifest['files'])
+    return problems
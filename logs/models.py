@@ -1,10 +1,79 @@
+import regex
+from django.core.exceptions import ValidationError
 from django.db import models
 
 # Create your models here.
+class LogTemplate(models.Model):
+    """Message template mined from log entries, e.g. 'Timeout after <NUM>s on <*>'"""
+    template = models.TextField()
+    signature = models.CharField(max_length=32, unique=True)
+    token_count = models.PositiveIntegerField()
+    count = models.PositiveBigIntegerField(default=0)
+    first_seen = models.DateTimeField(null=True, blank=True)
+    last_seen = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.template
+
 class LogEntry(models.Model):
     timestamp = models.DateTimeField()
     severity = models.CharField(max_length=10)
     message = models.TextField()
+    template = models.ForeignKey(LogTemplate, null=True, blank=True, on_delete=models.SET_NULL, related_name='entries')
+    anomaly_probability = models.FloatField(null=True, blank=True, db_index=True)
+    model_version = models.CharField(max_length=255, null=True, blank=True)
+
+class LogEmbedding(models.Model):
+    """Pooled BERT embedding of an analyzed log entry, stored as unit-length float16"""
+    log_entry = models.OneToOneField(LogEntry, primary_key=True, on_delete=models.CASCADE, related_name='embedding')
+    model_version = models.CharField(max_length=255, db_index=True)
+    vector = models.BinaryField()
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+# \1, \g<1> and (?1), not preceded by an escaping backslash
+NUMBERED_REFERENCE = regex.compile(r'(?<!\\)(?:\\\\)*(?:\\[1-9]|\\g<[+-]?\d+>|\(\?[+-]?\d+\))')
+
+class LogRule(models.Model):
+    """Operator-maintained regex signature whose matches skip the classifier"""
+    ANOMALOUS = 'anomalous'
+    NORMAL = 'normal'
+    VERDICTS = [(ANOMALOUS, 'Anomalous'), (NORMAL, 'Normal')]
+
+    name = models.CharField(max_length=100, unique=True)
+    pattern = models.TextField(help_text='Regular expression (regex module syntax) searched in the message')
+    verdict = models.CharField(max_length=10, choices=VERDICTS)
+    enabled = models.BooleanField(default=True)
+    hit_count = models.PositiveBigIntegerField(default=0)
+    last_hit = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def clean(self):
+        # Rules are matched wrapped in a group of a combined alternation,
+        # which renumbers their groups
+        if NUMBERED_REFERENCE.search(self.pattern):
+            raise ValidationError({
+                'pattern': 'Numbered group references are not supported, name the group: (?P<word>\\w+) (?P=word)'
+            })
+        try:
+            regex.compile(f'({self.pattern})')
+        except regex.error as exc:
+            raise ValidationError({'pattern': f'Invalid regular expression: {exc}'})
+
+    def __str__(self):
+        return f'{self.name} ({self.verdict})'
+
+class IngestSegment(models.Model):
+    """Write-behind buffer segment flushed into LogEntry, so replays never insert it twice"""
+    name = models.CharField(max_length=100, unique=True)
+    rows = models.PositiveIntegerField()
+    bytes = models.PositiveBigIntegerField()
+    flush_seconds = models.FloatField()
+    lag_seconds = models.FloatField(help_text='Time from the segment being sealed to its rows being committed')
+    replayed = models.BooleanField(default=False, help_text='Left over by a previous flusher run')
+    pending_analysis = models.JSONField(
+        null=True, blank=True, help_text='[first, last] ID ranges whose analysis has not been queued yet'
+    )
+    flushed_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
 class AnomalyReport(models.Model):
     log_entry = models.ForeignKey(LogEntry, on_delete=models.CASCADE)
@@ -0,0 +1,97 @@
+"""
+Readiness of the inference workers.
+
+An inference worker warms the classifier up before it takes tasks from the
+analysis queues, and publishes a readiness entry with its model version,
+queues and warm-up timings in the Django cache
+(``ANOMALY_READINESS_CACHE_ALIAS``), which must be shared by the workers and
+the web processes, like the ``shared`` Redis cache. It refreshes the entry
+every ``ANOMALY_READINESS_REFRESH`` seconds while it runs and withdraws it on
+shutdown. ``/api/health/`` reports the entries and answers 503 until every
+inference queue has a live, warmed-up worker.
+
+Each worker writes only its own key, which expires after
+``ANOMALY_READINESS_MAX_AGE`` seconds, so workers never overwrite each
+other's entries. Readers find the keys through an index of hostnames; a
+hostname lost to a concurrent index update is added back on the worker's
+next refresh.
+
+Prefork children store their own warm-up timings under a per-process key,
+and the worker's main process collects them into its entry.
+"""
+import time
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+
+READINESS_KEY = 'anomaly:inference:readiness:{hostname}'
+HOSTNAMES_KEY = 'anomaly:inference:readiness:hostnames'
+WARMUP_KEY = 'anomaly:inference:warmup:{hostname}:{pid}'
+
+
+def _cache():
+    return caches[getattr(settings, 'ANOMALY_READINESS_CACHE_ALIAS', 'default')]
+
+
+def _max_age() -> float:
+    return getattr(settings, 'ANOMALY_READINESS_MAX_AGE', 120)
+
+
+def record_warmup(hostname: str, pid: int, stats: Dict[str, Any]):
+    """Store the warm-up timings of one worker process."""
+    _cache().set(WARMUP_KEY.format(hostname=hostname, pid=pid), stats, _max_age() * 10)
+
+
+def collect_warmups(hostname: str, pids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """Return the stored warm-up timings of the given processes."""
+    keys = {WARMUP_KEY.format(hostname=hostname, pid=pid): pid for pid in pids}
+    return {keys[key]: stats for key, stats in _cache().get_many(list(keys)).items()}
+
+
+def publish_ready(hostname: str, info: Dict[str, Any]):
+    """Publish or refresh a worker's readiness entry."""
+    cache = _cache()
+    # Outlives a few missed refreshes, then disappears with a dead worker
+    timeout = max(_max_age(), 3 * getattr(settings, 'ANOMALY_READINESS_REFRESH', 5))
+    cache.set(READINESS_KEY.format(hostname=hostname), dict(info, hostname=hostname, heartbeat_at=time.time()), timeout)
+    hostnames = cache.get(HOSTNAMES_KEY) or []
+    if hostname not in hostnames:
+        cache.set(HOSTNAMES_KEY, hostnames + [hostname], None)
+
+
+def withdraw(hostname: str):
+    """Remove a worker's readiness entry."""
+    _cache().delete(READINESS_KEY.format(hostname=hostname))
+
+
+def live_workers(now: Optional[float] = None) -> List[Dict[str, Any]]:
+    """Return the entries refreshed within ``ANOMALY_READINESS_MAX_AGE`` seconds."""
+    now = now or time.time()
+    cache = _cache()
+    keys = [READINESS_KEY.format(hostname=hostname) for hostname in cache.get(HOSTNAMES_KEY) or []]
+    workers = cache.get_many(keys).values()
+    return [worker for worker in workers if now - worker['heartbeat_at'] <= _max_age()]
+
+
+def readiness_report() -> Dict[str, Any]:
+    """
+    Summarize readiness per inference queue.
+
+    Returns:
+        dict: ``ready`` is True when every queue in ``ANOMALY_INFERENCE_QUEUES``
+        has at least one live, warmed-up worker
+    """
+    workers = live_workers()
+    queues = {
+        queue: sorted(
+            worker['hostname'] for worker in workers
+            if worker.get('warmed_up') and queue in worker.get('queues', [])
+        )
+        for queue in getattr(settings, 'ANOMALY_INFERENCE_QUEUES', [])
+    }
+    return {
+        'ready': all(queues.values()),
+        'queues': queues,
+        'workers': sorted(workers, key=lambda worker: worker['hostname']),
+    }
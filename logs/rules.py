@@ -0,0 +1,192 @@
+"""
+Operator rules deciding known signatures before the classifier.
+
+``LogRule`` rows (edited in the admin) pair a regular expression with a
+verdict. The enabled rules are compiled with the ``regex`` package into two
+combined patterns, one per verdict, each an alternation of the rules wrapped
+in their own group. A message takes one search per pattern, whichever
+number of rules there is. Anomalous rules are tried first, so a known-bad
+signature is never silenced by a broader known-good one.
+
+The matcher is rebuilt only when the rules change: every
+``ANOMALY_RULES_REFRESH_SECONDS`` a process compares the rule count and
+latest ``updated_at`` with those it compiled. Hit counts are kept in memory
+and added to the rows at the same interval.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import regex
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Count, F, Max
+from django.utils import timezone
+
+from . import metrics
+from .models import LogRule
+
+logger = logging.getLogger(__name__)
+
+# Model version recorded for verdicts decided by a rule, e.g. 'rule:disk-full'
+RULE_VERSION_PREFIX = 'rule'
+RULE_PROBABILITIES = {LogRule.ANOMALOUS: 1.0, LogRule.NORMAL: 0.0}
+
+
+class RuleMatcher:
+    """
+    Combined matcher over a set of rules.
+
+    Args:
+        rules (Sequence[LogRule]): Rules to compile; invalid patterns are
+            logged and skipped
+        timeout (float): Seconds one search may take before the message is
+            treated as unmatched, against runaway backtracking
+    """
+
+    def __init__(self, rules: Sequence[LogRule], timeout: Optional[float] = None):
+        self.timeout = timeout
+        self.patterns = []
+        for verdict in (LogRule.ANOMALOUS, LogRule.NORMAL):
+            self.patterns.extend(self._compile([rule for rule in rules if rule.verdict == verdict]))
+
+    @staticmethod
+    def _compile(rules: List[LogRule]) -> List[Tuple[regex.Pattern, Dict[int, LogRule]]]:
+        valid = []
+        for rule in rules:
+            try:
+                rule.clean()
+            except ValidationError as exc:
+                logger.warning(f"Skipping rule '{rule.name}': {'; '.join(exc.messages)}")
+                continue
+            valid.append(rule)
+        if not valid:
+            return []
+        # The wrapping groups come first in their alternatives, so a match's
+        # lastindex is the group of the rule that matched
+        try:
+            pattern = regex.compile('|'.join(f'({rule.pattern})' for rule in valid))
+        except regex.error as exc:
+            # One rule does not combine with the others (e.g. a row saved
+            # before clean() covered it): fall back to a search per rule
+            logger.error(f"Could not combine {len(valid)} log rules ({exc}), matching them one by one")
+            patterns = []
+            for rule in valid:
+                try:
+                    patterns.append((regex.compile(f'({rule.pattern})'), {1: rule}))
+                except regex.error as rule_exc:
+                    logger.warning(f"Skipping rule '{rule.name}': {rule_exc}")
+            return patterns
+        groups, number = {}, 1
+        for rule in valid:
+            groups[number] = rule
+            number += 1 + regex.compile(rule.pattern).groups
+        return [(pattern, groups)]
+
+    def __bool__(self) -> bool:
+        return bool(self.patterns)
+
+    def match(self, message: str) -> Optional[LogRule]:
+        """Return the rule deciding a message, or None."""
+        for pattern, groups in self.patterns:
+            try:
+                found = pattern.search(message, timeout=self.timeout)
+            except TimeoutError:
+                metrics.counter('rules.timeouts').inc()
+                logger.warning(f"Rule search timed out on a {len(message)}-character message")
+                continue
+            if found is not None:
+                return groups[found.lastindex]
+        return None
+
+
+class RuleSet:
+    """
+    Process-wide rule matcher, recompiled when the rule table changes, and
+    the hit counts not yet saved.
+    """
+
+    def __init__(self, refresh_seconds: float = 5.0, timeout: Optional[float] = None):
+        self.refresh_seconds = refresh_seconds
+        self.timeout = timeout
+        self.matcher = RuleMatcher([])
+        self._signature = None
+        self._checked_at = None
+        self._hits = Counter()
+        self._last_hits = {}
+        self._lock = threading.Lock()
+
+    def refresh(self, force: bool = False):
+        """Save pending hit counts, then recompile if the rules changed."""
+        now = time.monotonic()
+        if not force and self._checked_at is not None and now - self._checked_at < self.refresh_seconds:
+            return
+        with self._lock:
+            self._checked_at = now
+            self.flush_hits()
+            state = LogRule.objects.filter(enabled=True).aggregate(count=Count('id'), updated=Max('updated_at'))
+            signature = (state['count'], state['updated'])
+            if signature == self._signature:
+                return
+            start = time.perf_counter()
+            self.matcher = RuleMatcher(list(LogRule.objects.filter(enabled=True).order_by('id')), self.timeout)
+            self._signature = signature
+        logger.info(f"Compiled {state['count']} log rules in {time.perf_counter() - start:.3f}s")
+
+    def flush_hits(self):
+        hits, self._hits = self._hits, Counter()
+        last_hits, self._last_hits = self._last_hits, {}
+        # Queryset updates leave updated_at alone, so counting hits does not
+        # trigger a recompile
+        for rule_id, count in hits.items():
+            LogRule.objects.filter(pk=rule_id).update(hit_count=F('hit_count') + count, last_hit=last_hits[rule_id])
+
+    def apply(self, messages: Sequence[str]) -> Dict[int, Tuple[float, str]]:
+        """
+        Decide the messages a rule matches.
+
+        Returns:
+            dict: Index of each matched message -> ``(probability, model_version)``
+        """
+        self.refresh()
+        matcher = self.matcher
+        if not matcher or not messages:
+            return {}
+
+        start = time.perf_counter()
+        decided = {}
+        for index, message in enumerate(messages):
+            rule = matcher.match(message)
+            if rule is not None:
+                decided[index] = (RULE_PROBABILITIES[rule.verdict], f'{RULE_VERSION_PREFIX}:{rule.name}')
+                with self._lock:
+                    self._hits[rule.id] += 1
+                    self._last_hits[rule.id] = timezone.now()
+        metrics.histogram('rules.seconds').observe(time.perf_counter() - start)
+        metrics.counter('rules.matched').inc(len(decided))
+        return decided
+
+
+_rule_set = None
+_rule_set_lock = threading.Lock()
+
+
+def get_rule_set() -> RuleSet:
+    global _rule_set
+    if _rule_set is None:
+        with _rule_set_lock:
+            if _rule_set is None:
+                _rule_set = RuleSet(
+                    refresh_seconds=getattr(settings, 'ANOMALY_RULES_REFRESH_SECONDS', 5.0),
+                    timeout=getattr(settings, 'ANOMALY_RULES_TIMEOUT', 0.05),
+                )
+    return _rule_set
+
+
+def apply_rules(messages: Sequence[str]) -> Dict[int, Tuple[float, str]]:
+    """Decide the messages an enabled rule matches (see ``RuleSet.apply``)."""
+    if not getattr(settings, 'ANOMALY_RULES_ENABLED', True):
+        return {}
+    return get_rule_set().apply(messages)
@@ -4,6 +4,7 @@ GraphQL schema for anomaly detection system.
 import graphene
 from graphene_django import DjangoObjectType
 from graphene_django.filter import DjangoFilterConnectionField
+from django.conf import settings
 from django.db.models import Count, Q
 from django.utils import timezone
 from datetime import timedelta
@@ -20,7 +21,7 @@ class LogEntryType(DjangoObjectType):
     """GraphQL type for LogEntry model"""
     class Meta:
         model = LogEntry
-        fields = ('id', 'timestamp', 'severity', 'message')
+        fields = ('id', 'timestamp', 'severity', 'message', 'anomaly_probability', 'model_version')
 
 
 class AnomalyReportType(DjangoObjectType):
@@ -45,6 +46,12 @@ class DashboardStatsType(graphene.ObjectType):
     last_updated = graphene.DateTime()
 
 
+class SimilarLogType(graphene.ObjectType):
+    """Type for a log entry similar to another one"""
+    log_entry = graphene.Field(LogEntryType)
+    similarity = graphene.Float()
+
+
 class TaskStatusType(graphene.ObjectType):
     """Type for Celery task status"""
     task_id = graphene.String()
@@ -80,6 +87,19 @@ class Query(graphene.ObjectType):
         limit=graphene.Int(default_value=10)
     )
     
+    anomalous_logs = graphene.List(
+        LogEntryType,
+        threshold=graphene.Float(),
+        hours=graphene.Int(default_value=24),
+        limit=graphene.Int(default_value=50)
+    )
+    
+    similar_logs = graphene.List(
+        SimilarLogType,
+        log_id=graphene.Int(required=True),
+        limit=graphene.Int(default_value=10)
+    )
+    
     # Dashboard and statistics
     dashboard_stats = graphene.Field(DashboardStatsType)
     severity_distribution = graphene.List(
@@ -137,6 +157,28 @@ class Query(graphene.ObjectType):
             log_entry__timestamp__gte=cutoff_time
         ).order_by('-log_entry__timestamp')[:limit]
 
+    def resolve_anomalous_logs(self, info, hours, limit, threshold=None):
+        """Get recent log entries whose anomaly probability reaches the threshold"""
+        if threshold is None:
+            threshold = settings.ANOMALY_ALERT_THRESHOLD
+        cutoff_time = timezone.now() - timedelta(hours=hours)
+        return LogEntry.objects.filter(
+            timestamp__gte=cutoff_time,
+            anomaly_probability__gte=threshold
+        ).order_by('-anomaly_probability', '-timestamp')[:limit]
+
+    def resolve_similar_logs(self, info, log_id, limit):
+        """Get the log entries whose message embedding is closest to a given entry's"""
+        from .embeddings import similar_logs
+        from .models import LogEmbedding
+
+        limit = max(1, min(limit, getattr(settings, 'ANOMALY_SIMILAR_LOGS_MAX', 100)))
+        try:
+            matches = similar_logs(log_id, limit)
+        except LogEmbedding.DoesNotExist:
+            return []
+        return [SimilarLogType(log_entry=log_entry, similarity=similarity) for log_entry, similarity in matches]
+
     def resolve_dashboard_stats(self, info):
         """Get dashboard statistics"""
         last_24h = timezone.now() - timedelta(hours=24)
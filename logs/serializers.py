@@ -4,7 +4,8 @@ from .models import LogEntry, AnomalyReport
 class LogEntrySerializer(serializers.ModelSerializer):
     class Meta:
         model = LogEntry
-        fields = ['id', 'timestamp', 'severity', 'message']
+        fields = ['id', 'timestamp', 'severity', 'message', 'anomaly_probability', 'model_version']
+        read_only_fields = ['anomaly_probability', 'model_version']
 
 
 class AnomalyReportSerializer(serializers.ModelSerializer):
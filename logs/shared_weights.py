@@ -0,0 +1,103 @@
+"""
+Memory-mapped classifier weights.
+
+The fp32 weights are exported once to a safetensors file under
+``ANOMALY_COMPILED_CACHE_DIR`` and then mapped back copy-on-write, so the
+parameters point into the page cache instead of private heap memory. Every
+process that maps the file (prefork children, restarted workers, other
+workers on the host) shares the same physical pages for as long as nobody
+writes to them, which inference never does.
+"""
+import json
+import logging
+import os
+import struct
+from pathlib import Path
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+# safetensors dtype codes of the tensors a BERT classifier holds
+DTYPES = {
+    'F64': 'float64',
+    'F32': 'float32',
+    'F16': 'float16',
+    'BF16': 'bfloat16',
+    'I64': 'int64',
+    'I32': 'int32',
+    'I8': 'int8',
+    'U8': 'uint8',
+    'BOOL': 'bool',
+}
+
+
+def weights_path(cache_dir, key: str) -> Path:
+    return Path(cache_dir) / f'{key}.safetensors'
+
+
+def export_weights(model, path: Path):
+    """Write a model's state dict as safetensors, atomically."""
+    from safetensors.torch import save_model
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    save_model(model, str(tmp))
+    os.replace(tmp, path)
+    logger.info(f"Exported classifier weights to {path}")
+
+
+def read_header(path: Path):
+    """
+    Return the safetensors header and the byte offset where tensor data starts.
+    """
+    with open(path, 'rb') as weights:
+        (length,) = struct.unpack('<Q', weights.read(8))
+        header = json.loads(weights.read(length))
+    header.pop('__metadata__', None)
+    return header, 8 + length
+
+
+def mmap_state_dict(path: Path) -> Dict[str, object]:
+    """
+    Map a safetensors file copy-on-write and return tensors viewing it.
+
+    Tensors whose offset is not aligned to their element size are copied.
+    """
+    import torch
+
+    header, data_start = read_header(path)
+    storage = torch.UntypedStorage.from_file(str(path), shared=False, nbytes=path.stat().st_size)
+    raw = torch.empty(0, dtype=torch.uint8).set_(storage)
+
+    tensors = {}
+    for name, info in header.items():
+        dtype = getattr(torch, DTYPES[info['dtype']])
+        begin, end = info['data_offsets']
+        offset = data_start + begin
+        itemsize = torch.empty(0, dtype=dtype).element_size()
+        if offset % itemsize == 0:
+            tensors[name] = torch.empty(0, dtype=dtype).set_(storage, offset // itemsize, info['shape'])
+        else:
+            tensors[name] = raw[offset:data_start + end].clone().view(dtype).reshape(info['shape'])
+    return tensors
+
+
+def map_weights(model, path: Path):
+    """
+    Point a model's parameters and buffers at a memory-mapped copy of its
+    weights, exporting them first if the file does not exist.
+
+    Returns:
+        The same model, now backed by the mapped file
+    """
+    if not path.exists():
+        export_weights(model, path)
+
+    state = mmap_state_dict(path)
+    missing, unexpected = model.load_state_dict(state, strict=False, assign=True)
+    if unexpected:
+        raise ValueError(f"{path} does not match the model: unexpected weights {unexpected[:5]}")
+    if missing:
+        # Tied weights are stored once; the others keep their private copy
+        logger.info(f"{len(missing)} tied weights not mapped from {path}")
+    return model
@@ -9,12 +9,56 @@ from django.core.mail import send_mail
 from django.conf import settings
 from django.utils import timezone
 
-from .models import LogEntry, AnomalyReport
-from .utils import analyze_log, verify_hmac
+from .embeddings import embed_messages, store_embeddings
+from .inference_server import get_client
+from .models import LogEntry, AnomalyReport, IngestSegment
+from .template_miner import assign_templates
+from .model_registry import get_registry
+from . import metrics, worker
+from .thread_budget import current_threads
+from .utils import analyze_logs_tagged, verify_hmac
+from .verdict_cache import get_verdict_cache
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+def mine_templates(log_entries: List[LogEntry]):
+    """
+    Assign a template ID to analyzed log entries. Mining errors are logged
+    and never fail the analysis.
+    """
+    if not log_entries or not getattr(settings, 'ANOMALY_TEMPLATE_MINING_ENABLED', True):
+        return
+    try:
+        assign_templates(log_entries)
+    except Exception as exc:
+        logger.error(f"Error mining log templates: {str(exc)}")
+
+def store_probabilities(log_entries: List[LogEntry], anomaly_scores: List[float], model_versions: List[str]):
+    """
+    Persist the anomaly probability of each analyzed log entry and the
+    version of the model that produced it.
+    """
+    for log_entry, anomaly_score, model_version in zip(log_entries, anomaly_scores, model_versions):
+        log_entry.anomaly_probability = anomaly_score
+        log_entry.model_version = model_version
+    LogEntry.objects.bulk_update(log_entries, ['anomaly_probability', 'model_version'])
+
+def queue_embeddings(log_entries: List[LogEntry]):
+    """
+    Have the embeddings of analyzed entries computed for similar-log search,
+    off the verdict path. Errors are logged and never fail the analysis.
+    """
+    if not log_entries or not getattr(settings, 'ANOMALY_EMBEDDINGS_ENABLED', False):
+        return
+    try:
+        embed_log_entries.delay([log_entry.id for log_entry in log_entries])
+    except Exception as exc:
+        logger.error(f"Error queueing log embeddings: {str(exc)}")
+
+def is_alert(anomaly_score: float) -> bool:
+    return anomaly_score >= getattr(settings, 'ANOMALY_ALERT_THRESHOLD', 0.5)
+
 @shared_task(bind=True, max_retries=3, default_retry_delay=60)
 def analyze_log_async(self, log_message: str, log_entry_id: int = None):
     """
@@ -30,9 +74,12 @@ def analyze_log_async(self, log_message: str, log_entry_id: int = None):
     try:
         start_time = timezone.now()
         logger.info(f"Starting anomaly analysis for log entry {log_entry_id}")
+        log_entry = LogEntry.objects.filter(id=log_entry_id).first() if log_entry_id else None
         
         # Perform the analysis
-        anomaly_score = analyze_log(log_message)
+        [(anomaly_score, model_version)] = analyze_logs_tagged(
+            [log_message], [log_entry.severity if log_entry else None]
+        )
         
         end_time = timezone.now()
         processing_time = (end_time - start_time).total_seconds()
@@ -40,13 +87,21 @@ def analyze_log_async(self, log_message: str, log_entry_id: int = None):
         result = {
             'log_entry_id': log_entry_id,
             'anomaly_score': anomaly_score,
+            'model_version': model_version,
             'processing_time': processing_time,
             'analyzed_at': end_time.isoformat(),
-            'is_anomaly': anomaly_score == 1
+            'is_anomaly': is_alert(anomaly_score)
         }
         
+        # Store the probability and assign the message template
+        if log_entry:
+            store_probabilities([log_entry], [anomaly_score], [model_version])
+            mine_templates([log_entry])
+            queue_embeddings([log_entry])
+            result['template_id'] = log_entry.template_id
+
         # Create AnomalyReport if anomaly detected
-        if anomaly_score == 1 and log_entry_id:
+        if is_alert(anomaly_score) and log_entry_id:
             try:
                 log_entry = LogEntry.objects.get(id=log_entry_id)
                 AnomalyReport.objects.create(
@@ -159,27 +214,55 @@ def process_log_batch(log_entries: List[Dict[str, Any]]):
     """
     Process multiple log entries in batch.
     
+    Each entry is validated like a single ``POST /api/logs/``. The valid ones
+    are stored in one transaction and analyzed together by
+    ``analyze_log_batch`` tasks, so they share batched forward passes;
+    invalid ones are reported and do not fail the others.
+    
     Args:
         log_entries (List[dict]): List of log entry data
         
     Returns:
-        dict: Batch processing results
+        dict: Batch processing results. ``tasks`` has one item per entry, in
+        order: its ``log_data`` with either the ``log_entry_id`` and the
+        ``task_id`` of the batch analyzing it, or its validation ``errors``
     """
+    from .ingest import insert_entries, queue_analysis, validate_items
+
     try:
         logger.info(f"Starting batch processing of {len(log_entries)} log entries")
         
+        valid, errors = validate_items([(log_data, None) for log_data in log_entries])
+        created = insert_entries(
+            [data for _, data in valid], getattr(settings, 'ANOMALY_BULK_INSERT_CHUNK', 1000)
+        )
+        log_entry_ids = [log_entry.id for log_entry in created]
+
+        chunk_size = getattr(settings, 'ANOMALY_BULK_ANALYSIS_CHUNK', 500)
+        analysis_task_ids = queue_analysis(log_entry_ids, chunk_size)
+        stored = {index: position for position, (index, _) in enumerate(valid)}
         results = []
-        for log_data in log_entries:
-            task = process_log_entry_async.delay(log_data)
+        for index, log_data in enumerate(log_entries):
+            if index in errors:
+                results.append({'log_data': log_data, 'errors': errors[index]})
+                continue
+            position = stored[index]
             results.append({
                 'log_data': log_data,
-                'task_id': task.id
+                'log_entry_id': log_entry_ids[position],
+                'task_id': analysis_task_ids[position // chunk_size] if analysis_task_ids else None,
             })
+        if errors:
+            logger.warning(f"Rejected {len(errors)} of {len(log_entries)} log entries in the batch")
         
         return {
-            'status': 'success',
+            'status': 'success' if valid else 'error',
             'batch_size': len(log_entries),
+            'accepted': len(valid),
+            'rejected': len(errors),
             'tasks': results,
+            'log_entry_ids': log_entry_ids,
+            'analysis_task_ids': analysis_task_ids or [],
             'started_at': timezone.now().isoformat()
         }
         
@@ -187,6 +270,101 @@ def process_log_batch(log_entries: List[Dict[str, Any]]):
         logger.error(f"Error in batch processing: {str(exc)}")
         return {'status': 'error', 'message': str(exc)}
 
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def analyze_log_batch(self, log_entry_ids: List[int]):
+    """
+    Analyze several stored log entries through the batching inference engine.
+
+    Args:
+        log_entry_ids (List[int]): IDs of the LogEntry records to analyze
+
+    Returns:
+        dict: Number of entries analyzed and anomalies detected
+    """
+    try:
+        start_time = timezone.now()
+        log_entries = list(LogEntry.objects.filter(id__in=log_entry_ids))
+        verdicts = analyze_logs_tagged(
+            [log_entry.message for log_entry in log_entries],
+            [log_entry.severity for log_entry in log_entries]
+        )
+        anomaly_scores = [anomaly_score for anomaly_score, _ in verdicts]
+        model_versions = [model_version for _, model_version in verdicts]
+        store_probabilities(log_entries, anomaly_scores, model_versions)
+        mine_templates(log_entries)
+        queue_embeddings(log_entries)
+
+        reports = [
+            AnomalyReport(
+                log_entry=log_entry,
+                anomaly_score=float(anomaly_score),
+                summary=f"Anomaly detected in log message: {log_entry.message[:100]}..."
+            )
+            for log_entry, anomaly_score in zip(log_entries, anomaly_scores)
+            if is_alert(anomaly_score)
+        ]
+        AnomalyReport.objects.bulk_create(reports)
+
+        processing_time = (timezone.now() - start_time).total_seconds()
+        logger.info(
+            f"Analyzed batch of {len(log_entries)} log entries in {processing_time:.2f}s, "
+            f"{len(reports)} anomalies"
+        )
+        return {
+            'status': 'completed',
+            'analyzed_count': len(log_entries),
+            'anomalies_detected': len(reports),
+            'model_versions': sorted(set(model_versions)),
+            'processing_time': processing_time,
+            'analyzed_at': timezone.now().isoformat()
+        }
+
+    except Exception as exc:
+        logger.error(f"Error analyzing log batch: {str(exc)}")
+        raise self.retry(exc=exc, countdown=60 * (self.request.retries + 1))
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def embed_log_entries(self, log_entry_ids: List[int]):
+    """
+    Store the pooled BERT embedding of analyzed log entries for similar-log search.
+
+    Args:
+        log_entry_ids (List[int]): IDs of the LogEntry records to embed
+
+    Returns:
+        dict: Number of entries embedded and the model version used
+    """
+    try:
+        start_time = timezone.now()
+        log_entries = list(LogEntry.objects.filter(id__in=log_entry_ids))
+        if not log_entries:
+            return {'status': 'completed', 'embedded_count': 0}
+        messages = [log_entry.message for log_entry in log_entries]
+        severities = [log_entry.severity for log_entry in log_entries]
+        client = get_client()
+        if client is not None:
+            # The node's inference server holds the model; failures are
+            # retried rather than loading a copy in this process
+            vectors, model_version = client.embed(messages, severities)
+        else:
+            # Resolved once, so a hot reload cannot mix versions within the batch
+            registry = get_registry()
+            vectors = embed_messages(messages, severities, registry=registry)
+            model_version = registry.version
+        store_embeddings(log_entries, vectors, model_version)
+        processing_time = (timezone.now() - start_time).total_seconds()
+        logger.info(f"Embedded {len(log_entries)} log entries in {processing_time:.2f}s")
+        return {
+            'status': 'completed',
+            'embedded_count': len(log_entries),
+            'model_version': model_version,
+            'processing_time': processing_time,
+        }
+
+    except Exception as exc:
+        logger.error(f"Error embedding log entries: {str(exc)}")
+        raise self.retry(exc=exc, countdown=60 * (self.request.retries + 1))
+
 @shared_task(bind=True, max_retries=2)
 def detect_anomaly_patterns(self, time_window_hours: int = 24):
     """
@@ -354,25 +532,35 @@ def real_time_anomaly_stream(self, log_entry_ids: List[int]):
         logger.info(f"Processing real-time stream of {len(log_entry_ids)} log entries")
 
         # Batch process for efficiency
-        log_entries = LogEntry.objects.filter(id__in=log_entry_ids)
+        log_entries = list(LogEntry.objects.filter(id__in=log_entry_ids))
 
         results = []
         anomalies_detected = 0
 
-        for log_entry in log_entries:
-            # Quick anomaly check
-            start_time = timezone.now()
-            anomaly_score = analyze_log(log_entry.message)
-            processing_time = (timezone.now() - start_time).total_seconds()
-
+        # One batched pass over the whole stream
+        start_time = timezone.now()
+        verdicts = analyze_logs_tagged(
+            [log_entry.message for log_entry in log_entries],
+            [log_entry.severity for log_entry in log_entries]
+        )
+        anomaly_scores = [anomaly_score for anomaly_score, _ in verdicts]
+        model_versions = [model_version for _, model_version in verdicts]
+        processing_time = (timezone.now() - start_time).total_seconds() / max(len(log_entries), 1)
+        store_probabilities(log_entries, anomaly_scores, model_versions)
+        mine_templates(log_entries)
+        queue_embeddings(log_entries)
+
+        for log_entry, anomaly_score, model_version in zip(log_entries, anomaly_scores, model_versions):
             result = {
                 'log_entry_id': log_entry.id,
+                'template_id': log_entry.template_id,
                 'anomaly_score': anomaly_score,
+                'model_version': model_version,
                 'processing_time': processing_time,
-                'is_anomaly': anomaly_score == 1
+                'is_anomaly': is_alert(anomaly_score)
             }
 
-            if anomaly_score == 1:
+            if is_alert(anomaly_score):
                 anomalies_detected += 1
 
                 # Create anomaly report
@@ -422,12 +610,39 @@ def cleanup_old_results():
 
         logger.info(f"Cleaned up {deleted_count} old anomaly reports")
 
+        # Flush records guard against replaying a segment twice, which cannot
+        # happen this long after it was flushed. Those whose analysis is still
+        # pending are kept: the flusher queues it again from them
+        deleted_segments = IngestSegment.objects.filter(
+            flushed_at__lt=cutoff_date, pending_analysis__isnull=True
+        ).delete()[0]
+
         return {
             'status': 'success',
             'deleted_reports': deleted_count,
+            'deleted_ingest_segments': deleted_segments,
             'cleaned_at': timezone.now().isoformat()
         }
 
     except Exception as exc:
         logger.error(f"Error in cleanup task: {str(exc)}")
         return {'status': 'error', 'message': str(exc)}
+
+@shared_task
+def get_inference_stats():
+    """
+    Report the anomaly classifier state of the worker process that runs this task.
+
+    Returns:
+        dict: Load state, load time, resident memory, torch threads, verdict
+        cache hit rate and inference metrics (batch sizes, queue wait) of the
+        worker process
+    """
+    stats = get_registry().stats()
+    stats['threads'] = dict(
+        current_threads(), budget=worker.THREAD_BUDGET.as_dict() if worker.THREAD_BUDGET else None
+    )
+    stats['verdict_cache'] = get_verdict_cache().stats()
+    stats['metrics'] = metrics.snapshot()
+    stats['collected_at'] = timezone.now().isoformat()
+    return stats
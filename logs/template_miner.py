@@ -0,0 +1,266 @@
+"""
+Online log template mining (Drain).
+
+Each message is normalized (numbers, IPs, hex values and UUIDs masked),
+split into tokens, and routed down a fixed-depth prefix tree: first by
+token count, then by its leading tokens. The leaf holds template clusters.
+The message joins the most similar cluster if at least
+``ANOMALY_TEMPLATE_SIMILARITY`` of its tokens match, and positions that
+differ become ``<*>``. Otherwise it starts a new cluster.
+
+Clusters are mirrored in the ``LogTemplate`` table, and every analyzed
+``LogEntry`` gets the integer ID of its template.
+"""
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Greatest, Least
+
+from .models import LogEntry, LogTemplate
+from .verdict_cache import normalize_message
+
+logger = logging.getLogger(__name__)
+
+WILDCARD = '<*>'
+
+
+def template_signature(template: str) -> str:
+    return hashlib.blake2b(template.encode(), digest_size=16).hexdigest()
+
+
+class Cluster:
+    """A template and the ID of the LogTemplate row that stores it."""
+
+    __slots__ = ('tokens', 'template_id')
+
+    def __init__(self, tokens: List[str], template_id: Optional[int] = None):
+        self.tokens = tokens
+        self.template_id = template_id
+
+    @property
+    def template(self) -> str:
+        return ' '.join(self.tokens)
+
+
+class TemplateMiner:
+    """
+    Drain prefix-tree template miner.
+
+    Args:
+        depth (int): Tree depth, including the token-count level and the leaf
+        similarity_threshold (float): Minimum share of matching tokens to
+            join an existing cluster
+        max_children (int): Maximum children per internal node; further
+            tokens are routed to the wildcard child
+    """
+
+    def __init__(self, depth: int = 4, similarity_threshold: float = 0.4, max_children: int = 100):
+        self.prefix_depth = max(depth - 2, 1)
+        self.similarity_threshold = similarity_threshold
+        self.max_children = max_children
+        self.root: Dict[int, dict] = {}
+        self.clusters: List[Cluster] = []
+
+    @staticmethod
+    def tokenize(message: str) -> List[str]:
+        return normalize_message(message).split()
+
+    def _leaf(self, tokens: List[str], create: bool) -> Optional[list]:
+        node = self.root.get(len(tokens))
+        if node is None:
+            if not create:
+                return None
+            node = self.root[len(tokens)] = {'children': {}, 'clusters': []}
+
+        for token in tokens[:self.prefix_depth]:
+            children = node['children']
+            if any(char.isdigit() for char in token) or token.startswith('<'):
+                token = WILDCARD
+            if token in children:
+                node = children[token]
+            elif WILDCARD in children and (not create or len(children) >= self.max_children):
+                node = children[WILDCARD]
+            elif create:
+                if len(children) >= self.max_children - 1:
+                    token = WILDCARD
+                node = children.setdefault(token, {'children': {}, 'clusters': []})
+            else:
+                return None
+        return node['clusters']
+
+    def _similarity(self, template: List[str], tokens: List[str]) -> Tuple[float, int]:
+        same = wildcards = 0
+        for template_token, token in zip(template, tokens):
+            if template_token == WILDCARD:
+                wildcards += 1
+            elif template_token == token:
+                same += 1
+        return same / len(tokens) if tokens else 1.0, wildcards
+
+    def _best_match(self, clusters: List[Cluster], tokens: List[str]) -> Optional[Cluster]:
+        best, best_key = None, None
+        for cluster in clusters:
+            similarity, wildcards = self._similarity(cluster.tokens, tokens)
+            if best_key is None or (similarity, wildcards) > best_key:
+                best, best_key = cluster, (similarity, wildcards)
+        if best is not None and best_key[0] >= self.similarity_threshold:
+            return best
+        return None
+
+    def add(self, message: str) -> Tuple[Cluster, bool]:
+        """
+        Mine a message.
+
+        Returns:
+            tuple: ``(cluster, changed)``; ``changed`` is True when the
+            cluster is new or its template was generalized
+        """
+        tokens = self.tokenize(message)
+        clusters = self._leaf(tokens, create=True)
+        cluster = self._best_match(clusters, tokens)
+
+        if cluster is None:
+            cluster = Cluster(tokens)
+            clusters.append(cluster)
+            self.clusters.append(cluster)
+            return cluster, True
+
+        merged = [
+            template_token if template_token == token else WILDCARD
+            for template_token, token in zip(cluster.tokens, tokens)
+        ]
+        changed = merged != cluster.tokens
+        cluster.tokens = merged
+        return cluster, changed
+
+    def match(self, message: str) -> Optional[Cluster]:
+        """Return the cluster a message belongs to, without learning from it."""
+        tokens = self.tokenize(message)
+        clusters = self._leaf(tokens, create=False)
+        return self._best_match(clusters, tokens) if clusters else None
+
+    def load(self, template: str, template_id: int) -> Cluster:
+        """Restore a stored template into the tree."""
+        tokens = template.split()
+        cluster = Cluster(tokens, template_id)
+        self._leaf(tokens, create=True).append(cluster)
+        self.clusters.append(cluster)
+        return cluster
+
+
+_miner = None
+_miner_lock = threading.Lock()
+
+
+def get_miner() -> TemplateMiner:
+    """Return the process-wide miner, restored from the LogTemplate table."""
+    global _miner
+    if _miner is None:
+        with _miner_lock:
+            if _miner is None:
+                miner = TemplateMiner(
+                    depth=getattr(settings, 'ANOMALY_TEMPLATE_DEPTH', 4),
+                    similarity_threshold=getattr(settings, 'ANOMALY_TEMPLATE_SIMILARITY', 0.4),
+                    max_children=getattr(settings, 'ANOMALY_TEMPLATE_MAX_CHILDREN', 100),
+                )
+                for template_id, template in LogTemplate.objects.values_list('id', 'template'):
+                    miner.load(template, template_id)
+                _miner = miner
+    return _miner
+
+
+def _merge_template(duplicate: LogTemplate, into: int):
+    """Fold a template row into another: its entries, counts and time span."""
+    LogEntry.objects.filter(template_id=duplicate.id).update(template_id=into)
+    updates = {'count': F('count') + duplicate.count}
+    if duplicate.first_seen is not None:
+        updates['first_seen'] = Least(Coalesce(F('first_seen'), Value(duplicate.first_seen)), Value(duplicate.first_seen))
+    if duplicate.last_seen is not None:
+        updates['last_seen'] = Greatest(Coalesce(F('last_seen'), Value(duplicate.last_seen)), Value(duplicate.last_seen))
+    LogTemplate.objects.filter(id=into).update(**updates)
+    duplicate.delete()
+
+
+def _save_template(miner: TemplateMiner, cluster: Cluster):
+    """
+    Upsert the LogTemplate row backing a new or changed cluster.
+
+    A generalized cluster keeps its row. When its new template is already
+    stored under another row (an earlier merge, or another process), that
+    row is folded into it rather than left orphaned.
+    """
+    template = cluster.template
+    signature = template_signature(template)
+
+    try:
+        with transaction.atomic():
+            if cluster.template_id is not None and LogTemplate.objects.filter(id=cluster.template_id).exists():
+                duplicate = LogTemplate.objects.filter(signature=signature).exclude(id=cluster.template_id).first()
+                if duplicate is not None:
+                    _merge_template(duplicate, cluster.template_id)
+                    for other in miner.clusters:
+                        if other.template_id == duplicate.id:
+                            other.template_id = cluster.template_id
+                LogTemplate.objects.filter(id=cluster.template_id).update(template=template, signature=signature)
+                return
+            # New cluster, or its row was merged away by another process
+            cluster.template_id = LogTemplate.objects.get_or_create(
+                signature=signature, defaults={'template': template, 'token_count': len(cluster.tokens)}
+            )[0].id
+    except IntegrityError:
+        # Stored concurrently by another process
+        cluster.template_id = LogTemplate.objects.get(signature=signature).id
+
+
+def assign_templates(log_entries: List[LogEntry]) -> Dict[int, int]:
+    """
+    Mine log entries, store their template IDs and update template counts.
+
+    Args:
+        log_entries (List[LogEntry]): Entries to assign a template to
+
+    Returns:
+        dict: Template ID per log entry ID
+    """
+    miner = get_miner()
+    seen = {}
+
+    with _miner_lock:
+        clusters = []
+        for log_entry in log_entries:
+            cluster, changed = miner.add(log_entry.message)
+            if changed or cluster.template_id is None:
+                _save_template(miner, cluster)
+            clusters.append(cluster)
+
+        # Rows another process merged away are resolved by signature again
+        stored = set(LogTemplate.objects.filter(
+            id__in={cluster.template_id for cluster in clusters}
+        ).values_list('id', flat=True))
+        for cluster in clusters:
+            if cluster.template_id not in stored:
+                _save_template(miner, cluster)
+                stored.add(cluster.template_id)
+
+        for log_entry, cluster in zip(log_entries, clusters):
+            log_entry.template_id = cluster.template_id
+
+            count, first_seen, last_seen = seen.get(cluster.template_id, (0, log_entry.timestamp, log_entry.timestamp))
+            seen[cluster.template_id] = (
+                count + 1, min(first_seen, log_entry.timestamp), max(last_seen, log_entry.timestamp)
+            )
+
+    for template_id, (count, first_seen, last_seen) in seen.items():
+        LogTemplate.objects.filter(id=template_id).update(
+            count=F('count') + count,
+            first_seen=Least(Coalesce(F('first_seen'), Value(first_seen)), Value(first_seen)),
+            last_seen=Greatest(Coalesce(F('last_seen'), Value(last_seen)), Value(last_seen)),
+        )
+
+    LogEntry.objects.bulk_update(log_entries, ['template'])
+    return {log_entry.id: log_entry.template_id for log_entry in log_entries}
@@ -0,0 +1,108 @@
+# logs/test_embeddings.py
+
+import numpy as np
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import embeddings
+from .embeddings import EmbeddingIndex, normalize, store_embeddings
+from .models import LogEmbedding, LogEntry
+
+
+def clustered_vectors(count, dimensions=32, clusters=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dimensions))
+    vectors = centers[rng.integers(clusters, size=count)] + 0.1 * rng.normal(size=(count, dimensions))
+    return normalize(vectors).astype(np.float16)
+
+
+class EmbeddingIndexTests(SimpleTestCase):
+    """Tests for the float16 nearest-neighbour index"""
+
+    def exact(self, vectors, query, k):
+        scores = vectors.astype(np.float32) @ normalize(query)
+        return list(np.argsort(-scores, kind='stable')[:k])
+
+    def test_blocked_search_matches_exact_search(self):
+        vectors = clustered_vectors(1000)
+        index = EmbeddingIndex('v1', block_rows=128, ivf_min_rows=10**6)
+        index.add(range(1000), vectors)
+
+        query = vectors[7].astype(np.float32)
+        results = index.search(query, k=5)
+        self.assertEqual([match_id for match_id, _ in results], self.exact(vectors, query, 5))
+        self.assertAlmostEqual(results[0][1], 1.0, places=2)
+        self.assertNotIn(7, [match_id for match_id, _ in index.search(query, k=5, exclude=[7])])
+
+    def test_ivf_recall(self):
+        vectors = clustered_vectors(4000)
+        index = EmbeddingIndex('v1', block_rows=512, ivf_min_rows=2000, nprobe=8)
+        index.add(range(3000), vectors[:3000])
+        self.assertIsNotNone(index._ivf)
+        # Rows added after the lists were built are still searched
+        index.add(range(3000, 4000), vectors[3000:])
+
+        recall = []
+        for row in (5, 1234, 3500):
+            query = vectors[row].astype(np.float32)
+            found = {match_id for match_id, _ in index.search(query, k=10)}
+            recall.append(len(found & set(self.exact(vectors, query, 10))) / 10)
+        self.assertGreaterEqual(np.mean(recall), 0.9)
+
+
+class SimilarLogsTests(TestCase):
+    """Tests for similar-log search over stored embeddings"""
+
+    def setUp(self):
+        embeddings._indexes.clear()
+        self.client = APIClient()
+        self.entries = [
+            LogEntry.objects.create(timestamp=timezone.now(), severity='ERROR', message=f'event {i}')
+            for i in range(4)
+        ]
+        vectors = normalize(np.array([[1, 0, 0], [0.9, 0.1, 0], [0, 1, 0], [0.8, 0, 0.2]])).astype(np.float16)
+        store_embeddings(self.entries, vectors, 'v1:fp32:t1.0')
+
+    def test_rest_endpoint_ranks_by_similarity(self):
+        response = self.client.get(f'/api/logs/{self.entries[0].id}/similar/?limit=2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [result['id'] for result in response.json()['results']],
+            [self.entries[1].id, self.entries[3].id]
+        )
+
+    def test_new_embeddings_and_versions(self):
+        self.client.get(f'/api/logs/{self.entries[0].id}/similar/')
+        extra = LogEntry.objects.create(timestamp=timezone.now(), severity='INFO', message='event 5')
+        store_embeddings([extra], normalize(np.array([[1.0, 0, 0]])).astype(np.float16), 'v1:fp32:t1.0')
+        other = LogEntry.objects.create(timestamp=timezone.now(), severity='INFO', message='event 6')
+        store_embeddings([other], normalize(np.array([[1.0, 0, 0]])).astype(np.float16), 'v2:fp32:t1.0')
+
+        response = self.client.get(f'/api/logs/{self.entries[0].id}/similar/?limit=1')
+        self.assertEqual(response.json()['results'][0]['id'], extra.id)
+        self.assertEqual(LogEmbedding.objects.count(), 6)
+
+    def test_replaced_embeddings_reload_the_index(self):
+        index = embeddings.get_index('v1:fp32:t1.0')
+        index.refresh()
+        with self.assertNumQueries(1):
+            index.refresh()
+        # Same row count, but entry 0 now points the other way
+        store_embeddings([self.entries[0]], normalize(np.array([[0, 1.0, 0]])).astype(np.float16), 'v1:fp32:t1.0')
+        index.refresh()
+        query = normalize(np.array([0, 1.0, 0]))
+        self.assertEqual({match_id for match_id, _ in index.search(query, k=2)}, {self.entries[0].id, self.entries[2].id})
+
+    def test_errors(self):
+        self.assertEqual(self.client.get('/api/logs/999999/similar/').status_code, 404)
+        plain = LogEntry.objects.create(timestamp=timezone.now(), severity='INFO', message='no vector')
+        self.assertEqual(self.client.get(f'/api/logs/{plain.id}/similar/').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/logs/{plain.id}/similar/?limit=0').status_code, 400)
+
+    def test_graphql_query(self):
+        query = f'{{ similarLogs(logId: {self.entries[0].id}, limit: 1) {{ similarity logEntry {{ id }} }} }}'
+        response = self.client.post('/graphql/', {'query': query}, format='json')
+        result = response.json()['data']['similarLogs']
+        self.assertEqual(result[0]['logEntry']['id'], str(self.entries[1].id))
+        self.assertGreater(result[0]['similarity'], 0.9)
@@ -0,0 +1,608 @@
+# logs/test_inference.py
+
+import json
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+
+import numpy as np
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from .backends import weights_fingerprint
+from .benchmark import compare, fit_temperature, load_corpus
+from . import cascade, metrics
+from .cascade import Tier0Scorer, featurize, split_by_confidence
+from .early_exit import EarlyExitPolicy, ExitHeads, find_exit_heads, fit_head, fit_head_temperature
+from .inference import BatchingEngine, padding_ratio, plan_buckets
+from .inference_server import InferenceClient, InferenceServer, InferenceServerError
+from .metrics import Histogram
+from .model_registry import ModelRegistry, cpu_supports_bf16, current_rss_bytes, get_registry
+from .models import AnomalyReport, LogEntry
+from .tasks import analyze_log_batch
+from .thread_budget import plan_threads
+from .truncation import TruncationPolicy, collapse_repeats
+from .utils import analyze_logs, cache_variants
+from .verdict_cache import VerdictCache, fingerprint, normalize_message
+
+
+class BatchingEngineTests(SimpleTestCase):
+    """Tests for the micro-batching inference engine"""
+
+    def setUp(self):
+        self.batches = []
+
+        def predict(messages, severities):
+            self.batches.append(list(messages))
+            # Callers arriving meanwhile queue up for the next batch
+            time.sleep(0.02)
+            return [len(message) for message in messages]
+
+        self.engine = BatchingEngine(predict, max_batch_size=4, max_wait_ms=50)
+
+    def tearDown(self):
+        self.engine.shutdown()
+
+    def test_results_are_returned_in_order(self):
+        messages = ['a', 'bb', 'ccc', 'dddd', 'eeeee', 'ffffff']
+        self.assertEqual(self.engine.predict(messages), [1, 2, 3, 4, 5, 6])
+
+    def test_flushes_at_max_batch_size(self):
+        self.engine.predict(['m'] * 10)
+        self.assertTrue(all(len(batch) <= 4 for batch in self.batches))
+        self.assertEqual(sum(len(batch) for batch in self.batches), 10)
+
+    def test_concurrent_callers_share_batches(self):
+        barrier = threading.Barrier(4)
+        results = {}
+
+        def call(index):
+            barrier.wait()
+            results[index] = self.engine.submit('x' * index).result(timeout=5)
+
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(1, 5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, {1: 1, 2: 2, 3: 3, 4: 4})
+        self.assertLess(len(self.batches), 4)
+
+    def test_lone_caller_does_not_wait(self):
+        engine = BatchingEngine(lambda messages, severities: messages, max_wait_ms=5000)
+        start = time.perf_counter()
+        self.assertEqual(engine.predict(['a', 'b']), ['a', 'b'])
+        self.assertEqual(engine.submit('c').result(timeout=5), 'c')
+        self.assertLess(time.perf_counter() - start, 1)
+        engine.shutdown()
+
+    def test_severities_travel_with_their_messages(self):
+        seen = []
+        engine = BatchingEngine(lambda messages, severities: seen.extend(severities) or messages, max_wait_ms=1)
+        self.assertEqual(engine.predict(['a', 'b'], ['INFO', 'ERROR']), ['a', 'b'])
+        self.assertEqual(seen, ['INFO', 'ERROR'])
+        engine.shutdown()
+
+    def test_prediction_errors_reach_every_caller(self):
+        def failing_predict(messages, severities):
+            raise RuntimeError('model unavailable')
+
+        engine = BatchingEngine(failing_predict, max_batch_size=2, max_wait_ms=1)
+        future = engine.submit('boom')
+        with self.assertRaises(RuntimeError):
+            future.result(timeout=5)
+        engine.shutdown()
+
+
+class LengthBucketingTests(SimpleTestCase):
+    def test_plan_buckets_groups_similar_lengths(self):
+        lengths = [300, 5, 7, 280, 6, 310]
+        self.assertEqual(plan_buckets(lengths, 3), [[1, 4, 2], [3, 0, 5]])
+
+    def test_plan_buckets_covers_every_index_once(self):
+        lengths = [4, 1, 9, 2, 8]
+        groups = plan_buckets(lengths, 2)
+        self.assertEqual(sorted(i for group in groups for i in group), [0, 1, 2, 3, 4])
+
+    def test_padding_ratio(self):
+        self.assertEqual(padding_ratio([10, 10]), 0.0)
+        self.assertAlmostEqual(padding_ratio([10, 510]), 0.490196, places=5)
+        self.assertEqual(padding_ratio([]), 0.0)
+
+
+class WordTokenizer:
+    """Whitespace tokenizer with [CLS]/[SEP] framing, enough for TruncationPolicy"""
+    model_max_length = 512
+
+    def num_special_tokens_to_add(self):
+        return 2
+
+    def __call__(self, texts, add_special_tokens=False):
+        return {'input_ids': [text.split() for text in texts]}
+
+    def prepare_for_model(self, ids, add_special_tokens=True):
+        ids = ['[CLS]'] + ids + ['[SEP]']
+        return {'input_ids': ids, 'attention_mask': [1] * len(ids)}
+
+
+class TruncationPolicyTests(SimpleTestCase):
+    def setUp(self):
+        self.message = ' '.join(f'w{i}' for i in range(20))
+
+    def test_head_keeps_the_start(self):
+        encodings = TruncationPolicy('head', default_budget=7).encode(WordTokenizer(), [self.message])
+        self.assertEqual(encodings['input_ids'][0], ['[CLS]', 'w0', 'w1', 'w2', 'w3', 'w4', '[SEP]'])
+
+    def test_head_tail_keeps_both_ends(self):
+        encodings = TruncationPolicy('head_tail', default_budget=7).encode(WordTokenizer(), [self.message])
+        self.assertEqual(encodings['input_ids'][0], ['[CLS]', 'w0', 'w1', 'w17', 'w18', 'w19', '[SEP]'])
+
+    def test_budget_depends_on_severity(self):
+        policy = TruncationPolicy('head', budgets={'info': 4}, default_budget=10)
+        encodings = policy.encode(WordTokenizer(), [self.message, self.message], ['INFO', 'ERROR'])
+        self.assertEqual([len(ids) for ids in encodings['input_ids']], [4, 10])
+
+    def test_short_messages_are_untouched(self):
+        encodings = TruncationPolicy('head_tail', default_budget=64).encode(WordTokenizer(), ['disk full'])
+        self.assertEqual(encodings['input_ids'][0], ['[CLS]', 'disk', 'full', '[SEP]'])
+
+    def test_collapse_repeats(self):
+        trace = '\n'.join(
+            ['Exception in thread main', 'Retrying in 5s', 'Retrying in 10s', 'Retrying in 20s']
+            + [f'    at com.example.Worker.{name}(Worker.java:{i})' for i, name in enumerate('abcdefghij')]
+            + ['Caused by: java.io.IOException: disk full']
+        )
+        self.assertEqual(collapse_repeats(trace).splitlines(), [
+            'Exception in thread main',
+            'Retrying in 5s [repeated 3 times]',
+            '    at com.example.Worker.a(Worker.java:0)',
+            '    at com.example.Worker.b(Worker.java:1)',
+            '    ... 6 similar frames ...',
+            '    at com.example.Worker.i(Worker.java:8)',
+            '    at com.example.Worker.j(Worker.java:9)',
+            'Caused by: java.io.IOException: disk full',
+        ])
+
+    def test_budget_filled_by_special_tokens(self):
+        for policy in ('head', 'head_tail'):
+            encodings = TruncationPolicy(policy, budgets={'INFO': 1}).encode(WordTokenizer(), [self.message], ['INFO'])
+            self.assertEqual(encodings['input_ids'][0], ['[CLS]', '[SEP]'])
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            TruncationPolicy('middle')
+        with self.assertRaises(ValueError):
+            TruncationPolicy('head', budgets={'INFO': 0})
+
+
+class ThreadBudgetTests(SimpleTestCase):
+    def test_split_shares_cores_between_processes(self):
+        budget = plan_threads(processes=4, cpus=8, policy='split', reserve=0, inter_op=1)
+        self.assertEqual((budget.intra_op, budget.inter_op), (2, 1))
+        self.assertFalse(budget.oversubscribed)
+
+    def test_reserve_and_minimum_of_one_thread(self):
+        budget = plan_threads(processes=4, cpus=4, policy='split', reserve=2)
+        self.assertEqual(budget.cpus, 2)
+        self.assertEqual(budget.intra_op, 1)
+        self.assertTrue(budget.oversubscribed)
+
+    def test_per_process_and_fixed_policies(self):
+        self.assertEqual(plan_threads(processes=2, cpus=16, policy='per_process', reserve=0).intra_op, 1)
+        self.assertEqual(plan_threads(processes=2, cpus=16, policy='fixed', reserve=0, intra_op=3).intra_op, 3)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            plan_threads(processes=1, policy='greedy')
+
+
+class Bf16PrecisionTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def cpuinfo(self, flags):
+        path = os.path.join(self.directory, f'cpuinfo-{len(os.listdir(self.directory))}')
+        with open(path, 'w') as cpuinfo:
+            cpuinfo.write(f'processor\t: 0\nflags\t\t: {flags}\n')
+        return path
+
+    def test_cpu_flag_detection(self):
+        self.assertTrue(cpu_supports_bf16(self.cpuinfo('fpu sse2 avx512f avx512_bf16')))
+        self.assertFalse(cpu_supports_bf16(self.cpuinfo('fpu sse2 avx2')))
+        self.assertFalse(cpu_supports_bf16('/nonexistent/cpuinfo'))
+
+    def test_falls_back_to_fp32_without_native_support(self):
+        with mock.patch('logs.model_registry.cpu_supports_bf16', return_value=False):
+            registry = ModelRegistry('m', precision='bf16')
+            self.assertEqual(registry.precision, 'fp32')
+            self.assertEqual(registry.version, 'm:fp32:t1.0')
+            self.assertEqual(ModelRegistry('m', precision='bf16', allow_emulated_bf16=True).precision, 'bf16')
+
+        with mock.patch('logs.model_registry.cpu_supports_bf16', return_value=True):
+            self.assertEqual(ModelRegistry('m', precision='bf16').version, 'm:bf16:t1.0')
+
+    def test_bf16_needs_the_eager_backend(self):
+        with self.assertRaises(ValueError):
+            ModelRegistry('m', precision='bf16', backend='torchscript')
+
+
+class ProcessMemoryTests(SimpleTestCase):
+    def test_rss_fallback_units(self):
+        usage = mock.Mock(ru_maxrss=2048)
+        with mock.patch('builtins.open', side_effect=OSError), mock.patch('resource.getrusage', return_value=usage):
+            with mock.patch('sys.platform', 'linux'):
+                self.assertEqual(current_rss_bytes(), 2048 * 1024)
+            with mock.patch('sys.platform', 'darwin'):
+                self.assertEqual(current_rss_bytes(), 2048)
+
+
+class WeightsFingerprintTests(SimpleTestCase):
+    def test_fingerprint_follows_the_weights(self):
+        with tempfile.TemporaryDirectory() as directory:
+            weights = os.path.join(directory, 'model.safetensors')
+            with open(weights, 'wb') as weights_file:
+                weights_file.write(b'old weights')
+            before = weights_fingerprint(directory)
+            with open(weights, 'wb') as weights_file:
+                weights_file.write(b'fine-tuned weights')
+            self.assertNotEqual(weights_fingerprint(directory), before)
+
+            with open(os.path.join(directory, 'MANIFEST.json'), 'w') as manifest:
+                json.dump({'files': {'model.safetensors': {'sha256': 'ab' * 32, 'bytes': 18}}}, manifest)
+            self.assertEqual(weights_fingerprint(directory), 'ab' * 6)
+
+        hub_model = mock.Mock(config=mock.Mock(_commit_hash='0123456789abcdef'))
+        self.assertEqual(weights_fingerprint('bert-base-uncased', hub_model), '0123456789ab')
+
+
+class EarlyExitTests(SimpleTestCase):
+    def test_fit_head_learns_separable_classes(self):
+        rng = np.random.default_rng(0)
+        features = rng.normal(size=(400, 8)).astype(np.float32) * 5 + 3
+        targets = (features[:, 2] > 3).astype(int)
+        weight, bias = fit_head(features, targets)
+        predictions = (features @ weight + bias).argmax(axis=1)
+        self.assertGreater((predictions == targets).mean(), 0.95)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_train_command_takes_the_version_as_an_argument(self):
+        from .management.commands.train_exit_heads import Command
+
+        # Django's own --version must not be shadowed
+        parser = Command().create_parser('manage.py', 'train_exit_heads')
+        self.assertEqual(parser.parse_args(['2024-07-15', '--limit', '10']).version, '2024-07-15')
+        self.assertIsNone(parser.parse_args([]).version)
+
+    def test_heads_roundtrip(self):
+        heads = ExitHeads({6: (np.ones((4, 2)), np.zeros(2)), 3: (np.eye(4, 2), np.ones(2))}, {6: 1.5})
+        path = os.path.join(self.directory, 'heads.npz')
+        heads.save(path)
+        loaded = ExitHeads.load(path)
+        self.assertEqual(loaded.layers, [3, 6])
+        self.assertEqual(loaded.temperatures, {3: 1.0, 6: 1.5})
+        np.testing.assert_array_equal(loaded.heads[3][0], np.eye(4, 2))
+        np.testing.assert_array_equal(loaded.heads[6][1], np.zeros(2))
+
+    def test_head_temperature_matches_the_full_model(self):
+        rng = np.random.default_rng(0)
+        full_logits = rng.normal(size=(500, 2)) * 2
+        full_probabilities = np.exp(full_logits) / np.exp(full_logits).sum(axis=1, keepdims=True)
+        # An overconfident head: same ranking, logits three times too large
+        self.assertAlmostEqual(fit_head_temperature(full_logits * 3, full_probabilities), 3.0, delta=0.1)
+
+    def test_policy_thresholds_and_version(self):
+        policy = EarlyExitPolicy({'info': 0.9, 'ERROR': 1.01}, default_threshold=0.95)
+        self.assertEqual(policy.threshold('INFO'), 0.9)
+        self.assertEqual(policy.threshold('error'), 1.01)
+        self.assertEqual(policy.threshold(None), 0.95)
+        self.assertNotEqual(policy.signature, EarlyExitPolicy({'INFO': 0.8}).signature)
+
+        path = os.path.join(self.directory, 'heads.npz')
+        ExitHeads({3: (np.ones((4, 2)), np.zeros(2))}).save(path)
+        version = ModelRegistry('m', exit_heads=path, early_exit=policy).version
+        self.assertTrue(version.startswith(f'm:fp32:t1.0:exit-{policy.signature}-'))
+        ExitHeads({3: (np.ones((4, 2)), np.ones(2))}).save(path)
+        self.assertNotEqual(ModelRegistry('m', exit_heads=path, early_exit=policy).version, version)
+        # Missing heads mean the full model serves
+        self.assertEqual(ModelRegistry('m', exit_heads='/nonexistent/heads.npz').version, 'm:fp32:t1.0')
+        self.assertEqual(ModelRegistry('m').version, 'm:fp32:t1.0')
+        with self.assertRaises(ValueError):
+            ModelRegistry('m', backend='onnx', exit_heads='/nonexistent/heads.npz')
+
+    def test_versioned_models_only_use_their_own_heads(self):
+        shared = os.path.join(self.directory, 'shared.npz')
+        with override_settings(ANOMALY_EARLY_EXIT_HEADS=shared):
+            self.assertEqual(find_exit_heads(self.directory, versioned=False), shared)
+            self.assertIsNone(find_exit_heads(self.directory, versioned=True))
+            ExitHeads({3: (np.ones((4, 2)), np.zeros(2))}).save(os.path.join(self.directory, 'exit_heads.npz'))
+            self.assertEqual(
+                find_exit_heads(self.directory, versioned=True), os.path.join(self.directory, 'exit_heads.npz')
+            )
+
+
+class HistogramTests(SimpleTestCase):
+    def test_snapshot_percentiles(self):
+        histogram = Histogram('test', [1, 2, 4, 8])
+        for value in [1, 1, 2, 3, 7]:
+            histogram.observe(value)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['count'], 5)
+        self.assertEqual(snapshot['p50'], 2)
+        self.assertEqual(snapshot['p99'], 8)
+        self.assertEqual(snapshot['max'], 7)
+
+
+class BenchmarkCorpusTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_labelled_corpus_file(self):
+        path = os.path.join(self.directory, 'corpus.jsonl')
+        with open(path, 'w') as corpus:
+            corpus.write(json.dumps({'message': 'disk full', 'label': 1}) + '\n')
+            corpus.write(json.dumps({'message': 'heartbeat', 'label': 0}) + '\n')
+        messages, labels = load_corpus(path)
+        self.assertEqual(messages, ['disk full', 'heartbeat'])
+        self.assertEqual(labels, [1, 0])
+
+    def test_plain_corpus_file_is_unlabelled(self):
+        path = os.path.join(self.directory, 'corpus.txt')
+        with open(path, 'w') as corpus:
+            corpus.write('first line\n\nsecond line\n')
+        messages, labels = load_corpus(path)
+        self.assertEqual(messages, ['first line', 'second line'])
+        self.assertIsNone(labels)
+
+    def test_database_corpus_is_only_labelled_by_reports_on_request(self):
+        LogEntry.objects.create(timestamp=timezone.now(), severity='INFO', message='ok')
+        anomalous = LogEntry.objects.create(timestamp=timezone.now(), severity='ERROR', message='boom')
+        AnomalyReport.objects.create(log_entry=anomalous, anomaly_score=1.0, summary='boom')
+        # The reports are the classifier's own verdicts, not ground truth
+        messages, labels = load_corpus()
+        self.assertEqual(sorted(messages), ['boom', 'ok'])
+        self.assertIsNone(labels)
+        messages, labels = load_corpus(report_labels=True)
+        self.assertEqual(dict(zip(messages, labels)), {'ok': 0, 'boom': 1})
+
+    def test_compare(self):
+        self.assertEqual(
+            compare([0.9, 0.2, 0.1, 0.75], [0.8, 0.3, 0.6, 0.75], labels=[1, 1, 0, 1]),
+            {'agreement': 0.75, 'accuracy': 0.5, 'max_probability_drift': 0.5}
+        )
+
+
+class CalibrationTests(TestCase):
+    def test_fit_temperature_softens_overconfident_logits(self):
+        # Confident logits that are wrong a third of the time
+        logits = np.array([[0.0, 6.0], [6.0, 0.0], [0.0, 6.0]] * 10)
+        labels = [1, 0, 0] * 10
+        temperature, nll = fit_temperature(logits, labels)
+        self.assertGreater(temperature, 1.0)
+        _, uncalibrated_nll = fit_temperature(logits, labels, candidates=[1.0])
+        self.assertLess(nll, uncalibrated_nll)
+
+    @override_settings(ANOMALY_ALERT_THRESHOLD=0.7, ANOMALY_TEMPLATE_MINING_ENABLED=False)
+    def test_batch_task_stores_probabilities_and_applies_threshold(self):
+        entries = [
+            LogEntry.objects.create(timestamp=timezone.now(), severity='ERROR', message=f'event {i}')
+            for i in range(3)
+        ]
+        verdicts = [(0.2, 'tier0'), (0.65, 'v2:fp32:t1.0'), (0.93, 'v2:fp32:t1.0')]
+        with mock.patch('logs.tasks.analyze_logs_tagged', return_value=verdicts):
+            result = analyze_log_batch.run([entry.id for entry in entries])
+
+        self.assertEqual(result['anomalies_detected'], 1)
+        self.assertEqual(result['model_versions'], ['tier0', 'v2:fp32:t1.0'])
+        self.assertEqual(
+            list(LogEntry.objects.order_by('id').values_list('anomaly_probability', 'model_version')),
+            verdicts
+        )
+        report = AnomalyReport.objects.get()
+        self.assertEqual(report.log_entry_id, entries[2].id)
+        self.assertAlmostEqual(report.anomaly_score, 0.93)
+
+
+class VerdictCacheTests(SimpleTestCase):
+    def setUp(self):
+        for name in ('local_hits', 'shared_hits', 'misses'):
+            metrics.counter(f'verdict_cache.{name}').reset()
+
+    def test_normalize_masks_variable_parts(self):
+        self.assertEqual(
+            normalize_message('User 42 from 10.0.0.7:8080 request 0x1F req=550e8400-e29b-41d4-a716-446655440000'),
+            'User <NUM> from <IP> request <HEX> req=<UUID>'
+        )
+        self.assertEqual(normalize_message('commit deadbeef42  done'), 'commit <HEX> done')
+
+    def test_same_template_same_fingerprint(self):
+        self.assertEqual(
+            fingerprint('Timeout after 30s on worker-7'),
+            fingerprint('Timeout after 45s on worker-12')
+        )
+        self.assertNotEqual(fingerprint('Timeout after 30s'), fingerprint('Connected after 30s'))
+
+    def test_hits_and_misses(self):
+        verdicts = VerdictCache(max_size=10, ttl=60)
+        self.assertEqual(verdicts.get_many(['job 1 failed'], 'v1'), {})
+        verdicts.set_many(['job 1 failed'], [1], 'v1')
+        self.assertEqual(verdicts.get_many(['ok', 'job 2 failed'], 'v1'), {1: 1})
+        self.assertEqual(verdicts.stats()['local_hits'], 1)
+        self.assertEqual(verdicts.stats()['misses'], 2)
+
+    def test_lru_eviction(self):
+        verdicts = VerdictCache(max_size=2, ttl=60)
+        verdicts.set_many(['alpha', 'beta'], [0, 0], 'v1')
+        verdicts.get_many(['alpha'], 'v1')
+        verdicts.set_many(['gamma'], [1], 'v1')
+        self.assertEqual(verdicts.get_many(['alpha', 'beta', 'gamma'], 'v1'), {0: 0, 2: 1})
+
+    def test_ttl_expiry(self):
+        verdicts = VerdictCache(max_size=10, ttl=0)
+        verdicts.set_many(['alpha'], [1], 'v1')
+        self.assertEqual(verdicts.get_many(['alpha'], 'v1'), {})
+
+    def test_versions_are_kept_apart(self):
+        verdicts = VerdictCache(max_size=10, ttl=60)
+        verdicts.set_many(['alpha'], [1], 'v1')
+        self.assertEqual(verdicts.get_many(['alpha'], 'v2'), {})
+        verdicts.set_many(['alpha'], [0], 'v2')
+        # Switching versions back and forth does not empty the local tier
+        self.assertEqual(verdicts.get_many(['alpha'], 'v1'), {0: 1})
+        self.assertEqual(verdicts.get_many(['alpha'], 'v2'), {0: 0})
+
+    def test_variants_are_kept_apart(self):
+        verdicts = VerdictCache(max_size=10, ttl=60)
+        verdicts.set_many(['alpha', 'alpha'], [0, 1], 'v1', variants=['b64', 'b512'])
+        self.assertEqual(verdicts.get_many(['alpha', 'alpha', 'alpha'], 'v1', ['b512', 'b64', 'b128']), {0: 1, 1: 0})
+
+    @override_settings(
+        ANOMALY_TOKEN_BUDGETS={'INFO': 64}, ANOMALY_TOKEN_BUDGET=512,
+        ANOMALY_EARLY_EXIT_THRESHOLDS={'INFO': 0.9}, ANOMALY_EARLY_EXIT_DEFAULT_THRESHOLD=0.95,
+    )
+    def test_cache_variants_follow_the_severity(self):
+        self.assertEqual(cache_variants(['INFO', 'ERROR'], 'm:fp32:t1.0'), ['b64', 'b512'])
+        self.assertEqual(cache_variants(['INFO', 'ERROR'], 'm:fp32:t1.0:exit-a-b'), ['b64:x0.9', 'b512:x0.95'])
+
+    def test_shared_tier(self):
+        cache.clear()
+        writer = VerdictCache(max_size=10, ttl=60, shared_alias='default')
+        reader = VerdictCache(max_size=10, ttl=60, shared_alias='default')
+        writer.set_many(['disk 93% full'], [1], 'v1')
+        self.assertEqual(reader.get_many(['disk 97% full'], 'v1'), {0: 1})
+        self.assertEqual(reader.stats()['shared_hits'], 1)
+
+
+class Tier0ScorerTests(SimpleTestCase):
+    def test_featurize_is_stable_across_variable_parts(self):
+        first, _ = featurize('Heartbeat 17 ok', 'INFO', 1024)
+        second, _ = featurize('Heartbeat 42 ok', 'INFO', 1024)
+        np.testing.assert_array_equal(first, second)
+
+    def test_fit_separates_simple_classes(self):
+        messages = ['heartbeat ok', 'cache refreshed', 'kernel panic', 'segmentation fault'] * 20
+        labels = [0, 0, 1, 1] * 20
+        severities = ['INFO', 'INFO', 'CRITICAL', 'ERROR'] * 20
+        scorer = Tier0Scorer.fit(messages, labels, severities, dimensions=4096, epochs=10)
+        probabilities = scorer.score(['heartbeat ok', 'kernel panic'], ['INFO', 'CRITICAL'])
+        self.assertLess(probabilities[0], 0.1)
+        self.assertGreater(probabilities[1], 0.9)
+
+    def test_save_and_load(self):
+        scorer = Tier0Scorer(np.arange(16, dtype=np.float32), bias=0.5)
+        with tempfile.TemporaryDirectory() as directory:
+            path = f'{directory}/tier0.npz'
+            scorer.save(path)
+            loaded = Tier0Scorer.load(path)
+        np.testing.assert_array_equal(loaded.weights, scorer.weights)
+        self.assertEqual(loaded.bias, 0.5)
+
+    def test_split_by_confidence(self):
+        decided, uncertain = split_by_confidence(np.array([0.01, 0.5, 0.99, 0.9]), 0.05, 0.95)
+        self.assertEqual(list(decided), [0, 2])
+        self.assertAlmostEqual(decided[0], 0.01)
+        self.assertAlmostEqual(decided[2], 0.99)
+        self.assertEqual(uncertain, [1, 3])
+
+    def test_confident_messages_skip_the_model(self):
+        messages = ['heartbeat ok', 'kernel panic'] * 20
+        scorer = Tier0Scorer.fit(messages, [0, 1] * 20, dimensions=4096, epochs=10)
+        with tempfile.TemporaryDirectory() as directory:
+            path = f'{directory}/tier0.npz'
+            scorer.save(path)
+            cascade._scorer_loaded = False
+            with override_settings(ANOMALY_TIER0_WEIGHTS=path, ANOMALY_VERDICT_CACHE_ENABLED=False,
+                                   ANOMALY_RULES_ENABLED=False):
+                normal, anomalous = analyze_logs(['heartbeat ok', 'kernel panic'], ['INFO', 'ERROR'])
+            self.assertLess(normal, 0.05)
+            self.assertGreater(anomalous, 0.95)
+            cascade._scorer, cascade._scorer_loaded = None, False
+        self.assertFalse(get_registry().is_loaded)
+
+
+# Rules are read from the database, which these tests do not use
+@override_settings(ANOMALY_RULES_ENABLED=False)
+class InferenceServerTests(SimpleTestCase):
+    """Tests for the Unix socket inference server and its client"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = f'{self.tmp.name}/inference.sock'
+        self.engine = BatchingEngine(
+            lambda messages, severities: [
+                (0.9 if severity == 'ERROR' else 0.1, 'test-model') for severity in severities
+            ],
+            max_wait_ms=1
+        )
+        self.server = InferenceServer(self.path, self.engine)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.engine.shutdown()
+        self.tmp.cleanup()
+
+    def test_client_round_trip(self):
+        client = InferenceClient(self.path, timeout=5)
+        self.assertEqual(
+            client.predict(['a', 'b'], ['INFO', 'ERROR']), [(0.1, 'test-model'), (0.9, 'test-model')]
+        )
+
+    def test_server_errors_reach_the_client(self):
+        self.server.engine = BatchingEngine(lambda messages, severities: 1 / 0, max_wait_ms=1)
+        with self.assertRaises(InferenceServerError):
+            InferenceClient(self.path, timeout=5).predict(['a'])
+        self.server.engine.shutdown()
+
+    @override_settings(ANOMALY_VERDICT_CACHE_ENABLED=False, ANOMALY_TIER0_ENABLED=False)
+    def test_analyze_logs_uses_the_server(self):
+        with override_settings(ANOMALY_INFERENCE_SOCKET=self.path):
+            self.assertEqual(analyze_logs(['disk full'], ['ERROR']), [0.9])
+
+    def test_embeddings_come_from_the_server(self):
+        vectors = np.arange(6, dtype=np.float16).reshape(2, 3)
+        self.server.embedder = lambda messages, severities: (vectors[:len(messages)], 'v2:fp32:t1.0')
+        embedded, version = InferenceClient(self.path, timeout=5).embed(['a', 'b'], ['INFO', 'ERROR'])
+        np.testing.assert_array_equal(embedded, vectors)
+        self.assertEqual(version, 'v2:fp32:t1.0')
+
+    def test_client_asks_for_the_served_version(self):
+        versions = iter(['v1:fp32:t1.0', 'v2:fp32:t1.0'])
+        self.server.version_source = lambda: next(versions)
+        client = InferenceClient(self.path, timeout=5, version_ttl=60)
+        self.assertEqual(client.model_version(), 'v1:fp32:t1.0')
+        self.assertEqual(client.model_version(), 'v1:fp32:t1.0')
+        client.version_ttl = 0
+        self.assertEqual(client.model_version(), 'v2:fp32:t1.0')
+
+    @override_settings(ANOMALY_TIER0_ENABLED=False)
+    def test_cache_lookups_use_the_served_version(self):
+        # This process's own registry never reloads when a server classifies
+        self.server.version_source = lambda: 'v2:fp32:t1.0'
+        with override_settings(ANOMALY_INFERENCE_SOCKET=self.path), \
+                mock.patch('logs.utils.get_verdict_cache') as verdict_cache:
+            verdict_cache.return_value.get_many.return_value = {}
+            analyze_logs(['disk full'], ['ERROR'])
+        self.assertTrue(verdict_cache.return_value.get_many.call_args.args[1].startswith('v2:fp32:t1.0:'))
+
+    @override_settings(ANOMALY_VERDICT_CACHE_ENABLED=False, ANOMALY_TIER0_ENABLED=False,
+                       ANOMALY_BATCHING_ENABLED=False)
+    def test_analyze_logs_falls_back_in_process(self):
+        with override_settings(ANOMALY_INFERENCE_SOCKET=f'{self.tmp.name}/missing.sock'), \
+                mock.patch('logs.utils.predict_tagged', return_value=[(0.4, 'local-model')]) as predict:
+            self.assertEqual(analyze_logs(['disk full'], ['ERROR']), [0.4])
+        predict.assert_called_once_with(['disk full'], ['ERROR'])
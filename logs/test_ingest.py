@@ -0,0 +1,368 @@
+"""
+Tests for bulk log ingestion.
+"""
+import io
+import json
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, transaction
+from django.db.models import QuerySet, Sum
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import ingest_buffer
+from .ingest import aingest, aingest_stream, iter_ndjson, validate_items
+from .ingest_buffer import IngestFlusher, SegmentBuffer
+from .models import IngestSegment, LogEntry
+from .utils import generate_hmac
+
+
+@override_settings(ANOMALY_BULK_INSERT_CHUNK=2, ANOMALY_BULK_ANALYSIS_CHUNK=2)
+class BulkIngestTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        patcher = mock.patch('logs.tasks.analyze_log_batch.delay')
+        self.delay = patcher.start()
+        self.delay.return_value.id = 'task-id'
+        self.addCleanup(patcher.stop)
+
+    def entry(self, message, severity='INFO'):
+        return {'timestamp': '2025-06-01T12:00:00Z', 'severity': severity, 'message': message}
+
+    def test_json_array(self):
+        entries = [self.entry(f'message {n}') for n in range(5)]
+        response = self.client.post('/api/logs/bulk/', json.dumps(entries), content_type='application/json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['accepted'], 5)
+        ids = [result['id'] for result in response.data['results']]
+        self.assertEqual(
+            list(LogEntry.objects.filter(id__in=ids).order_by('id').values_list('message', flat=True)),
+            [f'message {n}' for n in range(5)]
+        )
+        # Three analysis tasks of at most two entries each
+        self.assertEqual([call.args[0] for call in self.delay.call_args_list], [ids[0:2], ids[2:4], ids[4:]])
+        self.assertEqual(response.data['analysis_task_ids'], ['task-id'] * 3)
+
+    def test_json_array_is_stored_in_one_transaction(self):
+        entries = [self.entry(f'message {n}') for n in range(5)]
+        insert = QuerySet._insert
+        calls = []
+
+        def fail_third_batch(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 3:
+                raise DatabaseError('disk I/O error')
+            return insert(*args, **kwargs)
+
+        with transaction.atomic(), mock.patch.object(QuerySet, '_insert', autospec=True, side_effect=fail_third_batch):
+            response = self.client.post('/api/logs/bulk/', json.dumps(entries), content_type='application/json')
+        self.assertEqual(response.status_code, 500)
+        # The first two batches went back with the third
+        self.assertFalse(LogEntry.objects.exists())
+        self.delay.assert_not_called()
+
+    def test_broker_failure_still_returns_the_stored_ids(self):
+        self.delay.side_effect = ConnectionError('broker down')
+        entries = [self.entry(f'message {n}') for n in range(3)]
+        response = self.client.post('/api/logs/bulk/', json.dumps(entries), content_type='application/json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['status'], 'stored')
+        self.assertEqual(response.data['analysis_task_ids'], [])
+        ids = [result['id'] for result in response.data['results']]
+        self.assertEqual(LogEntry.objects.filter(id__in=ids).count(), 3)
+
+    def test_ndjson_is_stored_as_it_streams(self):
+        body = '\n'.join([
+            json.dumps(self.entry('disk full', 'ERROR')),
+            '{not json',
+            json.dumps({'severity': 'INFO', 'message': 'no timestamp'}),
+            '',
+            json.dumps(self.entry('all good')),
+            json.dumps(self.entry('still good')),
+        ])
+        with self.captureOnCommitCallbacks(execute=True), \
+                override_settings(ANOMALY_BULK_STREAM_CHUNK_BYTES=16, ANOMALY_BULK_MAX_REPORTED_ERRORS=1):
+            response = self.client.post('/api/logs/bulk/', body, content_type='application/x-ndjson')
+
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual((response.data['accepted'], response.data['rejected']), (3, 2))
+        # Only rejected lines are listed, up to the reporting cap
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['index'], 1)
+        self.assertIn('non_field_errors', response.data['results'][0]['errors'])
+        self.assertTrue(response.data['results_truncated'])
+        self.assertEqual(
+            sorted(LogEntry.objects.values_list('message', flat=True)), ['all good', 'disk full', 'still good']
+        )
+        self.assertEqual(sum(len(call.args[0]) for call in self.delay.call_args_list), 3)
+
+    def test_signed_ndjson_is_verified_before_it_is_stored(self):
+        body = json.dumps(self.entry('signed'))
+        with mock.patch('django.db.transaction.Atomic.__enter__', side_effect=AssertionError('transaction opened')):
+            response = self.client.post(
+                '/api/logs/bulk/', body, content_type='application/x-ndjson', headers={'X-HMAC-Signature': 'invalid'}
+            )
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(LogEntry.objects.exists())
+
+        with override_settings(ANOMALY_BULK_SIGNED_MAX_BYTES=8):
+            response = self.client.post(
+                '/api/logs/bulk/', body, content_type='application/x-ndjson',
+                headers={'X-HMAC-Signature': generate_hmac(settings.SECRET_KEY, body)}
+            )
+        self.assertEqual(response.status_code, 400)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/api/logs/bulk/', body, content_type='application/x-ndjson',
+                headers={'X-HMAC-Signature': generate_hmac(settings.SECRET_KEY, body)}
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(LogEntry.objects.get().message, 'signed')
+        self.delay.assert_called_once()
+
+    def test_rejects_bodies_that_are_not_lists(self):
+        response = self.client.post('/api/logs/bulk/', json.dumps(self.entry('one')), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        with override_settings(ANOMALY_BULK_MAX_ITEMS=2):
+            entries = [self.entry('x')] * 3
+            response = self.client.post('/api/logs/bulk/', json.dumps(entries), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(LogEntry.objects.exists())
+        self.delay.assert_not_called()
+
+
+@override_settings(ANOMALY_BULK_ANALYSIS_CHUNK=2)
+class ProcessLogBatchTests(TestCase):
+    def test_bad_entries_are_reported_without_failing_the_others(self):
+        from .tasks import process_log_batch
+
+        entries = [
+            {'timestamp': '2025-06-01T12:00:00Z', 'severity': 'INFO', 'message': 'first'},
+            {'timestamp': 'abc', 'severity': 'INFO', 'message': 'bad'},
+            {'timestamp': '2025-06-01T12:01:00Z', 'severity': 'ERROR', 'message': 'second'},
+            {'timestamp': '2025-06-01T12:02:00Z', 'severity': 'ERROR', 'message': 'third'},
+        ]
+        with mock.patch('logs.tasks.analyze_log_batch.delay') as delay:
+            delay.side_effect = [mock.Mock(id='task-1'), mock.Mock(id='task-2')]
+            result = process_log_batch(entries)
+
+        self.assertEqual((result['accepted'], result['rejected']), (3, 1))
+        self.assertIn('timestamp', result['tasks'][1]['errors'])
+        self.assertEqual([task.get('task_id') for task in result['tasks']], ['task-1', None, 'task-1', 'task-2'])
+        ids = result['log_entry_ids']
+        self.assertEqual([call.args[0] for call in delay.call_args_list], [ids[:2], ids[2:]])
+        self.assertEqual(
+            list(LogEntry.objects.order_by('id').values_list('message', flat=True)), ['first', 'second', 'third']
+        )
+
+
+class NdjsonReaderTests(SimpleTestCase):
+    def test_lines_split_across_chunks(self):
+        body = b'{"a": 1}\n\n{"b": "long value"}\r\n{"c": 3}'
+        items = list(iter_ndjson(io.BytesIO(body), chunk_size=5))
+        self.assertEqual(items, [({'a': 1}, None), ({'b': 'long value'}, None), ({'c': 3}, None)])
+
+    def test_oversized_lines_are_skipped(self):
+        body = b'{"a": 1}\n' + b'x' * 100 + b'\n{"b": 2}\n' + b'y' * 100
+        items = list(iter_ndjson(io.BytesIO(body), chunk_size=8, max_line_bytes=32))
+        self.assertEqual(items[0], ({'a': 1}, None))
+        self.assertIsNone(items[1][0])
+        self.assertIn('longer than 32 bytes', items[1][1])
+        self.assertEqual(items[2], ({'b': 2}, None))
+        self.assertIsNone(items[3][0])
+        self.assertEqual(len(items), 4)
+
+
+@override_settings(ANOMALY_BULK_INSERT_CHUNK=2, ANOMALY_BULK_ANALYSIS_CHUNK=2)
+class AsyncBulkIngestTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('logs.tasks.analyze_log_batch.delay')
+        self.delay = patcher.start()
+        self.delay.return_value.id = 'task-id'
+        self.addCleanup(patcher.stop)
+
+    def entry(self, message):
+        return {'timestamp': '2025-06-01T12:00:00Z', 'severity': 'INFO', 'message': message}
+
+    async def test_json_array_and_ndjson(self):
+        entries = [self.entry('one'), {'message': 'no timestamp'}, self.entry('two')]
+        response = await self.async_client.post(
+            '/api/logs/bulk/async/', json.dumps(entries), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 207)
+        results = response.json()['results']
+        self.assertIn('timestamp', results[1]['errors'])
+        self.assertEqual((await LogEntry.objects.aget(id=results[2]['id'])).message, 'two')
+
+        body = '\n'.join(json.dumps(self.entry(f'line {n}')) for n in range(3))
+        response = await self.async_client.post('/api/logs/bulk/async/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['accepted'], 3)
+        self.assertEqual(await LogEntry.objects.filter(message__startswith='line').acount(), 3)
+        # One task for the array, one per inserted chunk of the stream
+        self.assertEqual(self.delay.call_count, 3)
+
+    async def test_stream_is_read_off_the_event_loop(self):
+        body = io.BytesIO('\n'.join(json.dumps(self.entry(f'line {n}')) for n in range(5)).encode())
+        threads = set()
+
+        class Stream:
+            def read(self, size=-1):
+                threads.add(threading.get_ident())
+                return body.read(size)
+
+        result = await aingest_stream(Stream())
+        self.assertEqual(result['accepted'], 5)
+        # This coroutine runs on the event loop's thread
+        self.assertNotIn(threading.get_ident(), threads)
+
+    async def test_array_is_parsed_off_the_event_loop(self):
+        threads = set()
+
+        def validate(items):
+            threads.add(threading.get_ident())
+            return validate_items(items)
+
+        with mock.patch('logs.ingest.validate_items', side_effect=validate):
+            result = await aingest(json.dumps([self.entry('one'), self.entry('two')]).encode())
+        self.assertEqual(result['accepted'], 2)
+        self.assertTrue(threads)
+        self.assertNotIn(threading.get_ident(), threads)
+
+    async def test_bad_signature(self):
+        body = json.dumps([self.entry('signed')])
+        response = await self.async_client.post(
+            '/api/logs/bulk/async/', body, content_type='application/json', headers={'X-HMAC-Signature': 'invalid'}
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(await LogEntry.objects.aexists())
+
+
+@override_settings(ANOMALY_INGEST_WRITE_BEHIND=True, ANOMALY_BULK_ANALYSIS_CHUNK=10)
+class WriteBehindTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.buffer = SegmentBuffer(directory.name, fsync=False)
+        for patcher in (
+            mock.patch.object(ingest_buffer, '_buffer', self.buffer),
+            mock.patch('logs.tasks.analyze_log_batch.delay'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def entry(self, message):
+        return {'timestamp': '2025-06-01T12:00:00Z', 'severity': 'INFO', 'message': message}
+
+    def test_entries_are_stored_by_the_flusher(self):
+        response = self.client.post('/api/logs/', json.dumps(self.entry('single')), content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'buffered')
+
+        entries = [self.entry('one'), {'message': 'no timestamp'}]
+        response = self.client.post('/api/logs/bulk/', json.dumps(entries), content_type='application/json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data['results'][0], {'index': 0})
+
+        body = '\n'.join(json.dumps(self.entry(f'line {n}')) for n in range(3))
+        response = self.client.post('/api/logs/bulk/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 202)
+        self.assertFalse(LogEntry.objects.exists())
+        self.assertEqual(self.buffer.stats()['sealed_segments'], 1)
+
+        self.assertEqual(IngestFlusher(self.buffer).flush_once(), 5)
+        self.assertEqual(
+            sorted(LogEntry.objects.values_list('message', flat=True)), ['line 0', 'line 1', 'line 2', 'one', 'single']
+        )
+        self.assertEqual(IngestSegment.objects.aggregate(rows=Sum('rows'))['rows'], 5)
+        self.assertEqual(self.buffer.stats()['sealed_segments'] + self.buffer.stats()['active_bytes'], 0)
+
+    def test_bad_signature_leaves_nothing_buffered(self):
+        body = json.dumps(self.entry('signed'))
+        response = self.client.post(
+            '/api/logs/bulk/', body, content_type='application/x-ndjson', headers={'X-HMAC-Signature': 'invalid'}
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.buffer.stats()['sealed_segments'], 0)
+        self.assertFalse(list(self.buffer.directory.glob('.upload-*')))
+
+    def test_replay_after_a_crash(self):
+        self.buffer.append([{'timestamp': '2025-06-01T12:00:00Z', 'severity': 'INFO', 'message': 'kept'}])
+        # A crash in the middle of an append leaves half a line behind
+        with open(self.buffer.active_path, 'ab') as segment:
+            segment.write(b'{"timestamp": "2025-06-01T12')
+        self.buffer.append([{'timestamp': '2025-06-01T12:00:00Z', 'severity': 'INFO', 'message': 'after'}])
+        committed = self.buffer.seal()
+        IngestSegment.objects.create(name=committed.name, rows=2, bytes=0, flush_seconds=0, lag_seconds=0)
+        self.buffer.append([{'timestamp': '2025-06-01T12:00:00Z', 'severity': 'INFO', 'message': 'pending'}])
+
+        flusher = IngestFlusher(self.buffer)
+        self.assertEqual(flusher.recover(), 2)
+        # The segment committed before the crash is dropped, not inserted again
+        self.assertEqual(flusher.flush_once(), 1)
+        self.assertEqual(list(LogEntry.objects.values_list('message', flat=True)), ['pending'])
+        self.assertTrue(IngestSegment.objects.get(rows=1).replayed)
+
+        self.buffer.append([{'timestamp': '2025-06-01T12:00:00Z', 'severity': 'INFO', 'message': 'kept'}])
+        with open(self.buffer.active_path, 'ab') as segment:
+            segment.write(b'{"timestamp": "2025-06-01T12')
+        self.buffer.append([{'timestamp': '2025-06-01T12:00:00Z', 'severity': 'INFO', 'message': 'after'}])
+        self.assertEqual(flusher.flush_once(), 2)
+        self.assertFalse(IngestSegment.objects.get(rows=2, bytes__gt=0).replayed)
+
+    def test_unreadable_segment_is_quarantined(self):
+        self.buffer.append([self.entry('good')])
+        good = self.buffer.seal()
+        bad = self.buffer.directory / ('0' + good.name[1:-4] + '-bad.seg')
+        bad.write_bytes(b'not a header\n' + json.dumps(self.entry('lost')).encode() + b'\n')
+
+        self.assertEqual(IngestFlusher(self.buffer).flush_once(), 1)
+        self.assertEqual(list(LogEntry.objects.values_list('message', flat=True)), ['good'])
+        self.assertTrue((self.buffer.directory / 'quarantine' / bad.name).exists())
+        self.assertEqual(self.buffer.stats()['quarantined_segments'], 1)
+
+    def test_analysis_is_queued_again_after_a_dispatch_failure(self):
+        self.buffer.append([self.entry('one'), self.entry('two')])
+        flusher = IngestFlusher(self.buffer)
+        with mock.patch('logs.ingest.dispatch_analysis', side_effect=ConnectionError('broker down')):
+            self.assertEqual(flusher.flush_once(), 2)
+        segment = IngestSegment.objects.get()
+        ids = sorted(LogEntry.objects.values_list('id', flat=True))
+        self.assertEqual(segment.pending_analysis, [[ids[0], ids[1]]])
+
+        with mock.patch('logs.ingest.dispatch_analysis') as dispatch:
+            self.assertEqual(flusher.flush_once(), 0)
+        dispatch.assert_called_once_with(ids, flusher.analysis_chunk)
+        segment.refresh_from_db()
+        self.assertIsNone(segment.pending_analysis)
+
+    def test_cleanup_keeps_segments_whose_analysis_is_pending(self):
+        from .tasks import cleanup_old_results
+
+        for name, pending in (('done', None), ('pending', [[1, 2]])):
+            IngestSegment.objects.create(
+                name=name, rows=2, bytes=0, flush_seconds=0, lag_seconds=0, pending_analysis=pending
+            )
+        IngestSegment.objects.update(flushed_at=timezone.now() - timedelta(days=31))
+        self.assertEqual(cleanup_old_results()['deleted_ingest_segments'], 1)
+        self.assertEqual(list(IngestSegment.objects.values_list('name', flat=True)), ['pending'])
+
+    def test_one_off_flush_waits_for_no_other_flusher(self):
+        self.buffer.append([self.entry('one')])
+        with IngestFlusher(self.buffer).exclusive():
+            with self.assertRaisesMessage(CommandError, 'Another flusher'):
+                call_command('run_ingest_flusher', '--once', stdout=io.StringIO())
+        self.assertFalse(LogEntry.objects.exists())
+        call_command('run_ingest_flusher', '--once', stdout=io.StringIO())
+        self.assertEqual(LogEntry.objects.get().message, 'one')
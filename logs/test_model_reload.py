@@ -0,0 +1,124 @@
+# logs/test_model_reload.py
+
+import json
+import os
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from . import model_registry
+from .model_reload import ModelReloader
+from .model_registry import build_registry, get_registry
+from .model_versions import activate, current_version, list_versions, verify_manifest, write_manifest
+
+
+class FakeRegistry:
+    def __init__(self, revision):
+        self.revision = revision
+        self.version = f'{revision}:fp32:t1.0'
+
+    def warm_up(self, messages=None, rounds=1):
+        return {'model_version': self.version, 'warmup_time': 0.1}
+
+
+class ModelReloadTests(SimpleTestCase):
+    """Tests for versioned model directories and hot reloads"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        for version in ('v1', 'v2'):
+            (self.root / version).mkdir()
+            (self.root / version / 'config.json').write_text('{}')
+        (self.root / 'v2' / 'calibration.json').write_text(json.dumps({'temperature': 1.5}))
+        (self.root / 'scratch').mkdir()
+        self.previous = model_registry.swap_registry(None)
+
+    def tearDown(self):
+        model_registry.swap_registry(self.previous)
+        self.tmp.cleanup()
+
+    def test_versions_and_pointer(self):
+        self.assertEqual(list_versions(self.root), ['v1', 'v2'])
+        self.assertIsNone(current_version(self.root))
+        activate(self.root, 'v2')
+        self.assertEqual(current_version(self.root), 'v2')
+        with self.assertRaises(ValueError):
+            activate(self.root, 'scratch')
+
+    def test_registry_loads_the_current_version(self):
+        activate(self.root, 'v2')
+        with override_settings(ANOMALY_MODEL_ROOT=str(self.root)):
+            registry = build_registry()
+            self.assertEqual(registry.model_name, str(self.root / 'v2'))
+            self.assertEqual(registry.version, 'v2:fp32:t1.5')
+            self.assertEqual(build_registry('v1').version, 'v1:fp32:t1.0')
+
+    def test_reload_swaps_the_registry(self):
+        model_registry.swap_registry(FakeRegistry('v1'))
+        swapped = []
+        reloader = ModelReloader(on_swap=swapped.append)
+        with mock.patch('logs.model_reload.build_registry', FakeRegistry):
+            self.assertFalse(reloader.request('v1'))
+            self.assertTrue(reloader.request('v2'))
+            reloader.join(5)
+
+        self.assertEqual(get_registry().version, 'v2:fp32:t1.0')
+        self.assertEqual(reloader.last_reload['previous'], 'v1:fp32:t1.0')
+        self.assertEqual(swapped, [{'model_version': 'v2:fp32:t1.0', 'warmup_time': 0.1}])
+
+    def test_failed_reload_keeps_the_current_model(self):
+        model_registry.swap_registry(FakeRegistry('v1'))
+        reloader = ModelReloader()
+        with mock.patch('logs.model_reload.build_registry', side_effect=OSError('missing weights')):
+            reloader.request('v2')
+            reloader.join(5)
+        self.assertEqual(get_registry().revision, 'v1')
+        self.assertEqual(reloader.last_reload['error'], 'missing weights')
+
+    def test_manifest_detects_altered_files(self):
+        version = self.root / 'v1'
+        (version / 'vocab.txt').write_text('[PAD]\n[UNK]\n')
+        manifest = write_manifest(version, {'source': 'bert-base-uncased'})
+        self.assertEqual(sorted(manifest['files']), ['config.json', 'vocab.txt'])
+        self.assertEqual(verify_manifest(version), [])
+
+        (version / 'vocab.txt').write_text('[PAD]\n[UNK]\n[CLS]\n')
+        (version / 'config.json').unlink()
+        self.assertEqual(
+            verify_manifest(version), ['config.json: missing', 'vocab.txt: 18 bytes, expected 12']
+        )
+
+    def test_intact_files_are_not_hashed_again(self):
+        version = self.root / 'v1'
+        write_manifest(version, {'source': 'bert-base-uncased'})
+        with mock.patch('logs.model_versions.sha256_file') as sha256_file:
+            self.assertEqual(verify_manifest(version), [])
+        sha256_file.assert_not_called()
+
+        # Same size, different content and mtime
+        config = version / 'config.json'
+        mtime = config.stat().st_mtime_ns
+        config.write_text(' ' * config.stat().st_size)
+        os.utime(config, ns=(mtime + 10**9, mtime + 10**9))
+        self.assertEqual(verify_manifest(version), ['config.json: checksum mismatch'])
+
+    def test_versioned_models_load_offline(self):
+        activate(self.root, 'v1')
+        with override_settings(ANOMALY_MODEL_ROOT=str(self.root), ANOMALY_MODEL_OFFLINE=False):
+            self.assertTrue(build_registry().local_files_only)
+        with override_settings(ANOMALY_MODEL_ROOT=None, ANOMALY_MODEL_OFFLINE=False):
+            self.assertFalse(build_registry().local_files_only)
+
+    def test_reload_rejects_revisions_longer_than_the_shared_buffer(self):
+        import multiprocessing
+        from . import worker
+
+        request = multiprocessing.Array('c', worker.RELOAD_REQUEST_BYTES)
+        with mock.patch.object(worker, 'RELOAD_REQUEST', request), \
+                override_settings(ANOMALY_MODEL_ROOT=self.root):
+            self.assertIn('error', worker.reload_model(None, 'v' * worker.RELOAD_REQUEST_BYTES))
+            self.assertEqual(worker.reload_model(None, 'v2'), {'ok': "reloading model version 'v2'"})
+        self.assertEqual(request.value, b'v2')
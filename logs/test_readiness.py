@@ -0,0 +1,83 @@
+# logs/test_readiness.py
+
+import tempfile
+import time
+
+from django.core.cache import cache, caches
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from . import readiness
+
+
+@override_settings(
+    ANOMALY_INFERENCE_QUEUES=['analysis', 'real_time'], ANOMALY_READINESS_MAX_AGE=60,
+    ANOMALY_READINESS_CACHE_ALIAS='default'
+)
+class ReadinessTests(TestCase):
+    """Tests for worker readiness entries and the health endpoint"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def tearDown(self):
+        cache.clear()
+
+    def publish(self, hostname, queues, warmed_up=True):
+        readiness.publish_ready(hostname, {'queues': queues, 'warmed_up': warmed_up, 'model_version': 'm:fp32:t1.0'})
+
+    def test_ready_when_every_queue_has_a_warm_worker(self):
+        self.publish('celery@a', ['analysis'])
+        self.assertFalse(readiness.readiness_report()['ready'])
+
+        self.publish('celery@b', ['real_time'])
+        report = readiness.readiness_report()
+        self.assertTrue(report['ready'])
+        self.assertEqual(report['queues'], {'analysis': ['celery@a'], 'real_time': ['celery@b']})
+
+    def test_workers_still_warming_up_do_not_count(self):
+        self.publish('celery@a', ['analysis', 'real_time'], warmed_up=False)
+        report = readiness.readiness_report()
+        self.assertFalse(report['ready'])
+        self.assertEqual(len(report['workers']), 1)
+
+    def test_stale_and_withdrawn_entries_are_ignored(self):
+        self.publish('celery@a', ['analysis', 'real_time'])
+        self.assertEqual(len(readiness.live_workers(now=time.time() + 61)), 0)
+
+        readiness.withdraw('celery@a')
+        self.assertEqual(readiness.live_workers(), [])
+
+    def test_collect_warmups(self):
+        readiness.record_warmup('celery@a', 101, {'warmup_time': 1.5})
+        self.assertEqual(readiness.collect_warmups('celery@a', [101, 102]), {101: {'warmup_time': 1.5}})
+
+    def test_health_endpoint(self):
+        response = self.client.get('/api/health/')
+        self.assertEqual(response.status_code, 503)
+
+        self.publish('celery@a', ['analysis', 'real_time'])
+        response = self.client.get('/api/health/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['workers'][0]['model_version'], 'm:fp32:t1.0')
+
+    def test_processes_sharing_a_cache_see_each_others_entries(self):
+        # Two cache instances on one file store stand in for a worker and a
+        # web process sharing Redis
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        backend = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory.name}
+        with self.settings(CACHES={'default': backend, 'worker': backend, 'web': backend}):
+            with self.settings(ANOMALY_READINESS_CACHE_ALIAS='worker'):
+                self.publish('celery@a', ['analysis'])
+                self.publish('celery@b', ['real_time'])
+                readiness.publish_ready('celery@a', {'queues': ['analysis'], 'warmed_up': True, 'model_version': 'v2'})
+            self.assertIsNot(caches['worker'], caches['web'])
+            with self.settings(ANOMALY_READINESS_CACHE_ALIAS='web'):
+                report = readiness.readiness_report()
+                self.assertTrue(report['ready'])
+                self.assertEqual([worker['model_version'] for worker in report['workers']], ['v2', 'm:fp32:t1.0'])
+
+                readiness.withdraw('celery@b')
+                self.assertFalse(readiness.readiness_report()['ready'])
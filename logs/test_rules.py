@@ -0,0 +1,137 @@
+"""
+Tests for the operator rule prefilter.
+"""
+from unittest import mock
+
+import regex
+from django.core.exceptions import ValidationError
+from django.test import TestCase, override_settings
+
+from .models import LogRule
+from .rules import RuleMatcher, RuleSet
+from .utils import analyze_logs_tagged
+from .verdict_cache import VerdictCache
+
+
+class RuleMatcherTests(TestCase):
+    def test_matches_the_rule_of_the_alternative(self):
+        rules = [
+            LogRule(id=1, name='heartbeat', pattern=r'heartbeat (ok|received)', verdict=LogRule.NORMAL),
+            LogRule(id=2, name='disk-full', pattern=r'(?i)no space left on (\w+)', verdict=LogRule.ANOMALOUS),
+            LogRule(id=3, name='oom', pattern=r'OutOfMemoryError', verdict=LogRule.ANOMALOUS),
+        ]
+        matcher = RuleMatcher(rules)
+        self.assertEqual(matcher.match('write failed: No Space Left On device').name, 'disk-full')
+        self.assertEqual(matcher.match('java.lang.OutOfMemoryError: heap').name, 'oom')
+        self.assertEqual(matcher.match('heartbeat received from node-3').name, 'heartbeat')
+        # Inline flags stay scoped to their own rule
+        self.assertIsNone(matcher.match('outofmemoryerror'))
+        self.assertIsNone(matcher.match('user logged in'))
+
+    def test_anomalous_rules_win_over_normal_ones(self):
+        matcher = RuleMatcher([
+            LogRule(id=1, name='any-disk', pattern='disk', verdict=LogRule.NORMAL),
+            LogRule(id=2, name='disk-failure', pattern='disk failure', verdict=LogRule.ANOMALOUS),
+        ])
+        self.assertEqual(matcher.match('disk failure on sda').name, 'disk-failure')
+        self.assertEqual(matcher.match('disk usage 40%').name, 'any-disk')
+
+    def test_invalid_patterns_are_rejected_and_skipped(self):
+        broken = LogRule(id=1, name='broken', pattern='(unclosed', verdict=LogRule.ANOMALOUS)
+        with self.assertRaises(ValidationError):
+            broken.clean()
+        self.assertFalse(RuleMatcher([broken]))
+
+    def test_numbered_backreferences_are_rejected(self):
+        repeated = LogRule(id=1, name='repeated-word', pattern=r'(\w+) \1', verdict=LogRule.ANOMALOUS)
+        with self.assertRaises(ValidationError):
+            repeated.clean()
+        named = LogRule(id=2, name='named-repeat', pattern=r'(?P<word>\w+) (?P=word)', verdict=LogRule.ANOMALOUS)
+        named.clean()
+        oom = LogRule(id=3, name='oom', pattern='OutOfMemoryError', verdict=LogRule.ANOMALOUS)
+
+        matcher = RuleMatcher([repeated, named, oom])
+        self.assertEqual(matcher.match('retry retry later').name, 'named-repeat')
+        self.assertEqual(matcher.match('OutOfMemoryError').name, 'oom')
+
+    def test_rules_that_do_not_combine_are_matched_one_by_one(self):
+        compile_pattern = regex.compile
+
+        def compile_alone(pattern, *args, **kwargs):
+            if pattern.startswith('(') and ')|(' in pattern:
+                raise regex.error('cannot combine')
+            return compile_pattern(pattern, *args, **kwargs)
+
+        rules = [
+            LogRule(id=1, name='disk-full', pattern='no space left', verdict=LogRule.ANOMALOUS),
+            LogRule(id=2, name='oom', pattern='OutOfMemoryError', verdict=LogRule.ANOMALOUS),
+        ]
+        with mock.patch('logs.rules.regex.compile', side_effect=compile_alone):
+            matcher = RuleMatcher(rules)
+        self.assertEqual(len(matcher.patterns), 2)
+        self.assertEqual(matcher.match('java.lang.OutOfMemoryError').name, 'oom')
+        self.assertEqual(matcher.match('no space left on /var').name, 'disk-full')
+
+
+class RuleSetTests(TestCase):
+    def setUp(self):
+        self.rule = LogRule.objects.create(name='disk-full', pattern='no space left', verdict=LogRule.ANOMALOUS)
+        self.rules = RuleSet(refresh_seconds=0)
+
+    def test_recompiles_only_when_rules_change(self):
+        self.rules.refresh()
+        matcher = self.rules.matcher
+        self.rules.refresh()
+        self.assertIs(self.rules.matcher, matcher)
+
+        LogRule.objects.create(name='noise', pattern='heartbeat', verdict=LogRule.NORMAL)
+        self.rules.refresh()
+        self.assertIsNot(self.rules.matcher, matcher)
+        self.assertEqual(self.rules.apply(['heartbeat ok']), {0: (0.0, 'rule:noise')})
+
+        self.rule.enabled = False
+        self.rule.save()
+        self.assertEqual(self.rules.apply(['no space left on device']), {})
+
+    def test_hit_counts_are_saved_on_refresh(self):
+        decided = self.rules.apply(['no space left on /var', 'all good', 'no space left on /tmp'])
+        self.assertEqual(decided, {0: (1.0, 'rule:disk-full'), 2: (1.0, 'rule:disk-full')})
+        matcher = self.rules.matcher
+        self.rules.refresh()
+        self.rule.refresh_from_db()
+        self.assertEqual(self.rule.hit_count, 2)
+        self.assertIsNotNone(self.rule.last_hit)
+        # Counting hits does not look like a rule change
+        self.assertIs(self.rules.matcher, matcher)
+
+    @override_settings(ANOMALY_VERDICT_CACHE_ENABLED=False)
+    def test_matched_messages_skip_the_classifier(self):
+        with mock.patch('logs.rules.get_rule_set', return_value=self.rules), \
+                mock.patch('logs.utils.run_tier0', side_effect=lambda messages, severities: ({}, list(range(len(messages))))), \
+                mock.patch('logs.utils.predict_tier1', return_value=[(0.2, 'bert:fp32:t1.0')]) as predict:
+            verdicts = analyze_logs_tagged(['no space left on device', 'user logged in'])
+        self.assertEqual(verdicts, [(1.0, 'rule:disk-full'), (0.2, 'bert:fp32:t1.0')])
+        predict.assert_called_once_with(['user logged in'], [None])
+
+    def test_repeats_in_a_batch_are_scored_once(self):
+        messages = ['user 7 logged in', 'user 7 logged in', 'user 9 logged in', 'user 7 logged in']
+        severities = ['INFO', 'INFO', 'INFO', 'ERROR']
+        with mock.patch('logs.rules.get_rule_set', return_value=self.rules), \
+                mock.patch('logs.utils.serving_version', return_value='bert:fp32:t1.0'), \
+                mock.patch('logs.utils.get_verdict_cache', return_value=VerdictCache()), \
+                mock.patch('logs.utils.run_tier0', side_effect=lambda messages, severities: ({}, list(range(len(messages))))), \
+                mock.patch('logs.utils.predict_tier1', side_effect=lambda messages, severities: [
+                    (0.1 * (position + 1), 'bert:fp32:t1.0') for position in range(len(messages))
+                ]) as predict:
+            verdicts = analyze_logs_tagged(messages, severities)
+            # Same template, same severity: one forward pass
+            predict.assert_called_once_with(['user 7 logged in', 'user 7 logged in'], ['INFO', 'ERROR'])
+            self.assertEqual([probability for probability, _ in verdicts], [0.1, 0.1, 0.1, 0.2])
+
+            with override_settings(ANOMALY_VERDICT_CACHE_ENABLED=False):
+                predict.reset_mock()
+                analyze_logs_tagged(messages, severities)
+            # Without the cache only identical messages are merged
+            predict.assert_called_once_with(
+                ['user 7 logged in', 'user 9 logged in', 'user 7 logged in'], ['INFO', 'INFO', 'ERROR']
+            )
@@ -0,0 +1,121 @@
+# logs/test_template_miner.py
+
+from datetime import timedelta
+
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from . import template_miner
+from .models import LogEntry, LogTemplate
+from .template_miner import TemplateMiner, assign_templates
+
+
+class TemplateMinerTests(SimpleTestCase):
+    """Tests for the Drain prefix-tree miner"""
+
+    def test_variable_tokens_become_wildcards(self):
+        miner = TemplateMiner()
+        first, created = miner.add('Connection from alice closed')
+        second, changed = miner.add('Connection from bob closed')
+        self.assertTrue(created)
+        self.assertTrue(changed)
+        self.assertIs(first, second)
+        self.assertEqual(second.template, 'Connection from <*> closed')
+
+    def test_numbers_are_masked_before_mining(self):
+        miner = TemplateMiner()
+        first, _ = miner.add('Request 17 took 250 ms')
+        second, changed = miner.add('Request 18 took 31 ms')
+        self.assertIs(first, second)
+        self.assertFalse(changed)
+        self.assertEqual(first.template, 'Request <NUM> took <NUM> ms')
+
+    def test_dissimilar_messages_get_separate_clusters(self):
+        miner = TemplateMiner()
+        first, _ = miner.add('Disk quota exceeded for volume data')
+        second, _ = miner.add('User session expired after logout request')
+        self.assertIsNot(first, second)
+        self.assertEqual(len(miner.clusters), 2)
+
+    def test_match_does_not_learn(self):
+        miner = TemplateMiner()
+        miner.add('Worker started on alpha')
+        self.assertIsNotNone(miner.match('Worker started on beta'))
+        self.assertEqual(miner.clusters[0].template, 'Worker started on alpha')
+        self.assertIsNone(miner.match('Something completely different here'))
+
+    def test_load_restores_template(self):
+        miner = TemplateMiner()
+        miner.load('Connection from <*> closed', 7)
+        cluster, changed = miner.add('Connection from carol closed')
+        self.assertEqual(cluster.template_id, 7)
+        self.assertFalse(changed)
+
+
+class AssignTemplatesTests(TestCase):
+    """Tests for storing mined templates on log entries"""
+
+    def setUp(self):
+        template_miner._miner = None
+
+    def tearDown(self):
+        template_miner._miner = None
+
+    def test_entries_get_template_ids_and_counts(self):
+        now = timezone.now()
+        entries = [
+            LogEntry.objects.create(timestamp=now - timedelta(minutes=5), severity='INFO', message='Job 1 done'),
+            LogEntry.objects.create(timestamp=now, severity='INFO', message='Job 2 done'),
+            LogEntry.objects.create(timestamp=now, severity='ERROR', message='Disk full on volume data'),
+        ]
+
+        assigned = assign_templates(entries)
+
+        self.assertEqual(LogTemplate.objects.count(), 2)
+        self.assertEqual(assigned[entries[0].id], assigned[entries[1].id])
+        template = LogTemplate.objects.get(id=assigned[entries[0].id])
+        self.assertEqual(template.template, 'Job <NUM> done')
+        self.assertEqual(template.count, 2)
+        self.assertEqual(template.first_seen, now - timedelta(minutes=5))
+        self.assertEqual(template.last_seen, now)
+        self.assertEqual(LogEntry.objects.get(id=entries[1].id).template_id, template.id)
+
+    def test_generalized_template_is_updated(self):
+        now = timezone.now()
+        first = LogEntry.objects.create(timestamp=now, severity='INFO', message='Login by alice ok')
+        second = LogEntry.objects.create(timestamp=now, severity='INFO', message='Login by bob ok')
+
+        assign_templates([first])
+        assign_templates([second])
+
+        template = LogTemplate.objects.get()
+        self.assertEqual(template.template, 'Login by <*> ok')
+        self.assertEqual(template.count, 2)
+
+    def test_generalized_template_absorbs_a_stored_duplicate(self):
+        now = timezone.now()
+        old = LogTemplate.objects.create(
+            template='Job done for alpha', signature=template_miner.template_signature('Job done for alpha'),
+            token_count=4, count=4, first_seen=now - timedelta(hours=1), last_seen=now - timedelta(hours=1),
+        )
+        # Stored by another process under the template this cluster is about to reach
+        duplicate = LogTemplate.objects.create(
+            template='Job done for <*>', signature=template_miner.template_signature('Job done for <*>'),
+            token_count=4, count=2, first_seen=now - timedelta(hours=2), last_seen=now - timedelta(hours=2),
+        )
+        earlier = LogEntry.objects.create(timestamp=now, severity='INFO', message='Job done for gamma', template=duplicate)
+        # This process only knows the old template
+        template_miner._miner = TemplateMiner()
+        template_miner._miner.load(old.template, old.id)
+
+        entry = LogEntry.objects.create(timestamp=now, severity='INFO', message='Job done for beta')
+        self.assertEqual(assign_templates([entry]), {entry.id: old.id})
+
+        self.assertFalse(LogTemplate.objects.filter(id=duplicate.id).exists())
+        old.refresh_from_db()
+        self.assertEqual(old.template, 'Job done for <*>')
+        self.assertEqual(old.count, 7)
+        self.assertEqual(old.first_seen, now - timedelta(hours=2))
+        self.assertEqual(old.last_seen, now)
+        earlier.refresh_from_db()
+        self.assertEqual(earlier.template_id, old.id)
@@ -0,0 +1,89 @@
+"""
+Tests for the fast-path log entry validator.
+"""
+import json
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from .models import LogEntry
+from .serializers import LogEntrySerializer
+from .validation import represent_log_entry, validate_log_entry
+
+CASES = [
+    {'timestamp': '2025-06-01T12:00:00Z', 'severity': 'INFO', 'message': 'user logged in'},
+    {'timestamp': '2025-06-01T14:00:00.123+02:00', 'severity': ' ERROR ', 'message': '  disk full\n'},
+    {'timestamp': '2025-06-01 12:00', 'severity': 3, 'message': 4.5, 'id': 7, 'anomaly_probability': 1.0},
+    {'timestamp': '2025-06-01', 'severity': 'WARNING', 'message': 'date only'},
+    {},
+    {'timestamp': None, 'severity': None, 'message': None},
+    {'timestamp': 'yesterday', 'severity': '   ', 'message': ''},
+    {'timestamp': 1717243200, 'severity': True, 'message': ['a list']},
+    {'timestamp': '2025-13-01T00:00:00Z', 'severity': 'x' * 11 + '\x00', 'message': 'bad \ud800 \x00'},
+    None,
+    [],
+    'a string',
+]
+
+
+class ValidateLogEntryTests(SimpleTestCase):
+    def outcome(self, validate, data):
+        try:
+            return 'valid', validate(data)
+        except ValidationError as exc:
+            return 'invalid', exc.detail
+
+    def test_matches_the_serializer(self):
+        for data in CASES:
+            with self.subTest(data=data):
+                self.assertEqual(
+                    self.outcome(validate_log_entry, data),
+                    self.outcome(LogEntrySerializer().run_validation, data),
+                )
+
+    @override_settings(TIME_ZONE='Europe/Paris')
+    def test_naive_timestamps_use_the_current_timezone(self):
+        data = {'timestamp': '2025-03-30T02:30:00', 'severity': 'INFO', 'message': 'skipped hour'}
+        self.assertEqual(
+            self.outcome(validate_log_entry, data), self.outcome(LogEntrySerializer().run_validation, data)
+        )
+        data['timestamp'] = '2025-06-01T12:00:00'
+        self.assertEqual(validate_log_entry(data)['timestamp'].isoformat(), '2025-06-01T12:00:00+02:00')
+
+    def test_representation_matches_the_serializer(self):
+        log_entry = LogEntry(id=3, anomaly_probability=0.25, **validate_log_entry(CASES[1]))
+        self.assertEqual(represent_log_entry(log_entry), LogEntrySerializer(log_entry).data)
+
+
+class CreateLogEntryTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        patcher = mock.patch('logs.tasks.analyze_log_async.delay')
+        self.delay = patcher.start()
+        self.delay.return_value.id = 'task-id'
+        self.addCleanup(patcher.stop)
+
+    def post(self, data):
+        return self.client.post('/api/logs/', json.dumps(data), content_type='application/json')
+
+    def test_created_entry_is_rendered_like_the_serializer(self):
+        response = self.post(CASES[1])
+        self.assertEqual(response.status_code, 201)
+        log_entry = LogEntry.objects.get()
+        self.assertEqual(
+            response.json(),
+            {**LogEntrySerializer(log_entry).data, 'analysis_task_id': 'task-id', 'status': 'processing'}
+        )
+        self.delay.assert_called_once_with('disk full', log_entry.id)
+
+    def test_errors_keep_their_shape(self):
+        response = self.post({'severity': 'INFO', 'message': ''})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json(), {'timestamp': ['This field is required.'], 'message': ['This field may not be blank.']}
+        )
+        self.assertEqual(self.post(None).json(), {'non_field_errors': ['No data provided']})
+        self.assertFalse(LogEntry.objects.exists())
+        self.delay.assert_not_called()
@@ -1,8 +1,15 @@
 # logs/tests.py
 
+import json
+import struct
+import tempfile
+from pathlib import Path
+
 from django.test import TestCase
 from rest_framework.test import APIClient
 from .models import LogEntry
+from .model_registry import ModelRegistry, get_registry, process_memory
+from .shared_weights import read_header
 
 class LogEntryTests(TestCase):
     def setUp(self):
@@ -25,4 +32,41 @@ class LogEntryTests(TestCase):
 
     def test_invalid_hmac(self):
         response = self.client.post('/api/logs/', self.log_data, headers={'X-HMAC-Signature': 'invalid_signature'})
-        self.assertEqual(response.status_code, 403)  # Forbidden
\ No newline at end of file
+        self.assertEqual(response.status_code, 403)  # Forbidden
+
+
+class ModelRegistryTests(TestCase):
+    def test_importing_views_does_not_load_model(self):
+        from . import views  # noqa: F401
+        self.assertFalse(get_registry().is_loaded)
+
+    def test_stats_before_load(self):
+        registry = ModelRegistry('bert-base-uncased')
+        stats = registry.stats()
+        self.assertFalse(stats['loaded'])
+        self.assertIsNone(stats['load_time'])
+        self.assertGreater(stats['rss_bytes'], 0)
+        self.assertFalse(stats['inherited'])
+        self.assertFalse(stats['weights_mapped'])
+
+    def test_process_memory_splits_private_and_shared(self):
+        memory = process_memory()
+        self.assertGreater(memory['rss'], 0)
+        if memory['uss'] is not None:
+            self.assertLessEqual(memory['uss'], memory['pss'])
+            self.assertLessEqual(memory['pss'], memory['rss'])
+
+    def test_safetensors_header(self):
+        header = {'__metadata__': {'format': 'pt'}, 'w': {'dtype': 'F32', 'shape': [2], 'data_offsets': [0, 8]}}
+        encoded = json.dumps(header).encode()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'model.safetensors'
+            path.write_bytes(struct.pack('<Q', len(encoded)) + encoded + bytes(8))
+            parsed, data_start = read_header(path)
+        self.assertEqual(parsed, {'w': header['w']})
+        self.assertEqual(data_start, 8 + len(encoded))
+
+    def test_unload_without_load_is_noop(self):
+        registry = ModelRegistry('bert-base-uncased')
+        registry.unload()
+        self.assertFalse(registry.is_loaded)
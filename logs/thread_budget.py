@@ -0,0 +1,156 @@
+"""
+CPU thread budgets for torch in Celery worker processes.
+
+By default every prefork child runs torch with one intra-op thread per core,
+so a 4-process worker on an 8-core box runs 32 compute threads and the
+processes slow each other down. The worker's cores are split between pool
+processes and torch threads following ``ANOMALY_THREAD_POLICY``:
+
+- ``split``: each process gets an equal share of the cores
+- ``per_process``: one intra-op thread per process, for high concurrency
+- ``fixed``: ``ANOMALY_TORCH_INTRA_OP_THREADS`` threads per process
+
+``ANOMALY_CPU_RESERVE`` cores are left to the worker parent, the broker
+client and the OS.
+"""
+import logging
+import os
+import sys
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ('split', 'per_process', 'fixed')
+
+# Thread pools read these when the library initializes, which happens after
+# the fork in pool children
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+
+
+def available_cpus() -> int:
+    """
+    Return the cores this process may use: its CPU affinity, capped by a
+    cgroup v2 CPU quota when running in a container.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    try:
+        quota, period = Path('/sys/fs/cgroup/cpu.max').read_text().split()
+        if quota != 'max':
+            cpus = min(cpus, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+class ThreadBudget:
+    """
+    Planned split of the worker's cores.
+
+    Args:
+        cpus (int): Cores available to the whole worker
+        processes (int): Pool processes running inference
+        intra_op (int): torch intra-op threads per process
+        inter_op (int): torch inter-op threads per process
+        policy (str): Policy the split came from
+    """
+
+    def __init__(self, cpus: int, processes: int, intra_op: int, inter_op: int, policy: str):
+        self.cpus = cpus
+        self.processes = processes
+        self.intra_op = intra_op
+        self.inter_op = inter_op
+        self.policy = policy
+
+    @property
+    def oversubscribed(self) -> bool:
+        return self.processes * self.intra_op > self.cpus
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'policy': self.policy,
+            'cpus': self.cpus,
+            'processes': self.processes,
+            'intra_op_threads': self.intra_op,
+            'inter_op_threads': self.inter_op,
+            'oversubscribed': self.oversubscribed,
+        }
+
+    def __str__(self):
+        return (
+            f"{self.cpus} cpus, {self.processes} processes x {self.intra_op} intra-op "
+            f"+ {self.inter_op} inter-op torch threads (policy '{self.policy}')"
+        )
+
+
+def plan_threads(processes: int, cpus: Optional[int] = None, policy: Optional[str] = None,
+                 reserve: Optional[int] = None, intra_op: Optional[int] = None,
+                 inter_op: Optional[int] = None) -> ThreadBudget:
+    """
+    Split the available cores between pool processes and torch threads.
+
+    Arguments left as None are read from settings.
+
+    Returns:
+        ThreadBudget: The planned split
+    """
+    policy = policy or getattr(settings, 'ANOMALY_THREAD_POLICY', 'split')
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown thread policy '{policy}', expected one of {', '.join(POLICIES)}")
+    reserve = getattr(settings, 'ANOMALY_CPU_RESERVE', 0) if reserve is None else reserve
+    cpus = max(1, (cpus or available_cpus()) - reserve)
+    processes = max(1, processes)
+    inter_op = inter_op or getattr(settings, 'ANOMALY_TORCH_INTEROP_THREADS', 1)
+
+    if policy == 'split':
+        intra_op = max(1, cpus // processes)
+    elif policy == 'per_process':
+        intra_op = 1
+    else:
+        intra_op = intra_op or getattr(settings, 'ANOMALY_TORCH_INTRA_OP_THREADS', 1)
+
+    return ThreadBudget(cpus, processes, intra_op, inter_op, policy)
+
+
+def export_thread_env(budget: ThreadBudget):
+    """Set the OpenMP/MKL thread variables so processes forked later inherit the budget."""
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(budget.intra_op)
+
+
+def apply_thread_budget(budget: ThreadBudget) -> Dict[str, Any]:
+    """
+    Configure torch in the current process.
+
+    Returns:
+        dict: The thread counts torch reports afterwards
+    """
+    export_thread_env(budget)
+
+    import torch
+
+    torch.set_num_threads(budget.intra_op)
+    try:
+        torch.set_num_interop_threads(budget.inter_op)
+    except RuntimeError:
+        # Only allowed before the inter-op pool starts, e.g. not after a
+        # model already ran in this process
+        logger.warning(f"torch inter-op threads already fixed at {torch.get_num_interop_threads()}")
+    return current_threads()
+
+
+def current_threads() -> Dict[str, Any]:
+    """Return torch's thread counts in this process, if torch is loaded."""
+    torch = sys.modules.get('torch')
+    if torch is None:
+        return {}
+    return {
+        'intra_op_threads': torch.get_num_threads(),
+        'inter_op_threads': torch.get_num_interop_threads(),
+    }
@@ -0,0 +1,169 @@
+"""
+Sequence-length budgets for long log messages.
+
+Stack traces and JSON dumps can run far past what the classifier needs, and
+attention cost grows quadratically with the token count. Each message is
+fitted into a token budget chosen by its severity
+(``ANOMALY_TOKEN_BUDGETS``, falling back to ``ANOMALY_TOKEN_BUDGET``) with
+one of these policies (``ANOMALY_TRUNCATION_POLICY``):
+
+- ``head``: keep the first tokens (the historical behaviour)
+- ``head_tail``: keep the first and last tokens, so the exception at the
+  bottom of a trace survives
+- ``template``: collapse repeated lines and long runs of indented frames,
+  then keep head and tail
+"""
+import logging
+from typing import Dict, List, Optional
+
+from django.conf import settings
+
+from . import metrics
+from .verdict_cache import normalize_message
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ('head', 'head_tail', 'template')
+
+# Messages are cut to this many characters per budgeted token before
+# tokenizing, so a megabyte JSON dump is never tokenized in full
+CHARS_PER_TOKEN = 8
+
+
+def _is_frame(line: str) -> bool:
+    """Indented lines: Java ``at ...`` frames, Python ``File ...`` frames and their source lines."""
+    return line[:1].isspace() and bool(line.strip())
+
+
+def collapse_repeats(message: str, keep: int = 2) -> str:
+    """
+    Compress a multi-line message without losing its shape.
+
+    Consecutive lines that only differ in numbers, IDs or addresses become
+    one line with a repeat count, and runs of more than ``2 * keep + 1``
+    indented frames keep their first and last ``keep`` lines.
+    """
+    lines = message.splitlines()
+    if len(lines) < 2:
+        return message
+
+    deduplicated = []
+    for line in lines:
+        key = normalize_message(line)
+        if deduplicated and deduplicated[-1][0] == key:
+            deduplicated[-1][2] += 1
+        else:
+            deduplicated.append([key, line, 1])
+    lines = [line if count == 1 else f'{line} [repeated {count} times]' for _, line, count in deduplicated]
+
+    compressed = []
+    start = 0
+    while start < len(lines):
+        end = start + 1
+        if _is_frame(lines[start]):
+            while end < len(lines) and _is_frame(lines[end]):
+                end += 1
+        run = lines[start:end]
+        if len(run) > 2 * keep + 1:
+            compressed.extend(run[:keep])
+            compressed.append(f'    ... {len(run) - 2 * keep} similar frames ...')
+            compressed.extend(run[-keep:])
+        else:
+            compressed.extend(run)
+        start = end
+    return '\n'.join(compressed)
+
+
+class TruncationPolicy:
+    """
+    Fits tokenized messages into per-severity token budgets.
+
+    Args:
+        policy (str): One of ``POLICIES``
+        budgets (dict): Token budget per severity, special tokens included
+        default_budget (int): Budget for severities not in ``budgets``
+        head_fraction (float): Share of the budget kept from the start of the
+            message by the ``head_tail`` and ``template`` policies
+    """
+
+    def __init__(self, policy: str = 'head', budgets: Optional[Dict[str, int]] = None,
+                 default_budget: int = 512, head_fraction: float = 0.5):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown truncation policy '{policy}', expected one of {', '.join(POLICIES)}")
+        budgets = {severity.upper(): budget for severity, budget in (budgets or {}).items()}
+        if min([default_budget, *budgets.values()]) < 1:
+            raise ValueError('Token budgets must be positive')
+        self.policy = policy
+        self.budgets = budgets
+        self.default_budget = default_budget
+        self.head_fraction = head_fraction
+
+    @property
+    def signature(self) -> str:
+        """Short description of the policy, part of the verdict cache key."""
+        budgets = ','.join(f'{severity}={budget}' for severity, budget in sorted(self.budgets.items()))
+        return f'{self.policy}:{self.default_budget}:{budgets}:{self.head_fraction}'
+
+    def budget(self, severity: Optional[str]) -> int:
+        return self.budgets.get((severity or '').upper(), self.default_budget)
+
+    def fit(self, ids: List[int], budget: int) -> List[int]:
+        """Cut a token ID list down to ``budget`` tokens."""
+        if len(ids) <= budget:
+            return ids
+        if self.policy == 'head':
+            return ids[:budget]
+        head = int(budget * self.head_fraction)
+        tail = budget - head
+        return ids[:head] + (ids[-tail:] if tail else [])
+
+    def prepare(self, message: str, budget: int) -> str:
+        """Compress and pre-cut the text of a message before tokenizing it."""
+        if self.policy == 'template':
+            message = collapse_repeats(message)
+        limit = budget * CHARS_PER_TOKEN
+        if len(message) > limit:
+            if self.policy == 'head':
+                message = message[:limit]
+            else:
+                head = int(limit * self.head_fraction)
+                tail = limit - head
+                message = message[:head] + '\n' + (message[-tail:] if tail else '')
+        return message
+
+    def encode(self, tokenizer, messages: List[str], severities: Optional[List[str]] = None) -> Dict[str, list]:
+        """
+        Tokenize messages within their budgets, without padding.
+
+        Returns:
+            dict: Unpadded encodings (``input_ids``, ``attention_mask``...)
+            ready for ``tokenizer.pad``
+        """
+        severities = severities or [None] * len(messages)
+        special = tokenizer.num_special_tokens_to_add()
+        max_length = getattr(tokenizer, 'model_max_length', 512)
+        # A budget that the special tokens alone fill leaves no room for the message
+        rooms = [max(min(self.budget(severity), max_length) - special, 0) for severity in severities]
+
+        texts = [self.prepare(message, room) for message, room in zip(messages, rooms)]
+        token_ids = tokenizer(texts, add_special_tokens=False)['input_ids']
+
+        encodings = {}
+        truncated = 0
+        for ids, room in zip(token_ids, rooms):
+            truncated += len(ids) > room
+            encoded = tokenizer.prepare_for_model(self.fit(ids, room), add_special_tokens=True)
+            for key, values in encoded.items():
+                encodings.setdefault(key, []).append(values)
+        metrics.counter('inference.truncated_messages').inc(truncated)
+        return encodings
+
+
+def get_truncation_policy() -> TruncationPolicy:
+    """Build the truncation policy from settings."""
+    return TruncationPolicy(
+        policy=getattr(settings, 'ANOMALY_TRUNCATION_POLICY', 'head'),
+        budgets=getattr(settings, 'ANOMALY_TOKEN_BUDGETS', {}),
+        default_budget=getattr(settings, 'ANOMALY_TOKEN_BUDGET', 512),
+        head_fraction=getattr(settings, 'ANOMALY_TRUNCATION_HEAD_FRACTION', 0.5),
+    )
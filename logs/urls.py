@@ -1,8 +1,9 @@
 from django.urls import path
 from django.http import JsonResponse
 from .views import (
-    LogEntryListCreate, task_status, trigger_batch_analysis,
-    trigger_pattern_analysis, real_time_stream_analysis, anomaly_dashboard
+    LogEntryListCreate, bulk_ingest, bulk_ingest_async, task_status, trigger_batch_analysis,
+    trigger_pattern_analysis, real_time_stream_analysis, anomaly_dashboard,
+    inference_stats, ingest_buffer_stats, health, similar_logs
 )
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
@@ -17,6 +18,21 @@ def api_index(request):
                 "methods": ["GET", "POST"],
                 "description": "Create and list log entries with anomaly detection"
             },
+            "bulk_logs": {
+                "url": "/api/logs/bulk/",
+                "methods": ["POST"],
+                "description": "Ingest a JSON array or NDJSON body of log entries in one request"
+            },
+            "bulk_logs_async": {
+                "url": "/api/logs/bulk/async/",
+                "methods": ["POST"],
+                "description": "Bulk ingestion as a native async view, for ASGI deployments"
+            },
+            "similar_logs": {
+                "url": "/api/logs/{id}/similar/",
+                "methods": ["GET"],
+                "description": "Log entries with the most similar message embeddings"
+            },
             "dashboard": {
                 "url": "/api/dashboard/",
                 "methods": ["GET"],
@@ -42,6 +58,21 @@ def api_index(request):
                 "methods": ["GET"],
                 "description": "Monitor Celery task progress"
             },
+            "inference_stats": {
+                "url": "/api/inference-stats/",
+                "methods": ["GET"],
+                "description": "Anomaly classifier load time and memory of an analysis worker"
+            },
+            "ingest_buffer": {
+                "url": "/api/ingest-buffer/",
+                "methods": ["GET"],
+                "description": "Write-behind buffer depth, flush latency and replays"
+            },
+            "health": {
+                "url": "/api/health/",
+                "methods": ["GET"],
+                "description": "Readiness of the warmed-up analysis workers (503 until ready)"
+            },
             "token": {
                 "url": "/api/token/",
                 "methods": ["POST"],
@@ -58,6 +89,9 @@ urlpatterns = [
 
     # Core endpoints
     path('logs/', LogEntryListCreate.as_view(), name='log-entry-list-create'),
+    path('logs/bulk/', bulk_ingest, name='log-entry-bulk'),
+    path('logs/bulk/async/', bulk_ingest_async, name='log-entry-bulk-async'),
+    path('logs/<int:log_id>/similar/', similar_logs, name='similar-logs'),
     path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
 
@@ -69,4 +103,7 @@ urlpatterns = [
     path('pattern-analysis/', trigger_pattern_analysis, name='pattern-analysis'),
     path('real-time-analysis/', real_time_stream_analysis, name='real-time-analysis'),
     path('dashboard/', anomaly_dashboard, name='anomaly-dashboard'),
+    path('inference-stats/', inference_stats, name='inference-stats'),
+    path('ingest-buffer/', ingest_buffer_stats, name='ingest-buffer'),
+    path('health/', health, name='health'),
 ]
\ No newline at end of file
@@ -1,8 +1,20 @@
 import hmac
 import hashlib
 import base64
-from transformers import BertTokenizer, BertForSequenceClassification
-import torch
+import logging
+import time
+from django.conf import settings
+from . import metrics
+from .cascade import TIER0_VERSION, run_tier0
+from .early_exit import get_early_exit_policy
+from .inference import get_engine, predict_tagged
+from .inference_server import InferenceServerError, get_client
+from .model_registry import get_registry
+from .rules import apply_rules
+from .truncation import get_truncation_policy
+from .verdict_cache import fingerprint, get_verdict_cache
+
+logger = logging.getLogger(__name__)
 
 # HMAC Functions
 def generate_hmac(secret_key, message):
@@ -13,24 +25,128 @@ def verify_hmac(secret_key, message, signature):
     expected_signature = generate_hmac(secret_key, message)
     return hmac.compare_digest(expected_signature, signature)
 
-# BERT Model Setup
-tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
-model = BertForSequenceClassification.from_pretrained('bert-base-uncased', num_labels=2)
-
 # Preprocess Log Message
-def preprocess_log(log_message):
-    inputs = tokenizer(log_message, return_tensors='pt', truncation=True, padding=True, max_length=512)
-    return inputs
+def preprocess_log(log_message, severity=None):
+    tokenizer, _ = get_registry().get()
+    encodings = get_truncation_policy().encode(tokenizer, [log_message], [severity])
+    return tokenizer.pad(encodings, return_tensors='pt')
 
 # Analyze Log Function
-def analyze_log(log_message):
-    inputs = preprocess_log(log_message)
-    
-    with torch.no_grad():
-        outputs = model(**inputs)
-    
-    logits = outputs.logits
-    predicted_class = torch.argmax(logits, dim=-1).item()
-    
-    return predicted_class
+def analyze_log(log_message, severity=None):
+    return analyze_logs([log_message], [severity])[0]
+
+# Run BERT: through the node's inference server when one is configured,
+# otherwise (or when it fails) in this process. Returns (probability,
+# model_version) pairs.
+def predict_tier1(log_messages, severities):
+    client = get_client()
+    if client is not None:
+        start = time.perf_counter()
+        try:
+            predictions = client.predict(log_messages, severities)
+            metrics.histogram('inference.remote_seconds').observe(time.perf_counter() - start)
+            return predictions
+        except (OSError, InferenceServerError) as exc:
+            metrics.counter('inference.remote_failures').inc()
+            if not getattr(settings, 'ANOMALY_INFERENCE_SOCKET_FALLBACK', True):
+                raise
+            logger.warning(f"Inference server unavailable, classifying in process: {str(exc)}")
+
+    if getattr(settings, 'ANOMALY_BATCHING_ENABLED', True):
+        return get_engine().predict(log_messages, severities)
+    return predict_tagged(log_messages, severities)
+
+# Version of the model that classifies this process's messages, which keys
+# its verdict cache lookups. With an inference server, that is the server's
+# model, which follows reload_model on its own.
+def serving_version():
+    client = get_client()
+    if client is not None:
+        try:
+            return client.model_version()
+        except (OSError, InferenceServerError) as exc:
+            logger.warning(f"Could not ask the inference server for its model version: {str(exc)}")
+    return get_registry().version
+
+# Verdict cache variant of each message: the same template is truncated to
+# its severity's token budget, and under early exit the severity's threshold
+# decides where it leaves the encoder
+def cache_variants(severities, model_version):
+    truncation = get_truncation_policy()
+    early_exit = get_early_exit_policy() if ':exit-' in model_version else None
+    return [
+        f'b{truncation.budget(severity)}' + (f':x{early_exit.threshold(severity)}' if early_exit else '')
+        for severity in severities
+    ]
+
+# Analyze Several Log Messages: operator rules, the verdict cache, then the
+# tier-0 scorer, then BERT batched together with concurrent callers, each
+# distinct message once. Each verdict is returned as (probability,
+# model_version), the version being 'rule:<name>' for messages a rule
+# decided and 'tier0' for messages the tier-0 scorer decided.
+def analyze_logs_tagged(log_messages, severities=None):
+    log_messages = list(log_messages)
+    severities = list(severities) if severities is not None else [None] * len(log_messages)
+    cache_enabled = getattr(settings, 'ANOMALY_VERDICT_CACHE_ENABLED', True)
+    signature = get_truncation_policy().signature
+
+    verdicts = apply_rules(log_messages)
+    pending = [index for index in range(len(log_messages)) if index not in verdicts]
+    if cache_enabled and pending:
+        model_version = serving_version()
+        cached = get_verdict_cache().get_many(
+            [log_messages[index] for index in pending],
+            f'{model_version}:{signature}',
+            cache_variants([severities[index] for index in pending], model_version),
+        )
+        verdicts.update((pending[position], (verdict, model_version)) for position, verdict in cached.items())
+        pending = [index for index in pending if index not in verdicts]
+
+    # Repeats within the batch are scored once and share the first one's
+    # verdict. With the cache on, that is any message of the same template
+    # and severity, as the cache would have answered for them anyway
+    first_of = {}
+    repeats = {}
+    for index in pending:
+        message = fingerprint(log_messages[index]) if cache_enabled else log_messages[index]
+        first = first_of.setdefault((message, severities[index]), index)
+        if first != index:
+            repeats[index] = first
+    if repeats:
+        metrics.counter('cascade.batch_repeats').inc(len(repeats))
+        pending = [index for index in pending if index not in repeats]
+
+    decided, uncertain = run_tier0(
+        [log_messages[index] for index in pending], [severities[index] for index in pending]
+    )
+    verdicts.update((pending[position], (verdict, TIER0_VERSION)) for position, verdict in decided.items())
+    pending = [pending[position] for position in uncertain]
+
+    if pending:
+        pending_messages = [log_messages[index] for index in pending]
+        pending_severities = [severities[index] for index in pending]
+        start = time.perf_counter()
+        predictions = predict_tier1(pending_messages, pending_severities)
+        metrics.histogram('cascade.tier1_seconds').observe(time.perf_counter() - start)
+        metrics.counter('cascade.tier1_messages').inc(len(pending))
+        verdicts.update(zip(pending, predictions))
+        if cache_enabled:
+            # A hot reload can land between batches, so cache each verdict
+            # under the version that produced it
+            by_version = {}
+            for message, severity, (verdict, version) in zip(pending_messages, pending_severities, predictions):
+                by_version.setdefault(version, ([], [], []))
+                by_version[version][0].append(message)
+                by_version[version][1].append(verdict)
+                by_version[version][2].append(severity)
+            for version, (messages, version_verdicts, version_severities) in by_version.items():
+                get_verdict_cache().set_many(
+                    messages, version_verdicts, f'{version}:{signature}', cache_variants(version_severities, version)
+                )
+
+    verdicts.update((index, verdicts[first]) for index, first in repeats.items())
+    return [verdicts[index] for index in range(len(log_messages))]
 
+# Analyze Several Log Messages, returning only the anomaly probabilities
+def analyze_logs(log_messages, severities=None):
+    return [probability for probability, _ in analyze_logs_tagged(log_messages, severities)]
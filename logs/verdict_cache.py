@@ -0,0 +1,179 @@
+"""
+Verdict cache in front of the anomaly classifier.
+
+Production logs repeat the same message templates with different IDs,
+timestamps and counters. Messages are keyed by a fingerprint of their
+normalized text (UUIDs, IP addresses, hex values and numbers masked), so
+every instance of a template reuses the first verdict.
+
+Two tiers are consulted in order: a bounded in-process LRU and, when
+``ANOMALY_VERDICT_CACHE_ALIAS`` names a Django cache, a shared tier. Both
+expire entries after ``ANOMALY_VERDICT_CACHE_TTL`` seconds, and keys embed
+the model version, so a new model never reads an old model's verdicts.
+An old model's entries are left to age out rather than dropped at once:
+during a hot reload, or while the inference server and the in-process
+fallback take turns, two versions serve side by side. A
+per-message variant (the severity's token budget, say) keeps apart verdicts
+of one template that the model sees differently.
+"""
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+# Order matters: UUIDs and IPs contain hex digits and numbers
+MASKS = [
+    (re.compile(r'\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b'), '<UUID>'),
+    (re.compile(r'\b(?:\d{1,3}\.){3}\d{1,3}(?::\d+)?\b'), '<IP>'),
+    (re.compile(r'\b(?:[0-9a-fA-F]{1,4}:){2,7}[0-9a-fA-F]{1,4}\b'), '<IP>'),
+    (re.compile(r'\b0[xX][0-9a-fA-F]+\b'), '<HEX>'),
+    (re.compile(r'\b(?=[0-9a-fA-F]*\d)(?=[0-9a-fA-F]*[a-fA-F])[0-9a-fA-F]{8,}\b'), '<HEX>'),
+    (re.compile(r'\d+(?:\.\d+)?'), '<NUM>'),
+]
+WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_message(message: str) -> str:
+    """Mask the variable parts of a log message, leaving its template."""
+    for pattern, token in MASKS:
+        message = pattern.sub(token, message)
+    return WHITESPACE.sub(' ', message).strip()
+
+
+def fingerprint(message: str) -> str:
+    """Return a compact fingerprint of a message's normalized template."""
+    return hashlib.blake2b(normalize_message(message).encode(), digest_size=16).hexdigest()
+
+
+class VerdictCache:
+    """
+    Two-tier verdict cache keyed by model version and message fingerprint.
+
+    Args:
+        max_size (int): Maximum entries in the in-process LRU tier
+        ttl (float): Seconds before an entry expires
+        shared_alias (str): Django cache alias for the shared tier, or None
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 3600, shared_alias: Optional[str] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared_alias = shared_alias
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        # Process-wide, so they show up in the inference stats' metrics
+        self.local_hits = metrics.counter('verdict_cache.local_hits')
+        self.shared_hits = metrics.counter('verdict_cache.shared_hits')
+        self.misses = metrics.counter('verdict_cache.misses')
+
+    def _key(self, model_version: str, message: str, variant: Optional[str] = None) -> str:
+        if variant is None:
+            return f'verdict:{model_version}:{fingerprint(message)}'
+        return f'verdict:{model_version}:{variant}:{fingerprint(message)}'
+
+    def get_many(self, messages: List[str], model_version: str,
+                 variants: Optional[List[str]] = None) -> Dict[int, Any]:
+        """
+        Look up cached verdicts.
+
+        Args:
+            variants (List[str]): Part of each message's key besides its
+                fingerprint, e.g. the token budget of its severity
+
+        Returns:
+            dict: Verdict per index into ``messages``, for cache hits only
+        """
+        variants = variants or [None] * len(messages)
+        keys = [self._key(model_version, message, variant) for message, variant in zip(messages, variants)]
+        found = {}
+        missing = {}
+        now = time.monotonic()
+
+        with self._lock:
+            for index, key in enumerate(keys):
+                entry = self._local.get(key)
+                if entry is not None and entry[1] > now:
+                    self._local.move_to_end(key)
+                    found[index] = entry[0]
+                else:
+                    if entry is not None:
+                        del self._local[key]
+                    missing.setdefault(key, []).append(index)
+
+        self.local_hits.inc(len(found))
+
+        if missing and self.shared_alias:
+            shared = caches[self.shared_alias].get_many(list(missing))
+            with self._lock:
+                for key, verdict in shared.items():
+                    for index in missing.pop(key):
+                        found[index] = verdict
+                        self.shared_hits.inc()
+                    self._store(key, verdict, now)
+
+        self.misses.inc(sum(len(indices) for indices in missing.values()))
+        return found
+
+    def set_many(self, messages: List[str], verdicts: List[Any], model_version: str,
+                 variants: Optional[List[str]] = None):
+        """Store verdicts for messages in both tiers."""
+        variants = variants or [None] * len(messages)
+        entries = {
+            self._key(model_version, message, variant): verdict
+            for message, verdict, variant in zip(messages, verdicts, variants)
+        }
+        now = time.monotonic()
+
+        with self._lock:
+            for key, verdict in entries.items():
+                self._store(key, verdict, now)
+
+        if self.shared_alias and entries:
+            caches[self.shared_alias].set_many(entries, timeout=self.ttl)
+
+    def _store(self, key: str, verdict: Any, now: float):
+        self._local[key] = (verdict, now + self.ttl)
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_size:
+            self._local.popitem(last=False)
+
+    def clear(self):
+        """Drop the in-process tier."""
+        with self._lock:
+            self._local.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.local_hits.value + self.shared_hits.value + self.misses.value
+        hits = self.local_hits.value + self.shared_hits.value
+        return {
+            'size': len(self._local),
+            'local_hits': self.local_hits.value,
+            'shared_hits': self.shared_hits.value,
+            'misses': self.misses.value,
+            'hit_rate': hits / lookups if lookups else None,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_verdict_cache() -> VerdictCache:
+    """Return the process-wide verdict cache, creating it from settings."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = VerdictCache(
+                    max_size=getattr(settings, 'ANOMALY_VERDICT_CACHE_SIZE', 10000),
+                    ttl=getattr(settings, 'ANOMALY_VERDICT_CACHE_TTL', 3600),
+                    shared_alias=getattr(settings, 'ANOMALY_VERDICT_CACHE_ALIAS', None),
+                )
+    return _cache
@@ -7,8 +7,14 @@ from .models import LogEntry, AnomalyReport
 from .serializers import LogEntrySerializer
 from .utils import verify_hmac
 from .tasks import process_log_entry_async, send_notification_async
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.settings import api_settings
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+import asyncio
 import json
 
 class LogEntryListCreate(generics.ListCreateAPIView):
@@ -32,23 +38,121 @@ class LogEntryListCreate(generics.ListCreateAPIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        # Validate the parsed body directly rather than through the serializer
+        from .validation import represent_log_entry, validate_log_entry
+        if log_data is None:
+            raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: ['No data provided']}, code='null')
+        validated = validate_log_entry(log_data)
+
+        from .ingest_buffer import get_ingest_buffer, write_behind_enabled
+        if write_behind_enabled():
+            # Acknowledge once buffered; the flusher stores and analyzes it
+            get_ingest_buffer().append([validated])
+            response_data = represent_log_entry(LogEntry(**validated))
+            return Response({**response_data, 'status': 'buffered'}, status=status.HTTP_202_ACCEPTED)
+
         # Create the log entry synchronously for immediate response
-        response = super().create(request, *args, **kwargs)
+        log_entry = LogEntry.objects.create(**validated)
+        response_data = represent_log_entry(log_entry)
+
+        # Start async processing for anomaly detection
+        from .tasks import analyze_log_async
+        analysis_task = analyze_log_async.delay(log_entry.message, log_entry.id)
 
-        if response.status_code == status.HTTP_201_CREATED:
-            # Get the created log entry ID
-            log_entry_id = response.data.get('id')
-            log_message = log_data.get('message', '')
+        # Add task ID to response for tracking
+        response_data['analysis_task_id'] = analysis_task.id
+        response_data['status'] = 'processing'
 
-            # Start async processing for anomaly detection
-            from .tasks import analyze_log_async, send_notification_async
-            analysis_task = analyze_log_async.delay(log_message, log_entry_id)
+        return Response(response_data, status=status.HTTP_201_CREATED)
 
-            # Add task ID to response for tracking
-            response.data['analysis_task_id'] = analysis_task.id
-            response.data['status'] = 'processing'
 
-        return response
+def _bulk_status(result):
+    if not result['accepted']:
+        return status.HTTP_400_BAD_REQUEST
+    if result['rejected']:
+        return status.HTTP_207_MULTI_STATUS
+    if result['status'] == 'buffered':
+        return status.HTTP_202_ACCEPTED
+    return status.HTTP_201_CREATED
+
+
+@api_view(['POST'])
+def bulk_ingest(request):
+    """
+    Store many log entries at once and queue their analysis in a few batched tasks.
+
+    The body is a JSON array of log entries, or NDJSON (one entry per line)
+    with ``Content-Type: application/x-ndjson``, which is streamed and
+    stored as it is read. Answers 201 when every entry was stored (202 when
+    buffered for write-behind), 207 when only some were, and 400 when none
+    was.
+    """
+    from .ingest import BulkIngestError, BulkSignatureError, ingest, ingest_stream, is_ndjson
+
+    hmac_signature = request.headers.get('X-HMAC-Signature')
+    try:
+        if is_ndjson(request.content_type):
+            # Read in chunks straight from the request, never as a whole
+            stream = request.stream
+            if stream is None:
+                raise BulkIngestError('No log entries provided')
+            result = ingest_stream(stream, hmac_signature)
+        else:
+            body = request.body
+            if hmac_signature and not verify_hmac(settings.SECRET_KEY, body.decode('utf-8', 'replace'), hmac_signature):
+                raise PermissionDenied("Invalid HMAC signature")
+            result = ingest(body)
+    except BulkSignatureError:
+        raise PermissionDenied("Invalid HMAC signature")
+    except BulkIngestError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except PermissionDenied:
+        raise
+    except Exception as e:
+        return Response(
+            {'error': f'Error ingesting log entries: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+    return Response(result, status=_bulk_status(result))
+
+
+@csrf_exempt
+@require_POST
+async def bulk_ingest_async(request):
+    """
+    ``bulk_ingest`` as a native async view, for ASGI deployments.
+
+    Inserts go through the async ORM and tasks are published from a thread,
+    so the event loop keeps serving other requests meanwhile. Under WSGI it
+    works too, but every request still holds a worker thread.
+    """
+    from .ingest import BulkIngestError, BulkSignatureError, aingest, aingest_stream, ingest_stream, is_ndjson
+
+    hmac_signature = request.headers.get('X-HMAC-Signature')
+    try:
+        if is_ndjson(request.content_type):
+            if hmac_signature:
+                # The body is copied aside and verified first, which is blocking file I/O
+                result = await sync_to_async(ingest_stream)(request, hmac_signature)
+            else:
+                result = await aingest_stream(request)
+        else:
+            # The spooled body may have to be read back from disk
+            body = await asyncio.to_thread(lambda: request.body)
+            if hmac_signature and not verify_hmac(settings.SECRET_KEY, body.decode('utf-8', 'replace'), hmac_signature):
+                raise BulkSignatureError('Invalid HMAC signature')
+            result = await aingest(body)
+    except BulkSignatureError:
+        return JsonResponse({'detail': 'Invalid HMAC signature'}, status=status.HTTP_403_FORBIDDEN)
+    except BulkIngestError as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return JsonResponse(
+            {'error': f'Error ingesting log entries: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+    return JsonResponse(result, status=_bulk_status(result))
 
 
 @api_view(['GET'])
@@ -185,7 +289,18 @@ def real_time_stream_analysis(request):
 def anomaly_dashboard(request):
     """
     Get dashboard data for anomaly monitoring.
+
+    ``?threshold=`` sets the anomaly probability counted as anomalous
+    (defaults to ANOMALY_ALERT_THRESHOLD).
     """
+    try:
+        threshold = float(request.query_params.get('threshold', settings.ANOMALY_ALERT_THRESHOLD))
+    except ValueError:
+        return Response(
+            {'error': 'threshold must be a number'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
     try:
         # Get recent statistics
         last_24h = timezone.now() - timezone.timedelta(hours=24)
@@ -200,6 +315,11 @@ def anomaly_dashboard(request):
             log_entry__timestamp__gte=last_7d
         ).count()
 
+        # Entries at or above the probability threshold
+        anomalous_logs_24h = LogEntry.objects.filter(
+            timestamp__gte=last_24h, anomaly_probability__gte=threshold
+        ).count()
+
         # Get severity distribution for last 24h
         from django.db.models import Count
         severity_stats = LogEntry.objects.filter(
@@ -211,6 +331,13 @@ def anomaly_dashboard(request):
             log_entry__timestamp__gte=last_24h
         ).order_by('-log_entry__timestamp')[:10]
 
+        # Most frequent message templates over the last 24h
+        top_templates = LogEntry.objects.filter(
+            timestamp__gte=last_24h, template__isnull=False
+        ).values('template_id', 'template__template').annotate(
+            count=Count('id')
+        ).order_by('-count')[:10]
+
         recent_anomalies_data = []
         for anomaly in recent_anomalies:
             recent_anomalies_data.append({
@@ -225,7 +352,13 @@ def anomaly_dashboard(request):
         dashboard_data = {
             'anomalies_last_24h': anomalies_24h,
             'anomalies_last_7d': anomalies_7d,
+            'alert_threshold': threshold,
+            'anomalous_logs_last_24h': anomalous_logs_24h,
             'severity_distribution_24h': {item['severity']: item['count'] for item in severity_stats},
+            'top_templates_24h': [
+                {'template_id': item['template_id'], 'template': item['template__template'], 'count': item['count']}
+                for item in top_templates
+            ],
             'recent_anomalies': recent_anomalies_data,
             'last_updated': timezone.now().isoformat()
         }
@@ -236,4 +369,97 @@ def anomaly_dashboard(request):
         return Response(
             {'error': f'Error retrieving dashboard data: {str(e)}'},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
\ No newline at end of file
+        )
+
+@api_view(['GET'])
+def inference_stats(request):
+    """
+    Ask an analysis worker to report its anomaly classifier statistics.
+    """
+    try:
+        from .tasks import get_inference_stats
+        task = get_inference_stats.delay()
+
+        return Response({
+            'message': 'Inference stats requested from an analysis worker',
+            'task_id': task.id
+        })
+
+    except Exception as e:
+        return Response(
+            {'error': f'Error requesting inference stats: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+@api_view(['GET'])
+def ingest_buffer_stats(request):
+    """
+    Report the write-behind buffer depth and the most recent flushes.
+    """
+    from .ingest_buffer import buffer_stats, write_behind_enabled
+
+    try:
+        report = buffer_stats()
+    except Exception as e:
+        return Response(
+            {'error': f'Error reading the ingest buffer: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+    return Response({'write_behind': write_behind_enabled(), **report})
+
+@api_view(['GET'])
+def health(request):
+    """
+    Report whether warmed-up workers are consuming every inference queue.
+
+    Answers 200 when they are and 503 otherwise, with the readiness entry
+    (model version, warm-up timings) of each worker.
+    """
+    from .readiness import readiness_report
+
+    try:
+        report = readiness_report()
+    except Exception as e:
+        return Response(
+            {'ready': False, 'error': f'Error reading worker readiness: {str(e)}'},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+    return Response(report, status=status.HTTP_200_OK if report['ready'] else status.HTTP_503_SERVICE_UNAVAILABLE)
+
+@api_view(['GET'])
+def similar_logs(request, log_id):
+    """
+    List the log entries whose message embedding is closest to a given entry's.
+
+    Query parameters: ``limit`` (default 10, at most ``ANOMALY_SIMILAR_LOGS_MAX``).
+    """
+    from .embeddings import similar_logs as find_similar_logs
+    from .models import LogEmbedding
+
+    try:
+        limit = int(request.query_params.get('limit', 10))
+    except ValueError:
+        return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+    if not 1 <= limit <= getattr(settings, 'ANOMALY_SIMILAR_LOGS_MAX', 100):
+        return Response(
+            {'error': f"limit must be between 1 and {getattr(settings, 'ANOMALY_SIMILAR_LOGS_MAX', 100)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    if not LogEntry.objects.filter(id=log_id).exists():
+        return Response({'error': f'Log entry {log_id} not found'}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        matches = find_similar_logs(log_id, limit)
+    except LogEmbedding.DoesNotExist:
+        return Response(
+            {'error': f'Log entry {log_id} has no embedding yet (ANOMALY_EMBEDDINGS_ENABLED)'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+
+    return Response({
+        'log_entry_id': log_id,
+        'results': [
+            dict(LogEntrySerializer(log_entry).data, similarity=similarity)
+            for log_entry, similarity in matches
+        ],
+    })
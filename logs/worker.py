@@ -0,0 +1,260 @@
+"""
+Celery worker lifecycle hooks for the anomaly classifier.
+
+Only workers that consume one of ``settings.ANOMALY_INFERENCE_QUEUES`` load
+the model; they do it once per pool process, before the process starts
+taking tasks, and release it on shutdown. Their cores are split between
+pool processes and torch threads by ``logs.thread_budget``.
+
+With ``ANOMALY_MODEL_PRELOAD_IN_PARENT`` a prefork worker loads the model
+once in the main process instead, before the pool forks, and the children
+share its weight pages copy-on-write.
+
+Workers do not load the model at all when ``ANOMALY_INFERENCE_SOCKET`` points
+them at the node's inference server.
+
+Once warmed up and consuming, the worker publishes its readiness (see
+``logs.readiness``).
+
+With ``ANOMALY_MODEL_ROOT``, the ``reload_model`` broadcast (sent by
+``python manage.py reload_model``) switches the worker to another model
+version without a restart: the main process stores the version in shared
+memory, and every process holding the model picks it up and hot-swaps it
+(see ``logs.model_reload``).
+"""
+import gc
+import logging
+import multiprocessing
+import os
+import time
+
+from celery.signals import (
+    worker_init, worker_process_init, worker_process_shutdown, worker_ready, worker_shutdown
+)
+from celery.worker.control import control_command
+from django.conf import settings
+
+from . import model_reload, readiness
+from .model_registry import get_registry, process_memory
+from .model_versions import current_version, list_versions, model_root
+from .thread_budget import apply_thread_budget, export_thread_env, plan_threads
+
+logger = logging.getLogger(__name__)
+
+# Set in the worker main process before the pool forks, inherited by children
+INFERENCE_WORKER = False
+THREAD_BUDGET = None
+HOSTNAME = None
+INFERENCE_QUEUES = []
+BOOT_STARTED = None
+BOOT_SECONDS = None
+# Model version requested by the last reload_model broadcast, shared with
+# the pool processes
+RELOAD_REQUEST = None
+RELOAD_REQUEST_BYTES = 256
+
+# Warm-up statistics kept in each process's readiness entry
+WARMUP_FIELDS = ('model_version', 'load_time', 'verify_time', 'warmup_time', 'warmup_rounds', 'inherited')
+
+
+def _consumed_queues(worker):
+    consume_from = worker.app.amqp.queues.consume_from
+    return set(consume_from.keys()) if consume_from else set()
+
+
+def _uses_prefork_pool(worker):
+    return 'prefork' in str(worker.pool_cls)
+
+
+def _apply_thread_budget():
+    if THREAD_BUDGET is None:
+        return
+    try:
+        threads = apply_thread_budget(THREAD_BUDGET)
+        logger.info(f"torch threads in this process: {threads}")
+    except Exception as exc:
+        logger.error(f"Could not apply the CPU thread budget: {str(exc)}")
+
+
+def _preload_in_parent():
+    try:
+        import torch
+
+        # Keep torch's thread pools from starting before the fork; each child
+        # applies its own thread budget afterwards
+        torch.set_num_threads(1)
+        get_registry().get()
+        # Move the objects created so far out of the collector's reach, so
+        # collections in the children do not write to (and copy) their pages
+        gc.freeze()
+        memory = process_memory()
+        logger.info(
+            f"Loaded the anomaly classifier before forking the pool "
+            f"(RSS {memory['rss'] / 2**20:.0f} MiB), children will share its weights"
+        )
+    except Exception as exc:
+        # Children fall back to loading their own copy
+        logger.error(f"Anomaly classifier preload failed: {str(exc)}")
+
+
+def _warm_up():
+    if not getattr(settings, 'ANOMALY_MODEL_WARMUP_ON_BOOT', True):
+        return
+    try:
+        stats = get_registry().warm_up(
+            getattr(settings, 'ANOMALY_WARMUP_MESSAGES', None),
+            rounds=getattr(settings, 'ANOMALY_WARMUP_ROUNDS', 1),
+        )
+        logger.info(f"Inference worker ready: {stats}")
+    except Exception as exc:
+        # Fall back to lazy loading on the first task
+        logger.error(f"Anomaly classifier warm-up failed: {str(exc)}")
+        return
+    _record_warmup(stats)
+
+
+def _record_warmup(stats):
+    try:
+        readiness.record_warmup(HOSTNAME, os.getpid(), {field: stats.get(field) for field in WARMUP_FIELDS})
+    except Exception as exc:
+        logger.error(f"Could not record warm-up timings: {str(exc)}")
+
+
+def _watch_reload_requests():
+    if RELOAD_REQUEST is None:
+        return
+    reloader = model_reload.ModelReloader(
+        getattr(settings, 'ANOMALY_WARMUP_MESSAGES', None),
+        warmup_rounds=getattr(settings, 'ANOMALY_WARMUP_ROUNDS', 1),
+        on_swap=_record_warmup,
+    )
+    model_reload.watch(
+        reloader,
+        lambda: RELOAD_REQUEST.value.decode() or None,
+        interval=getattr(settings, 'ANOMALY_MODEL_RELOAD_POLL', 1.0),
+    )
+
+
+def _publish_readiness(consumer):
+    global BOOT_SECONDS
+    pool_info = consumer.pool.info if consumer.pool else {}
+    processes = pool_info.get('processes') or [os.getpid()]
+    warming_up = INFERENCE_WORKER and getattr(settings, 'ANOMALY_MODEL_WARMUP_ON_BOOT', True)
+    try:
+        warmups = readiness.collect_warmups(HOSTNAME, processes) if warming_up else {}
+        # Differs between processes while a hot reload is rolling through the pool
+        versions = sorted({stats.get('model_version') for stats in warmups.values()} - {None})
+        info = {
+            'model_version': ', '.join(versions) or get_registry().version,
+            'queues': INFERENCE_QUEUES,
+            'concurrency': pool_info.get('max-concurrency', 1),
+            # Pool children only take tasks once their warm-up is done
+            'warmed_up': not warming_up or len(warmups) >= len(processes),
+            'inference_server': getattr(settings, 'ANOMALY_INFERENCE_SOCKET', None),
+            'warmups': warmups,
+        }
+        if info['warmed_up'] and BOOT_SECONDS is None:
+            BOOT_SECONDS = time.perf_counter() - BOOT_STARTED
+            logger.info(f"Inference worker {HOSTNAME} warmed up {BOOT_SECONDS:.2f}s after boot")
+        info['boot_seconds'] = BOOT_SECONDS
+        readiness.publish_ready(HOSTNAME, info)
+    except Exception as exc:
+        logger.error(f"Could not publish worker readiness: {str(exc)}")
+
+
+@worker_init.connect
+def configure_inference_worker(sender=None, **kwargs):
+    """Decide whether this worker runs inference, based on its queues, and plan its CPU budget."""
+    global INFERENCE_WORKER, THREAD_BUDGET, HOSTNAME, INFERENCE_QUEUES, BOOT_STARTED, RELOAD_REQUEST
+    BOOT_STARTED = time.perf_counter()
+    HOSTNAME = sender.hostname
+    inference_queues = set(getattr(settings, 'ANOMALY_INFERENCE_QUEUES', []))
+    INFERENCE_QUEUES = sorted(_consumed_queues(sender) & inference_queues)
+    INFERENCE_WORKER = bool(INFERENCE_QUEUES)
+    if INFERENCE_WORKER and getattr(settings, 'ANOMALY_INFERENCE_SOCKET', None):
+        logger.info(f"Classifying through the inference server at {settings.ANOMALY_INFERENCE_SOCKET}")
+        INFERENCE_WORKER = False
+    logger.info(f"Inference worker: {INFERENCE_WORKER}")
+    prefork = _uses_prefork_pool(sender)
+
+    if INFERENCE_WORKER and getattr(settings, 'ANOMALY_THREAD_BUDGET_ENABLED', True):
+        # Thread pools share one torch runtime, so only prefork children count
+        THREAD_BUDGET = plan_threads(processes=sender.concurrency if prefork else 1)
+        export_thread_env(THREAD_BUDGET)
+        logger.info(f"CPU thread budget: {THREAD_BUDGET}")
+        if THREAD_BUDGET.oversubscribed:
+            logger.warning(
+                f"Worker concurrency {THREAD_BUDGET.processes} exceeds the {THREAD_BUDGET.cpus} available cpus; "
+                f"lower --concurrency to avoid contention"
+            )
+
+    if INFERENCE_WORKER and model_root():
+        # Created before the pool forks so every child sees the same memory
+        RELOAD_REQUEST = multiprocessing.Array('c', RELOAD_REQUEST_BYTES)
+
+    if INFERENCE_WORKER and prefork and getattr(settings, 'ANOMALY_MODEL_PRELOAD_IN_PARENT', False):
+        _preload_in_parent()
+
+    # Pools without child processes run tasks in this process
+    if INFERENCE_WORKER and not prefork:
+        _apply_thread_budget()
+        _warm_up()
+        _watch_reload_requests()
+
+
+@worker_process_init.connect
+def warm_up_pool_process(**kwargs):
+    """Apply the thread budget and load the classifier in each prefork child of an inference worker."""
+    if INFERENCE_WORKER:
+        _apply_thread_budget()
+        _warm_up()
+        _watch_reload_requests()
+
+
+@control_command(args=[('revision', str)], signature='[revision]')
+def reload_model(state, revision=None):
+    """Hot-swap the anomaly classifier to a model version (default: the CURRENT one)."""
+    if RELOAD_REQUEST is None:
+        return {'error': 'This worker holds no versioned anomaly classifier'}
+    root = model_root()
+    revision = revision or current_version(root)
+    if len(revision.encode()) >= RELOAD_REQUEST_BYTES:
+        return {'error': f'Model version names are limited to {RELOAD_REQUEST_BYTES - 1} bytes'}
+    if revision not in list_versions(root):
+        return {'error': f"Model version '{revision}' not found in {root}"}
+    RELOAD_REQUEST.value = revision.encode()
+    logger.info(f"Reloading the anomaly classifier with model version '{revision}'")
+    return {'ok': f"reloading model version '{revision}'"}
+
+
+@worker_ready.connect
+def announce_readiness(sender=None, **kwargs):
+    """
+    Publish the worker's readiness once it consumes, and keep it fresh.
+
+    The pool hands tasks to a prefork child only after its start-up hooks
+    (including the warm-up) return, so the entry stays ``warmed_up: False``
+    until every child has recorded its warm-up.
+    """
+    if not INFERENCE_QUEUES:
+        return
+    _publish_readiness(sender)
+    interval = getattr(settings, 'ANOMALY_READINESS_REFRESH', 5)
+    sender.timer.call_repeatedly(interval, _publish_readiness, (sender,))
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def unload_model(**kwargs):
+    """Release the classifier when a worker process exits."""
+    get_registry().unload()
+
+
+@worker_shutdown.connect
+def withdraw_readiness(**kwargs):
+    """Stop advertising the worker as ready."""
+    if INFERENCE_QUEUES:
+        try:
+            readiness.withdraw(HOSTNAME)
+        except Exception as exc:
+            logger.error(f"Could not withdraw worker readiness: {str(exc)}")